@@ -0,0 +1,231 @@
+import asyncio
+import logging
+import re
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, Optional, Tuple
+
+# Status codes meaning the provider is overloaded rather than the request being wrong
+CONGESTION_STATUSES = {408, 429, 500, 502, 503, 504, 529}
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def error_status(error: BaseException) -> Optional[int]:
+    """Return the HTTP status carried by an SDK or HTTP client exception, if any."""
+    for candidate in (
+        getattr(error, "status_code", None),
+        getattr(error, "code", None),
+        getattr(getattr(error, "response", None), "status_code", None),
+    ):
+        if isinstance(candidate, int):
+            return candidate
+    return None
+
+
+def error_headers(error: BaseException):
+    return getattr(getattr(error, "response", None), "headers", None)
+
+
+def parse_wait(value: str) -> Optional[float]:
+    """Seconds until a reset given as seconds, a duration ("6m0s"), an epoch or a date."""
+    value = str(value).strip()
+    now = time.time()
+    try:
+        number = float(value)
+    except ValueError:
+        pass
+    else:
+        if number > 1e12:  # epoch milliseconds
+            return max(number / 1000 - now, 0)
+        if number > 1e9:  # epoch seconds
+            return max(number - now, 0)
+        return max(number, 0)
+
+    parts = _DURATION_RE.findall(value)
+    if parts and "".join(n + u for n, u in parts) == value:
+        return sum(float(n) * _DURATION_UNITS[u] for n, u in parts)
+
+    for parse in (datetime.fromisoformat, parsedate_to_datetime):
+        try:
+            moment = parse(value.replace("Z", "+00:00"))
+        except (TypeError, ValueError):
+            continue
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=timezone.utc)
+        return max(moment.timestamp() - now, 0)
+    return None
+
+
+class AdaptiveConcurrency:
+    """AIMD limit on the requests in flight to one (provider, model).
+
+    Every success widens the window by 1/window, so it grows by about one slot per
+    window's worth of requests. A 429, 5xx or timeout halves it, once per round
+    trip: failures of requests sent before the last decrease are not counted
+    again. Rate-limit headers cap the window at the requests the provider says
+    remain, and an exhausted quota or a retry-after pauses new requests until
+    the reset.
+    """
+
+    def __init__(
+        self,
+        key: str,
+        initial_window: float = 4,
+        min_window: float = 1,
+        max_window: float = 32,
+        enabled: bool = True,
+    ):
+        self.key = key
+        self.window = float(initial_window)
+        self.min_window = float(min_window)
+        self.max_window = float(max_window)
+        self.enabled = enabled
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.on_change: Optional[Callable[[str, int, int], None]] = None
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def _try_take(self) -> Tuple[Optional[float], float]:
+        """Take a slot and return its start time, or None and how long to wait."""
+        now = time.monotonic()
+        if self.paused_until > now:
+            return None, self.paused_until - now
+        if not self.enabled or self.in_flight < int(self.window):
+            self.in_flight += 1
+            return now, 0.0
+        return None, 1.0
+
+    def acquire(self) -> float:
+        with self._condition:
+            while True:
+                started, wait = self._try_take()
+                if started is not None:
+                    return started
+                # Bounded so slots released by async callers are noticed too
+                self._condition.wait(min(wait, 1.0))
+
+    async def acquire_async(self) -> float:
+        while True:
+            with self._condition:
+                started, wait = self._try_take()
+            if started is not None:
+                return started
+            await asyncio.sleep(min(wait, 0.05))
+
+    def release(self, started: float, error: Optional[BaseException] = None) -> None:
+        with self._condition:
+            self.in_flight -= 1
+            if error is None:
+                self._resize(self.window + 1 / self.window)
+            elif self._is_congestion(error):
+                headers = error_headers(error)
+                if headers is not None:
+                    self.observe_headers(headers)
+                if started >= self._last_decrease:
+                    self._last_decrease = time.monotonic()
+                    self._resize(self.window / 2)
+            self._condition.notify_all()
+
+    @contextmanager
+    def slot(self):
+        started = self.acquire()
+        try:
+            yield
+        except BaseException as e:
+            self.release(started, e)
+            raise
+        self.release(started)
+
+    @asynccontextmanager
+    async def slot_async(self):
+        started = await self.acquire_async()
+        try:
+            yield
+        except BaseException as e:
+            self.release(started, e)
+            raise
+        self.release(started)
+
+    def observe_headers(self, headers) -> None:
+        """Apply x-ratelimit-*/anthropic-ratelimit-* and retry-after response headers."""
+        if headers is None:
+            return
+        remaining: Dict[str, int] = {}
+        resets: Dict[str, float] = {}
+        retry_after = None
+        for name, value in headers.items():
+            name = name.lower()
+            if name in ("retry-after", "retry-after-ms"):
+                wait = parse_wait(value)
+                if wait is not None and name == "retry-after-ms":
+                    wait /= 1000
+                retry_after = wait if retry_after is None else max(retry_after, wait or 0)
+            elif "ratelimit" in name:
+                kind = "tokens" if "token" in name else "requests"
+                if "remaining" in name:
+                    try:
+                        count = int(float(value))
+                    except ValueError:
+                        continue
+                    remaining[kind] = min(count, remaining.get(kind, count))
+                elif "reset" in name:
+                    wait = parse_wait(value)
+                    if wait is not None:
+                        resets[kind] = max(wait, resets.get(kind, 0))
+
+        with self._condition:
+            if "requests" in remaining and remaining["requests"] < self.window:
+                self._resize(remaining["requests"])
+            exhausted = [resets.get(kind, 1.0) for kind, count in remaining.items() if count <= 0]
+            pause = max(exhausted + ([retry_after] if retry_after else []), default=0)
+            if pause > 0:
+                self.paused_until = max(self.paused_until, time.monotonic() + pause)
+                logging.warning(f"Pausing requests to {self.key} for {pause:.1f}s (rate limited)")
+
+    @staticmethod
+    def _is_congestion(error: BaseException) -> bool:
+        if isinstance(error, TimeoutError) or "Timeout" in type(error).__name__:
+            return True
+        return error_status(error) in CONGESTION_STATUSES
+
+    def _resize(self, window: float) -> None:
+        if not self.enabled:
+            return
+        old = int(self.window)
+        self.window = min(max(float(window), self.min_window), self.max_window)
+        if int(self.window) != old:
+            logging.info(f"Concurrency window of {self.key}: {old} -> {int(self.window)}")
+            if self.on_change:
+                self.on_change(self.key, old, int(self.window))
+
+    def snapshot(self) -> dict:
+        return {
+            "window": int(self.window),
+            "in_flight": self.in_flight,
+            "paused_for": round(max(self.paused_until - time.monotonic(), 0), 1),
+        }
+
+
+_controllers: Dict[str, AdaptiveConcurrency] = {}
+_controllers_lock = threading.Lock()
+
+
+def controller_for(provider: Optional[str], model: str, **settings) -> AdaptiveConcurrency:
+    """Return the controller shared by every manager of (provider, model)."""
+    key = f"{provider}/{model}" if provider else model
+    with _controllers_lock:
+        if key not in _controllers:
+            _controllers[key] = AdaptiveConcurrency(key, **settings)
+        return _controllers[key]
+
+
+def concurrency_snapshot() -> Dict[str, dict]:
+    """Current window, in-flight count and pause of every controller, for monitoring."""
+    with _controllers_lock:
+        return {key: controller.snapshot() for key, controller in _controllers.items()}
@@ -1,21 +1,195 @@
-import logging
-import requests
-import subprocess
+import re
 import json
+import logging
 import time
-import getpass
-import ollama
-import anthropic
-import g4f
-
-from g4f.client import Client
-from google import genai
-from google.genai import types
-from huggingface_hub import InferenceClient
-from openai import OpenAI
-from mistralai import Mistral
+import threading
+
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+from adaptive_concurrency import controller_for
+from chunk_planner import SUMMARY_TOKENS, TOKENS_PER_WORD, estimate_tokens
+from http_transport import shared_client
+from loop_detector import RepetitionDetector
+from rate_limiter import RateLimiter
+from response_cache import ResponseCache
+from retry_policy import RetryBudget, RetryPolicy
+
+LMSTUDIO_BASE_URL = "http://127.0.0.1:1234/v1"
+LLAMACPP_BASE_URL = "http://127.0.0.1:8080/v1"
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+GLHF_BASE_URL = "https://glhf.chat/api/openai/v1"
+ALIBABA_BASE_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1"
+DEEPINFRA_BASE_URL = "https://api.deepinfra.com/v1/openai"
+ARLIAI_CHAT_URL = "https://api.arliai.com/v1/chat/completions"
+HYPERBOLIC_CHAT_URL = "https://api.hyperbolic.xyz/v1/chat/completions"
+
+
+# Provider SDKs are imported by the managers that use them, so that loading this
+# module (see providers.py) does not pay for every SDK on each launch.
+
+
+def gemini_safety_settings():
+    from google.genai import types
+
+    return [
+        types.SafetySetting(category=category, threshold="BLOCK_NONE")
+        for category in (
+            "HARM_CATEGORY_HATE_SPEECH",
+            "HARM_CATEGORY_HARASSMENT",
+            "HARM_CATEGORY_SEXUALLY_EXPLICIT",
+            "HARM_CATEGORY_DANGEROUS_CONTENT",
+            "HARM_CATEGORY_CIVIC_INTEGRITY",
+        )
+    ]
+
+
+def ollama_options(temperature: float, max_tokens: int, num_ctx: Optional[int]) -> dict:
+    options = {"temperature": temperature, "num_predict": max_tokens}
+    if num_ctx:
+        options["num_ctx"] = num_ctx  # as preloaded, or Ollama reloads the model
+    return options
+
+
+# Prompts open with their fixed instructions and end with the part that changes
+# the most, so consecutive requests share the longest possible prefix for the
+# providers' prompt caches. Previous summaries only ever grow at their end.
+CHUNK_INSTRUCTIONS = (
+    "Please summarize the content at the end of this message, maintaining continuity "
+    "with the previous summaries.\n"
+    "Make it around 300 words. DO NOT EXCEED THIS.\n"
+    "Provide a coherent narrative that captures the essence of this part of the story."
+)
+FINAL_SUMMARY_INSTRUCTIONS = (
+    "Based on the chunk summaries at the end of this message, create a comprehensive "
+    "summary of the entire book.\n"
+    "Your summary should provide an engaging overview of the plot from beginning to end."
+)
+CONDENSE_INSTRUCTIONS = (
+    "Condense the summary of a story so far at the end of this message.\n"
+    "Keep the main plot developments, character arcs and key events in chronological "
+    "order. Only provide the condensed summary."
+)
+SHORTEN_INSTRUCTIONS = (
+    "Shorten the summary at the end of this message, keeping its plot developments, "
+    "character arcs and key events in order. Only provide the shortened summary."
+)
+CONTENT_HEADER = "Content to summarize:\n"
+
+CHUNK_SUMMARY_TARGET_WORDS = 300
+CHUNK_SUMMARY_MIN_WORDS = 100
+CHUNK_SUMMARY_MAX_WORDS = 800  # around 1000 tokens
+
+_PARAGRAPH_RE = re.compile(r"(?<=\n\n)")
+
+
+def count_words(text: str) -> int:
+    """Words as the length checks count them, separated by single spaces"""
+    return len(text.split(" "))
+
+
+def collect_stream(
+    deltas: Iterable[str], max_words: Optional[int] = None, repetition_window: Optional[int] = None
+) -> str:
+    """Join streamed text, abandoning the stream once it runs past max_words or starts looping."""
+    parts = []
+    spaces = 0
+    detector = RepetitionDetector(repetition_window) if repetition_window else None
+    for delta in deltas:
+        parts.append(delta)
+        if detector:
+            cut = detector.feed(delta)
+            if cut is not None:
+                return "".join(parts)[:cut]
+        spaces += delta.count(" ")
+        if max_words and spaces >= max_words:
+            break
+    return "".join(parts)
+
+
+def iter_sse_deltas(lines: Iterable[str]) -> Iterator[str]:
+    """Content deltas of an OpenAI-style chat completion event stream."""
+    for line in lines:
+        if not line.startswith("data:"):
+            continue
+        data = line[len("data:") :].strip()
+        if data == "[DONE]":
+            return
+        choices = json.loads(data).get("choices") or []
+        content = choices and (choices[0].get("delta") or {}).get("content")
+        if content:
+            yield content
+
+
+def anthropic_text(completion) -> str:
+    return "".join(block.text for block in completion.content if block.type == "text")
+
+
+def anthropic_messages(prompt: str) -> list:
+    """User message for a prompt, with a cache breakpoint before the chunk content.
+
+    The part before the content is sent as one block per paragraph: as the
+    previous summaries grow, the breakpoint of the last request stays on a block
+    boundary within the lookback window, so its cached prefix is read back.
+    Prompts without chunk content are used once and not worth a cache write.
+    """
+    prefix, header, content = prompt.rpartition(CONTENT_HEADER)
+    if not header:
+        return [{"role": "user", "content": prompt}]
+    blocks = [{"type": "text", "text": part} for part in _PARAGRAPH_RE.split(prefix) if part]
+    blocks[-1]["cache_control"] = {"type": "ephemeral"}
+    blocks.append({"type": "text", "text": header + content})
+    return [{"role": "user", "content": blocks}]
+
+
+class PromptCacheStats:
+    """Prompt tokens sent and how many of them were read from the provider's prompt cache."""
+
+    def __init__(self):
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self._lock = threading.Lock()
+
+    def record(self, prompt_tokens: Optional[int], cached_tokens: Optional[int]) -> None:
+        with self._lock:
+            self.prompt_tokens += prompt_tokens or 0
+            self.cached_tokens += cached_tokens or 0
+
+    def record_openai(self, usage) -> None:
+        """Record the usage of an OpenAI-compatible chat completion."""
+        if usage is None:
+            return
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = getattr(details, "cached_tokens", None)
+        if cached is None:  # DeepSeek reports its cache hits separately
+            cached = getattr(usage, "prompt_cache_hit_tokens", None)
+        self.record(usage.prompt_tokens, cached)
+
+    def record_anthropic(self, usage) -> None:
+        read = getattr(usage, "cache_read_input_tokens", None) or 0
+        written = getattr(usage, "cache_creation_input_tokens", None) or 0
+        self.record(usage.input_tokens + read + written, read)
+
+    def record_gemini(self, usage_metadata) -> None:
+        if usage_metadata is None:
+            return
+        self.record(
+            usage_metadata.prompt_token_count,
+            getattr(usage_metadata, "cached_content_token_count", None),
+        )
+
+    def summary(self) -> str:
+        share = self.cached_tokens / self.prompt_tokens * 100 if self.prompt_tokens else 0
+        return (
+            f"{self.cached_tokens:,} of {self.prompt_tokens:,} prompt tokens "
+            f"read from the provider's prompt cache ({share:.0f}%)"
+        )
+
 
 class BaseManager:
+    # Cut responses off once their last this-many characters repeat earlier text,
+    # for models prone to getting stuck in a loop
+    repetition_window: Optional[int] = None
+
     def __init__(
         self,
         model: str,
@@ -23,353 +197,557 @@ class BaseManager:
         retries: int = 5,
         temperature: float = 0.2,
         system_message: str = "You are an expert literary analyst. Your task is to provide a detailed summary of the given text chunk, focusing on plot developments, character arcs, and key events. Ensure continuity with previous summaries if provided. Your summary should be comprehensive yet concise. Only provide the summary.",
+        provider: Optional[str] = None,
+        rate_limits: Optional[dict] = None,
+        concurrency: Optional[dict] = None,
+        retry: Optional[dict] = None,
+        response_cache: Optional[dict] = None,
     ):
         self.model = model
         self.max_tokens = max_tokens
         self.retries = retries
         self.temperature = temperature
         self.system_message = system_message
+        self.max_output_tokens = 4096  # cap of responses without a word limit
         self.last_request_time = 0
         self.min_request_interval = 1.0  # seconds
+        self._rate_limit_lock = threading.Lock()
+        # rpm/tpm/rpd/tpd from the model's config entry, shared across threads and processes
+        self.rate_limiter = (
+            RateLimiter.from_model_info(provider, {**rate_limits, "name": model})
+            if provider and rate_limits
+            else None
+        )
+        # AIMD window on the requests in flight, shared by all managers of the model
+        self.concurrency = controller_for(provider, model, **(concurrency or {}))
+        # Retry loop of every request, with the run's retry budget and circuit breaker
+        self.retry_policy = RetryPolicy(
+            f"{provider}/{model}" if provider else model,
+            **{"max_attempts": retries, **(retry or {})},
+        )
+        self.provider = provider
+        # Accepted responses are reused for identical requests, e.g. when re-running a book
+        self.response_cache = ResponseCache.from_settings(response_cache)
+        self.prompt_cache_stats = PromptCacheStats()
+
+    def _messages(self, prompt: str) -> list:
+        return [
+            {"role": "system", "content": self.system_message},
+            {"role": "user", "content": prompt},
+        ]
+
+    def _estimated_request_tokens(self, prompt: str) -> int:
+        return estimate_tokens(self.system_message) + estimate_tokens(prompt) + SUMMARY_TOKENS
+
+    def _wait_for_rate_limit(self, prompt: str = ""):
+        """Wait for the model's rate limits, or a minimum time between requests without them"""
+        if self.rate_limiter:
+            self.rate_limiter.acquire(self._estimated_request_tokens(prompt))
+            return
+        with self._rate_limit_lock:
+            current_time = time.time()
+            time_since_last = current_time - self.last_request_time
+            if time_since_last < self.min_request_interval:
+                time.sleep(self.min_request_interval - time_since_last)
+            self.last_request_time = time.time()
+
+    def _max_output_tokens(self, max_words: Optional[int]) -> int:
+        """Output token cap for a response of at most max_words, with room for tokenizer variance"""
+        if not max_words:
+            return self.max_output_tokens
+        return min(self.max_output_tokens, int(max_words * TOKENS_PER_WORD * 1.5))
+
+    def _stream(self, prompt: str, max_tokens: int) -> Iterator[str]:
+        """Yield the text of the response to prompt as it is generated."""
+        raise NotImplementedError
+
+    def _generate_response(self, prompt: str, max_words: Optional[int] = None) -> str:
+        """Stream a response, abandoning it as soon as it runs past max_words."""
+        self._wait_for_rate_limit(prompt)
+        stream = self._stream(prompt, self._max_output_tokens(max_words))
+        try:
+            response = collect_stream(stream, max_words, self.repetition_window)
+        finally:
+            stream.close()
+        if not response:
+            raise ValueError("Empty response from the model")
+        return response
+
+    def _request(self, prompt: str, max_words: Optional[int] = None) -> str:
+        """Send one request within the model's adaptive concurrency window"""
+        with self.concurrency.slot():
+            return self._generate_response(prompt, max_words)
+
+    def _request_bounded(
+        self, prompt: str, max_words: Optional[int] = None, target_words: Optional[int] = None
+    ) -> str:
+        """Request a response of at most max_words, shortening an overlong one rather than regenerating it"""
+        response = self._request(prompt, max_words)
+        if max_words and target_words and count_words(response) > max_words:
+            logging.info(f"Response ran past {max_words} words, shortening it")
+            response = self._request(self._shorten_prompt(response, target_words), max_words)
+        return response
+
+    def _chunk_prompt(self, content: str, previous_summaries: str) -> str:
+        return (
+            f"{CHUNK_INSTRUCTIONS}\n\n"
+            f"Previous summaries:\n{previous_summaries.strip() or 'None'}\n\n"
+            f"{CONTENT_HEADER}{content}"
+        )
+
+    def _final_summary_prompt(self, summaries: str, title: str, author: str) -> str:
+        return (
+            f"{FINAL_SUMMARY_INSTRUCTIONS}\n\n"
+            f"Book title: {title}\nAuthor: {author}\n\n"
+            f"Chunk summaries:\n{summaries}"
+        )
+
+    def _condense_prompt(self, summaries: str, max_words: int) -> str:
+        return (
+            f"{CONDENSE_INSTRUCTIONS}\n"
+            f"Use at most {max_words} words.\n\n"
+            f"Story so far:\n{summaries}"
+        )
+
+    def _shorten_prompt(self, summary: str, max_words: int) -> str:
+        return (
+            f"{SHORTEN_INSTRUCTIONS}\n"
+            f"Use around {max_words} words.\n\n"
+            f"Summary:\n{summary}"
+        )
+
+    @staticmethod
+    def _check_chunk_summary(response: str) -> Optional[str]:
+        response_length = count_words(response)
+        if response_length > CHUNK_SUMMARY_MAX_WORDS:
+            return "summary is too long"
+        elif response_length < CHUNK_SUMMARY_MIN_WORDS:
+            return "summary is too short"
+        return None
+
+    @staticmethod
+    def _check_final_summary(response: str) -> Optional[str]:
+        if len(response) < 200:
+            return "final summary is too short"
+        return None
+
+    @staticmethod
+    def _condensed_length_check(max_words: int) -> Callable[[str], Optional[str]]:
+        def check(response: str) -> Optional[str]:
+            if len(response.split()) > max_words * 1.25:
+                return "synopsis is too long"
+            return None
+
+        return check
+
+    def _cache_key(self, prompt: str) -> Optional[str]:
+        if not self.response_cache:
+            return None
+        return ResponseCache.key(
+            self.provider, self.model, self.temperature, self.system_message, prompt
+        )
+
+    def _cached_response(self, cache_key: Optional[str], check: Callable[[str], Optional[str]]) -> str:
+        if not cache_key:
+            return ""
+        cached = self.response_cache.get(cache_key)
+        # Only accepted responses are stored, but the checks may have changed since
+        return cached if cached and not check(cached) else ""
 
-    def _wait_for_rate_limit(self):
-        """Ensure minimum time between API requests"""
-        current_time = time.time()
-        time_since_last = current_time - self.last_request_time
-        if time_since_last < self.min_request_interval:
-            time.sleep(self.min_request_interval - time_since_last)
-        self.last_request_time = time.time()
-
-    def summarize_chunk(self, content: str, previous_summaries: str) -> str:
-        prompt = f"""
-        Previous summaries: {previous_summaries if previous_summaries else 'None'}
-
-        Please summarize the following content, maintaining continuity with previous summaries:
-
-        {content}
-
-        Make it around 300 words. DO NOT EXCEED THIS.
-
-        Provide a coherent narrative that captures the essence of this part of the story.
-        """
-        for attempt in range(self.retries):
-            try:
-                response = self._generate_response(prompt)
-            except Exception as e:
-                logging.error(
-                    f"Error during summarization (attempt {attempt + 1}): {e}"
-                )
-                if attempt < self.retries - 1:
-                    time.sleep(2**attempt)  # Exponential backoff
-                else:
-                    logging.warning("Max retries reached. Skipping this chunk.")
-                    return ""
-            else:
-                response_length = len(response.split(" "))
-                if response_length > 800:  # around 1000 tokens
-                    logging.error(
-                        f"Error during summarization (attempt {attempt + 1}): summary is too long."
-                    )
-                    continue
-                elif response_length < 100:
-                    logging.error(
-                        f"Error during summarization (attempt {attempt + 1}): summary is too short."
-                    )
-                    continue
-                return response
-
-    def create_final_summary(self, summaries: str, title: str, author: str) -> str:
-        prompt = f"""
-        Based on the following chunk summaries, create a comprehensive summary of the entire book:
-
-        {summaries}
-
-        Your summary should provide an engaging overview of the plot from beginning to end.
-
-        Book title: {title}
-        Author: {author}
-        """
-        for attempt in range(self.retries):
-            try:
-                response = self._generate_response(prompt)
-            except Exception as e:
-                logging.error(
-                    f"Error during final summarization (attempt {attempt + 1}): {e}"
-                )
-                if attempt < self.retries - 1:
-                    time.sleep(2**attempt)
-                else:
-                    logging.warning(
-                        "Max retries reached. Skipping final summary creation."
-                    )
-                    return ""
-            else:
-                if len(response) < 200:
-                    logging.error(
-                        f"Error during summarization (attempt {attempt + 1}): final summary is too short."
-                    )
-                    continue
-                return response
+    def _cache_response(self, cache_key: Optional[str], response: str) -> None:
+        if cache_key and response:
+            self.response_cache.put(cache_key, response)
+
+    def _generate_validated(
+        self,
+        prompt: str,
+        check: Callable[[str], Optional[str]],
+        task: str,
+        give_up: str,
+        retry_budget: Optional[RetryBudget] = None,
+        max_words: Optional[int] = None,
+        target_words: Optional[int] = None,
+    ) -> str:
+        """Generate a response, retrying on errors and on responses check rejects."""
+        cache_key = self._cache_key(prompt)
+        cached = self._cached_response(cache_key, check)
+        if cached:
+            return cached
+        response = self.retry_policy.call(
+            lambda: self._request_bounded(prompt, max_words, target_words),
+            check,
+            task,
+            give_up,
+            retry_budget,
+        )
+        self._cache_response(cache_key, response)
+        return response
+
+    def summarize_chunk(
+        self, content: str, previous_summaries: str, retry_budget: Optional[RetryBudget] = None
+    ) -> str:
+        return self._generate_validated(
+            self._chunk_prompt(content, previous_summaries),
+            self._check_chunk_summary,
+            "summarization",
+            "Skipping this chunk.",
+            retry_budget,
+            max_words=CHUNK_SUMMARY_MAX_WORDS,
+            target_words=CHUNK_SUMMARY_TARGET_WORDS,
+        )
+
+    def create_final_summary(
+        self, summaries: str, title: str, author: str, retry_budget: Optional[RetryBudget] = None
+    ) -> str:
+        return self._generate_validated(
+            self._final_summary_prompt(summaries, title, author),
+            self._check_final_summary,
+            "final summarization",
+            "Skipping final summary creation.",
+            retry_budget,
+        )
+
+    def condense_summaries(
+        self, summaries: str, max_words: int, retry_budget: Optional[RetryBudget] = None
+    ) -> str:
+        return self._generate_validated(
+            self._condense_prompt(summaries, max_words),
+            self._condensed_length_check(max_words),
+            "synopsis condensation",
+            "Skipping synopsis condensation.",
+            retry_budget,
+            max_words=int(max_words * 1.25),
+            target_words=max_words,
+        )
 
 class G4FManager(BaseManager):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        from g4f.client import Client
+
         self.client = Client()
         self.min_request_interval = 2.0  # Increased delay for G4F rate limiting
 
-    def _generate_response(self, prompt: str) -> str:
-        self._wait_for_rate_limit()
-        
-        messages = [
-            {"role": "system", "content": self.system_message},
-            {"role": "user", "content": prompt}
-        ]
-        
-        for attempt in range(self.retries):
-            try:
-                response = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=messages,
-                    temperature=self.temperature,
-                    max_tokens=self.max_tokens
-                )
-                
-                if not response.choices or not response.choices[0].message.content:
-                    raise ValueError(f"Unexpected response format: {response}")
-                
-                return response.choices[0].message.content
-
-            except Exception as e:
-                logging.error(f"G4F API request failed (attempt {attempt + 1}/{self.retries}): {e}")
-                if attempt < self.retries - 1:
-                    time.sleep(2 ** attempt)  # Exponential backoff
-                continue
-                
-        logging.error("Failed to get valid response from G4F after all retries")
-        return ""
+    def _stream(self, prompt: str, max_tokens: int) -> Iterator[str]:
+        stream = self.client.chat.completions.create(
+            model=self.model,
+            messages=self._messages(prompt),
+            temperature=self.temperature,
+            max_tokens=max_tokens,
+            stream=True,
+        )
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
 
 class OpenAIBaseManager(BaseManager):
+    stream_usage = True
+
     def __init__(self, api_key: str, base_url: str = None, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.client = OpenAI(api_key=api_key, base_url=base_url)
+        from openai import OpenAI
 
-    def _generate_response(self, prompt: str) -> str:
-        self._wait_for_rate_limit()
-        messages = [
-            {"role": "system", "content": self.system_message},
-            {"role": "user", "content": prompt},
-        ]
-        completion = self.client.chat.completions.create(
+        # RetryPolicy is the only retry layer, so that every attempt is budgeted
+        self.client = OpenAI(
+            api_key=api_key, base_url=base_url, http_client=shared_client(), max_retries=0
+        )
+
+    def _stream(self, prompt: str, max_tokens: int) -> Iterator[str]:
+        # The last chunk then carries the token usage, for the prompt cache stats
+        extra = {"stream_options": {"include_usage": True}} if self.stream_usage else {}
+        raw = self.client.chat.completions.with_raw_response.create(
             model=self.model,
-            messages=messages,
+            messages=self._messages(prompt),
             temperature=self.temperature,
+            max_tokens=max_tokens,
+            stream=True,
+            **extra,
         )
-        return completion.choices[0].message.content
+        self.concurrency.observe_headers(raw.headers)
+        stream = raw.parse()
+        try:
+            for chunk in stream:
+                if chunk.usage:
+                    self.prompt_cache_stats.record_openai(chunk.usage)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            stream.close()
 
 class OpenAIManager(OpenAIBaseManager):
-    def __init__(self, api_key: str, *args, **kwargs):
-        super().__init__(api_key=api_key, *args, **kwargs)
+    def __init__(self, api_key: str, base_url: Optional[str] = None, *args, **kwargs):
+        super().__init__(api_key=api_key, base_url=base_url, *args, **kwargs)
+
+    # Size limit of a Batch API input file
+    max_batch_bytes = 200_000_000
+
+    def batch_request(
+        self, custom_id: str, prompt: str, max_words: Optional[int] = CHUNK_SUMMARY_MAX_WORDS
+    ) -> dict:
+        """One line of a Batch API input file."""
+        return {
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": self.model,
+                "messages": self._messages(prompt),
+                "temperature": self.temperature,
+                "max_tokens": self._max_output_tokens(max_words),
+            },
+        }
+
+    def submit_batch(self, requests: List[dict]) -> str:
+        """Submit batch_request entries as one Batch API job and return its id."""
+        lines = "\n".join(json.dumps(request) for request in requests)
+        batch_file = self.client.files.create(
+            file=("batch.jsonl", lines.encode("utf-8")), purpose="batch"
+        )
+        batch = self.client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+        )
+        return batch.id
+
+    def batch_done(self, batch_id: str) -> bool:
+        status = self.client.batches.retrieve(batch_id).status
+        return status in ("completed", "failed", "expired", "cancelled")
+
+    def cancel_batch(self, batch_id: str) -> None:
+        self.client.batches.cancel(batch_id)
+
+    def batch_results(self, batch_id: str) -> Dict[str, str]:
+        """Responses of a finished batch by custom_id, failed requests are left out."""
+        batch = self.client.batches.retrieve(batch_id)
+        if not batch.output_file_id:
+            return {}
+        results = {}
+        for line in self.client.files.content(batch.output_file_id).text.splitlines():
+            entry = json.loads(line)
+            response = entry.get("response") or {}
+            if response.get("status_code") == 200:
+                results[entry["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
+        return results
 
 class LMStudioManager(OpenAIBaseManager):
-    def __init__(self, *args, **kwargs):
-        super().__init__(api_key="", base_url="http://127.0.0.1:1234/v1", *args, **kwargs)
+    stream_usage = False  # not understood by every local server version
+
+    def __init__(self, base_url: Optional[str] = None, *args, **kwargs):
+        super().__init__(api_key="", base_url=base_url or LMSTUDIO_BASE_URL, *args, **kwargs)
+
+class LlamaCppManager(OpenAIBaseManager):
+    stream_usage = False
+
+    def __init__(self, base_url: Optional[str] = None, *args, **kwargs):
+        super().__init__(api_key="", base_url=base_url or LLAMACPP_BASE_URL, *args, **kwargs)
 
 class OpenRouterManager(OpenAIBaseManager):
     def __init__(self, api_key: str, *args, **kwargs):
-        super().__init__(api_key=api_key, base_url="https://openrouter.ai/api/v1", *args, **kwargs)
+        super().__init__(api_key=api_key, base_url=OPENROUTER_BASE_URL, *args, **kwargs)
 
 class GLHFManager(OpenAIBaseManager):
     def __init__(self, api_key: str, *args, **kwargs):
-        super().__init__(api_key=api_key, base_url="https://glhf.chat/api/openai/v1", *args, **kwargs)
+        super().__init__(api_key=api_key, base_url=GLHF_BASE_URL, *args, **kwargs)
 
 class AlibabaManager(OpenAIBaseManager):
     def __init__(self, api_key: str, *args, **kwargs):
-        super().__init__(api_key=api_key, base_url="https://dashscope.aliyuncs.com/compatible-mode/v1", *args, **kwargs)
+        super().__init__(api_key=api_key, base_url=ALIBABA_BASE_URL, *args, **kwargs)
 
 class DeepInfraManager(OpenAIBaseManager):
     def __init__(self, api_key: str, *args, **kwargs):
-        super().__init__(api_key=api_key, base_url="https://api.deepinfra.com/v1/openai", *args, **kwargs)
+        super().__init__(api_key=api_key, base_url=DEEPINFRA_BASE_URL, *args, **kwargs)
 
 class MistralManager(BaseManager):
     def __init__(self, api_key: str, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        from mistralai import Mistral
+
         self.client = Mistral(api_key=api_key)
 
-    def _generate_response(self, prompt: str) -> str:
-        self._wait_for_rate_limit()
-        messages = [
-            {"role": "system", "content": self.system_message},
-            {"role": "user", "content": prompt},
-        ]
-        completion = self.client.chat.complete(
+    def _stream(self, prompt: str, max_tokens: int) -> Iterator[str]:
+        stream = self.client.chat.stream(
             model=self.model,
             temperature=self.temperature,
-            messages=messages,
+            messages=self._messages(prompt),
+            max_tokens=max_tokens,
         )
-        return completion.choices[0].message.content
+        for event in stream:
+            if event.data.choices and event.data.choices[0].delta.content:
+                yield event.data.choices[0].delta.content
 
 class ArliAiManager(BaseManager):
     def __init__(self, api_key: str, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.api_key = api_key
 
-    def _generate_response(self, prompt: str) -> str:
-        self._wait_for_rate_limit()
-        payload = json.dumps({
+    def _stream(self, prompt: str, max_tokens: int) -> Iterator[str]:
+        payload = {
             "model": self.model,
-            "messages": [
-                {"role": "system", "content": self.system_message},
-                {"role": "user", "content": prompt}
-            ],
+            "messages": self._messages(prompt),
             "temperature": self.temperature,
-            "max_tokens": self.max_tokens,
-            "stream": False
-        })
-        
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': f"Bearer {self.api_key}"
+            "max_tokens": max_tokens,
+            "stream": True
         }
 
-        response = requests.request("POST", "https://api.arliai.com/v1/chat/completions", headers=headers, data=payload)
-        
-        return response.json()["choices"][0]["message"]["content"]
+        headers = {'Authorization': f"Bearer {self.api_key}"}
+
+        # Pooled keep-alive connection with connect/read timeouts
+        with shared_client().stream("POST", ARLIAI_CHAT_URL, headers=headers, json=payload) as response:
+            self.concurrency.observe_headers(response.headers)
+            response.raise_for_status()
+            yield from iter_sse_deltas(response.iter_lines())
 
 class OllamaManager(BaseManager):
-    def __init__(self, *args, **kwargs):
+    repetition_window = 50
+
+    def __init__(
+        self,
+        *args,
+        host: Optional[str] = None,
+        num_ctx: Optional[int] = None,
+        keep_alive: Optional[int] = None,
+        **kwargs,
+    ):
+        """The server is started and the model loaded by local_backends.LocalBackend."""
         super().__init__(*args, **kwargs)
-        self.start_ollama()
+        import ollama
 
-    def start_ollama(self):
-        username = getpass.getuser()
-        subprocess.run(
-            [f"C:\\Users\\{username}\\AppData\\Local\\Programs\\Ollama\\ollama app.exe"]
-        )
+        self.client = ollama.Client(host=host)
+        self.num_ctx = num_ctx
+        self.keep_alive = keep_alive
 
-    def _generate_response(self, prompt: str) -> str:
-        self._wait_for_rate_limit()
-        stream = ollama.chat(
+    def _stream(self, prompt: str, max_tokens: int) -> Iterator[str]:
+        stream = self.client.chat(
             model=self.model,
-            messages=[
-                {"role": "system", "content": self.system_message},
-                {"role": "user", "content": prompt},
-            ],
+            messages=self._messages(prompt),
             stream=True,
-            options={"temperature": self.temperature},
+            options=ollama_options(self.temperature, max_tokens, self.num_ctx),
+            keep_alive=self.keep_alive,
         )
-
-        response = ""
-        latest_50 = ""  # track the latest 50 characters to check for repeats
-
-        for i, chunk in enumerate(stream):
-            response += chunk["message"]["content"]
-            latest_50 += chunk["message"]["content"]
-            if i >= 50:
-                latest_50 = latest_50[-50:]
-                if response.count(latest_50) > 1:
-                    # parse response to eliminate repeats
-                    response = " ".join(response.split(latest_50)[:-1])
-                    return response
-
-        return response
+        for chunk in stream:
+            yield chunk["message"]["content"]
 
 class GeminiManager(BaseManager):
     def __init__(self, api_key: str, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.client = genai.Client(api_key=api_key)
-        
+        from google import genai
 
-    def _generate_response(self, prompt: str) -> str:
-        self._wait_for_rate_limit()
+        self.client = genai.Client(api_key=api_key)
 
-        safety_settings = [
-            types.SafetySetting(
-                category="HARM_CATEGORY_HATE_SPEECH",
-                threshold="BLOCK_NONE",
-            ),
-            types.SafetySetting(
-                category="HARM_CATEGORY_HARASSMENT",
-                threshold="BLOCK_NONE",
-            ),
-            types.SafetySetting(
-                category="HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                threshold="BLOCK_NONE",
-            ),
-            types.SafetySetting(
-                category="HARM_CATEGORY_DANGEROUS_CONTENT",
-                threshold="BLOCK_NONE",
-            ),
-            types.SafetySetting(
-                category="HARM_CATEGORY_CIVIC_INTEGRITY",
-                threshold="BLOCK_NONE",
-            ),
-        ]
+    def _stream(self, prompt: str, max_tokens: int) -> Iterator[str]:
+        from google.genai import types
 
-        response = self.client.models.generate_content(
+        stream = self.client.models.generate_content_stream(
             model=self.model,
             contents=prompt,
             config=types.GenerateContentConfig(
                 temperature=self.temperature,
-                safety_settings=safety_settings,
+                max_output_tokens=max_tokens,
+                safety_settings=gemini_safety_settings(),
             ),
         )
-        return response.text
+        usage_metadata = None
+        for chunk in stream:
+            usage_metadata = chunk.usage_metadata or usage_metadata
+            if chunk.text:
+                yield chunk.text
+        self.prompt_cache_stats.record_gemini(usage_metadata)
 
 class HuggingFaceManager(BaseManager):
     def __init__(self, api_key: str, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        from huggingface_hub import InferenceClient
+
         self.client = InferenceClient(api_key=api_key)
 
-    def _generate_response(self, prompt: str) -> str:
-        self._wait_for_rate_limit()
-        messages = [
-            {"role": "system", "content": self.system_message},
-            {"role": "user", "content": prompt},
-        ]
-        completion = self.client.chat.completions.create(
+    def _stream(self, prompt: str, max_tokens: int) -> Iterator[str]:
+        stream = self.client.chat.completions.create(
             model=self.model,
-            messages=messages,
+            messages=self._messages(prompt),
             temperature=self.temperature,
+            max_tokens=max_tokens,
+            stream=True,
         )
-        return completion.choices[0].message.content
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
 
 class AnthropicManager(BaseManager):
-    def __init__(self, api_key: str, *args, **kwargs):
+    def __init__(self, api_key: str, base_url: Optional[str] = None, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.client = anthropic.Anthropic(api_key=api_key)
+        import anthropic
+
+        self.client = anthropic.Anthropic(api_key=api_key, base_url=base_url, max_retries=0)
+
+    # Size limit of a Message Batches request
+    max_batch_bytes = 256_000_000
+
+    def batch_request(
+        self, custom_id: str, prompt: str, max_words: Optional[int] = CHUNK_SUMMARY_MAX_WORDS
+    ) -> dict:
+        """One request of a Message Batch."""
+        return {
+            "custom_id": custom_id,
+            "params": {
+                "model": self.model,
+                "max_tokens": self._max_output_tokens(max_words),
+                "temperature": self.temperature,
+                "system": self.system_message,
+                "messages": anthropic_messages(prompt),
+            },
+        }
+
+    def submit_batch(self, requests: List[dict]) -> str:
+        """Submit batch_request entries as one Message Batch and return its id."""
+        return self.client.messages.batches.create(requests=requests).id
 
-    def _generate_response(self, prompt: str) -> str:
-        self._wait_for_rate_limit()
-        completion = self.client.messages.create(
+    def batch_done(self, batch_id: str) -> bool:
+        return self.client.messages.batches.retrieve(batch_id).processing_status == "ended"
+
+    def cancel_batch(self, batch_id: str) -> None:
+        self.client.messages.batches.cancel(batch_id)
+
+    def batch_results(self, batch_id: str) -> Dict[str, str]:
+        """Responses of a finished batch by custom_id, failed requests are left out."""
+        return {
+            entry.custom_id: anthropic_text(entry.result.message)
+            for entry in self.client.messages.batches.results(batch_id)
+            if entry.result.type == "succeeded"
+        }
+
+    def _stream(self, prompt: str, max_tokens: int) -> Iterator[str]:
+        with self.client.messages.stream(
             model=self.model,
+            max_tokens=max_tokens,
             temperature=self.temperature,
             system=self.system_message,
-            messages=[{"role": "user", "content": prompt}],
-        )
-        return completion.content
+            messages=anthropic_messages(prompt),
+        ) as stream:
+            response = getattr(stream, "response", None)
+            if response is not None:
+                self.concurrency.observe_headers(response.headers)
+            yield from stream.text_stream
+            self.prompt_cache_stats.record_anthropic(stream.get_final_message().usage)
 
 class HyperbolicManager(BaseManager):
     def __init__(self, api_key: str, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.api_key = api_key
 
-    def _generate_response(self, prompt: str) -> str:
-        self._wait_for_rate_limit()
-        url = "https://api.hyperbolic.xyz/v1/chat/completions"
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.api_key}",
-        }
+    def _stream(self, prompt: str, max_tokens: int) -> Iterator[str]:
+        url = HYPERBOLIC_CHAT_URL
+        headers = {"Authorization": f"Bearer {self.api_key}"}
         data = {
-            "messages": [
-                {"role": "system", "content": self.system_message},
-                {"role": "user", "content": prompt},
-            ],
+            "messages": self._messages(prompt),
             "model": self.model,
-            "max_tokens": 1000,
+            "max_tokens": max_tokens,
             "temperature": self.temperature,
             "top_p": 0.9,
+            "stream": True,
         }
 
-        response = requests.post(url, headers=headers, json=data)
-        return response.json()["choices"][0]["message"]["content"]
+        with shared_client().stream("POST", url, headers=headers, json=data) as response:
+            self.concurrency.observe_headers(response.headers)
+            response.raise_for_status()
+            yield from iter_sse_deltas(response.iter_lines())
@@ -1,27 +1,42 @@
 import os
 import tkinter as tk
+import itertools
 import json
 import logging
+import multiprocessing
+import threading
 import time
-import ollama
 
 from tkinter import ttk, filedialog, scrolledtext
 from tkinterdnd2 import TkinterDnD, DND_FILES
 
 from PyThreadKiller import PyThreadKiller
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from datetime import datetime
 from queue import Queue, Empty
 from typing import Dict, Any
 
+import http_transport
+from async_ai_models import SyncBridge
+from batch_runner import MAX_REQUESTS_PER_BATCH, summarize_chunks_in_batch
+from calibre_library import read_library
+from chunk_planner import PlanCache
+from local_backends import LOCAL_PROVIDERS, LocalBackend, context_length
+from providers import PROVIDERS, create_manager, requires_api_key
 from utils import (
+    MAP_REDUCE_FAN_IN,
+    count_reduce_steps,
     process_chunks,
     parse_metadata,
+    preprocess_book,
     read_epub,
     save_api_keys_to_file,
     encrypt_api_key,
     decrypt_api_key,
     load_daily_requests,
     save_daily_requests,
+    load_aborted_books,
+    save_aborted_books,
     seconds_to_time,
     float_to_cost,
     convert_to_readable_time,
@@ -193,19 +208,33 @@ class BookSummarizerGUI:
         self.processed_basenames = {}
 
         self.processed_books = set()
-        self.aborted_books = set()
+        # Kept across sessions, so books aborted before a restart can still be resumed
+        self.aborted_books = load_aborted_books()
 
         self.create_widgets()
 
         self.processing_queue = Queue()
+        self.stop_event = threading.Event()
+        self.progress_lock = threading.Lock()
         self.current_book = 0
         self.total_books = 0
         self.update_time_thread = None
+        # Bumped by every new estimate, so older estimate threads give up
+        self.estimate_generation = 0
+        # Callback of the latest estimate that asked for one, run when it is done
+        self.pending_estimate_done = None
         self.start_processing_thread = None
 
         self.master.after(100, self.check_queue)
 
         self.file_paths = {}
+        # Rows of the file list by (title, author, book dir device and inode),
+        # and by book path, so adding a library does not rescan the list per book
+        self.book_index = {}
+        self.item_by_path = {}
+        self.item_books = {}
+        # Metadata of books read from a Calibre metadata.db, by book path
+        self.book_metadata = {}
 
     def load_ai_config(self):
         config_path = os.path.join(
@@ -213,6 +242,13 @@ class BookSummarizerGUI:
         )
         with open(config_path, "r") as config_file:
             self.ai_config = json.load(config_file)
+        self.settings = self.ai_config.get("settings", {})
+        self.preprocess_workers = self.settings.get("preprocess_workers") or os.cpu_count() or 1
+        self.summarization_mode = self.settings.get("summarization_mode", "sequential")
+        self.map_reduce_workers = self.settings.get("map_reduce_workers", 8)
+        self.async_requests = self.settings.get("async_requests", {})
+        self.plan_cache = PlanCache()
+        http_transport.configure(**self.settings.get("http", {}))
 
     def create_widgets(self):
 
@@ -374,6 +410,13 @@ class BookSummarizerGUI:
         )
         self.process_button.grid(row=0, column=0, padx=10, sticky="ew")
 
+        self.resume_button = ttk.Button(
+            self.process_frame,
+            text="Resume Aborted",
+            command=self.resume_aborted_books,
+        )
+        self.resume_button.grid(row=0, column=5, padx=10, sticky="ew")
+
         self.estimated_time_frame = ttk.Frame(
             self.process_frame, width=305, height=20
         )
@@ -506,7 +549,7 @@ class BookSummarizerGUI:
         manage_window.title("Manage API Keys")
         manage_window.configure(background="#282c34")
         providers = [
-            x for x in self.ai_config["providers"] if x["name"] not in ["ollama", "lmstudio"]
+            x for x in self.ai_config["providers"] if x["name"] not in LOCAL_PROVIDERS
         ]
 
         for i, provider in enumerate(providers):
@@ -554,7 +597,7 @@ class BookSummarizerGUI:
     def save_api_keys(self):
         self.save_apis_keys_button.config(state=tk.DISABLED)
         for provider in [
-            x for x in self.ai_config["providers"] if x["name"] not in ["ollama", "lmstudio"]
+            x for x in self.ai_config["providers"] if x["name"] not in LOCAL_PROVIDERS
         ]:
             api_key = provider["entry"].get()
             if api_key:  # Only encrypt and save non-empty keys
@@ -584,6 +627,10 @@ class BookSummarizerGUI:
         self.console.config(state=tk.DISABLED)
 
     def update_daily_requests(self, model, provider, requests):
+        with self.progress_lock:
+            self._update_daily_requests(model, provider, requests)
+
+    def _update_daily_requests(self, model, provider, requests):
         today = datetime.now().strftime("%Y-%m-%d")
 
         if today not in self.daily_requests:
@@ -662,28 +709,15 @@ class BookSummarizerGUI:
         filetypes = (("eBook files", "*.mobi;*.azw3;*.epub"), ("All files", "*.*"))
         files = filedialog.askopenfilenames(filetypes=filetypes)
         for file in files:
-            if not self.file_listbox_contains(file):
-                base_name = os.path.basename(file)
-                self.file_listbox.insert("", tk.END, values=(base_name, "", ""))
-                self.file_paths[base_name] = file
-                self.update_book_count()
+            self.add_book(file)
+        self.update_book_count()
         if self.model_combobox.get() != "None":
             self.update_estimated_time()
 
     def select_folder(self):
         folder_path = filedialog.askdirectory()
         if folder_path:
-            for root, dirs, files in os.walk(folder_path):
-                for file in files:
-                    if file.endswith((".mobi", ".azw3", ".epub")):
-                        file_path = os.path.join(root, file)
-                        if not self.file_listbox_contains(file_path):
-                            base_name = os.path.basename(file_path)
-                            self.file_listbox.insert(
-                                "", tk.END, values=(base_name, "", "")
-                            )
-                            self.file_paths[base_name] = file_path
-                            self.update_book_count()  # Update the book count label
+            self.add_folder(folder_path)
         if self.model_combobox.get() != "None":
             self.update_estimated_time()
 
@@ -694,34 +728,50 @@ class BookSummarizerGUI:
 
     def process_dropped_file(self, file_path):
         if file_path.lower().endswith((".mobi", ".azw3", ".epub")):
-            base_name = os.path.basename(file_path)
-            if not self.file_listbox_contains(file_path):
-                self.file_listbox.insert("", tk.END, values=(base_name, "", ""))
-                self.file_paths[base_name] = file_path
+            if self.add_book(file_path):
                 self.update_book_count()
 
     def process_dropped_folder(self, folder_path):
-        for root, dirs, files in os.walk(folder_path):
-            for file in files:
-                file_path = os.path.join(root, file)
-                self.process_dropped_file(file_path)
-        self.update_book_count()
+        self.add_folder(folder_path)
+
+    def add_folder(self, folder_path):
+        """Add every book under folder_path, from its metadata.db when it is a Calibre library."""
+        library = read_library(folder_path)
+        if library is not None:
+            for book in library:
+                self.add_book(book.file_path, book.metadata())
+            self.console_print(f"Read {len(library)} books from the Calibre library.")
+        else:
+            for root, dirs, files in os.walk(folder_path):
+                for file in files:
+                    if file.lower().endswith((".mobi", ".azw3", ".epub")):
+                        self.add_book(os.path.join(root, file))
+        self.update_book_count()  # Update the book count label
 
     def remove_selected_files(self):
         selected_items = self.file_listbox.selection()
         if selected_items:
             for item in selected_items:
                 self.file_listbox.delete(item)
+                self.forget_book(item)
         self.update_book_count()
         self.update_estimated_time()
 
     def clear_file_list(self):
         self.file_listbox.delete(*self.file_listbox.get_children())
+        self.book_index.clear()
+        self.item_by_path.clear()
+        self.item_books.clear()
+        self.book_metadata.clear()
         self.update_book_count()
         self.update_estimated_time()
 
-    def file_listbox_contains(self, file_path: str) -> bool:
+    def book_key(self, file_path: str, metadata=None):
+        """(title, author, device, inode) of the book's directory, None without an OPF file."""
         book_dir = os.path.dirname(file_path)
+        if metadata is not None:
+            stat = os.stat(book_dir)
+            return metadata[0], metadata[1], stat.st_dev, stat.st_ino
         opf_file = next(
             (
                 os.path.join(book_dir, file)
@@ -731,40 +781,52 @@ class BookSummarizerGUI:
             None,
         )
         if not opf_file:
-            return False
+            return None
 
         try:
             title, author, _, _ = parse_metadata(opf_file)
+            stat = os.stat(book_dir)
         except Exception as e:
             self.console_print(f"Failed to parse metadata from {opf_file}: {str(e)}")
-            return False
+            return None
+        return title, author, stat.st_dev, stat.st_ino
 
-        for item in self.file_listbox.get_children():
-            item_base_name = self.file_listbox.item(item)["values"][0]
-            item_file_path = self.file_paths.get(item_base_name)
-            if not item_file_path:
-                continue
+    def add_book(self, file_path: str, metadata=None) -> bool:
+        """Add a book to the file list unless it is already there, in constant time.
 
-            item_book_dir = os.path.dirname(item_file_path)
-            item_opf_file = next(
-                (
-                    os.path.join(item_book_dir, file)
-                    for file in os.listdir(item_book_dir)
-                    if file.endswith(".opf")
-                ),
-                None,
-            )
-            if not item_opf_file:
-                continue
+        metadata, when known (from a Calibre library), saves parsing the OPF file."""
+        key = self.book_key(file_path, metadata)
+        if key is not None and key in self.book_index:
+            return False
+        if metadata is not None:
+            self.book_metadata[file_path] = metadata
+        base_name = os.path.basename(file_path)
+        status = "Aborted" if file_path in self.aborted_books else ""
+        item = self.file_listbox.insert("", tk.END, values=(base_name, status, ""))
+        self.file_paths[base_name] = file_path
+        self.item_by_path[file_path] = item
+        self.item_books[item] = (key, file_path)
+        if key is not None:
+            self.book_index[key] = item
+        return True
 
-            item_title, item_author, _, _ = parse_metadata(item_opf_file)
-            if (
-                item_title == title
-                and item_author == author
-                and os.path.samefile(item_book_dir, book_dir)
-            ):
-                return True
-        return False
+    def forget_book(self, item):
+        """Drop a removed row from the duplicate index."""
+        key, file_path = self.item_books.pop(item, (None, None))
+        if self.book_index.get(key) == item:
+            del self.book_index[key]
+        if self.item_by_path.get(file_path) == item:
+            del self.item_by_path[file_path]
+            self.book_metadata.pop(file_path, None)
+
+    def get_metadata(self, book_path):
+        """Title, author, series and series index of a book, parsed once if not already known."""
+        metadata = self.book_metadata.get(book_path)
+        if metadata is None:
+            metadata = parse_metadata(book_path)
+            if metadata[0]:
+                self.book_metadata[book_path] = metadata
+        return metadata
 
     def update_model_options(self, event):
         selected_provider = self.provider_var.get()
@@ -794,103 +856,126 @@ class BookSummarizerGUI:
                         return model
         return {}
 
-    def _load_model_if_needed(self, model):
-        """Load the model if it is not already present locally."""
-        if model not in [x["model"] for x in ollama.list()["models"]]:
-            self.console_print(
-                f"{model} not found locally. Pulling from Hugging Face... Please wait some minutes..."
-            )
-            ollama.pull(model)
-            self.console_print(f"{model} pulled successfully.")
+    def prepare_local_backend(self, provider, model, max_tokens, preprocessed_books):
+        """Start the local server if needed and load the model with a context fitting the queued books."""
+        backend = LocalBackend.from_settings(provider, self.settings.get("local_backends"))
+        num_ctx = context_length(preprocessed_books.values(), max_tokens)
+
+        def report(message):
+            self.processing_queue.put(("console_print", message))
+
+        if not backend.prepare(model, num_ctx, report, self.stop_event):
+            return None
+        return backend
+
+    def get_rolling_context(self, max_tokens):
+        """Rolling context settings for process_chunks, None to send all previous summaries."""
+        rolling_context = self.settings.get("rolling_context", {})
+        if not rolling_context.get("enabled"):
+            return None
+        return {
+            "keep_last": rolling_context.get("keep_last", 3),
+            # Leave most of small contexts to the chunk itself
+            "budget_tokens": min(
+                rolling_context.get("budget_tokens", 6000), int(max_tokens) // 4
+            ),
+        }
 
-    def preprocess_books(self, max_tokens, tpm):
+    def preprocess_books(self, max_tokens, tpm, on_book_done=None, cancelled=None):
+        """Preprocess the queued books, or return None once cancelled() is true."""
         preprocessed_books = {}
         book_chunk_info = {}
 
-        # Load existing processed books cache if it exists
-        processed_books_cache = {}
-        cache_file = 'processed_books_cache.json'
-        if os.path.exists(cache_file):
-            with open(cache_file, 'r') as f:
-                processed_books_cache = json.load(f)
-
+        book_paths = []
         for item in self.file_listbox.get_children():
             if self.file_listbox.item(item)["values"][1] != "Aborted" and self.file_listbox.item(item)["values"][2] == "":
                 base_name = self.file_listbox.item(item)["values"][0]
-                book_path = self.file_paths.get(base_name)
-                
-                content = read_epub(book_path)
-                if content:
-                    total_tokens = int(len(content.split()) * 1.3)
-
-                    # Start with initial values
-                    initial_chunk_size = min(int(max_tokens * 0.8), tpm)
-                    reduction_factor = 1
-                    max_allowed_tokens = int(max_tokens * 0.90)
-
-                    for _ in range(200):
-                        chunks = []
-                        current_token_count = 0
-                        content_words = content.split()
-                        previous_summary_tokens = 0
-                        theoretical_max_tokens = 0
-                        chunk_info = []
-
-                        while current_token_count < total_tokens:
-                            chunk_size = max(
-                                int((initial_chunk_size * reduction_factor) - previous_summary_tokens),
-                                max_tokens // 10,
-                            )
-
-                            # Convert chunk size to word count and ensure it's an integer
-                            chunk_word_count = int(chunk_size / 1.3)
-
-                            # Update theoretical maximum possible token count
-                            theoretical_max_tokens += chunk_size
-
-                            # Check if we're exceeding the max allowed tokens
-                            if chunk_size + previous_summary_tokens > max_allowed_tokens:
-                                break
-
-                            chunk_content = " ".join(
-                                content_words[current_token_count : current_token_count + int(chunk_word_count)]
-                            )
-                            chunks.append(chunk_content)
-                            chunk_info.append(
-                                {
-                                    "chunk_size": chunk_size,
-                                    "summary_tokens": previous_summary_tokens,
-                                }
-                            )
-                            current_token_count += chunk_word_count
-
-                            # Estimate summary tokens for next iteration
-                            summary_tokens = 1000
-                            previous_summary_tokens += summary_tokens
-
-                        if current_token_count >= total_tokens or (
-                            chunk_size + previous_summary_tokens <= max_allowed_tokens
-                        ):
-                            break
-
-                        reduction_factor -= 0.01
-
-                    # Adjust the console message to reflect theoretical max tokens, not current token count
-                    if current_token_count < total_tokens:
-                        self.console_print(
-                            f"Failed to preprocess {os.path.splitext(os.path.basename(book_path))[0]} ({total_tokens} tokens of length), as it's too large to process (maximum of ∼{int(theoretical_max_tokens)} tokens possible with this model current settings)."
-                        )
-                        continue
-                    else:
+                book_paths.append(self.file_paths.get(base_name))
+
+        if not book_paths:
+            self.book_chunk_info = book_chunk_info
+            return preprocessed_books
+
+        rolling_context = self.get_rolling_context(max_tokens)
+        summary_budget = rolling_context["budget_tokens"] if rolling_context else None
+
+        # Memoized plans are reported right away, only the rest is preprocessed
+        memoized_results = []
+        memoized_paths = set()
+        missing_paths = []
+        for book_path in book_paths:
+            result = self.plan_cache.get(
+                book_path, max_tokens, tpm, summary_budget, read_epub
+            )
+            if result is not None:
+                memoized_results.append(result)
+                memoized_paths.add(book_path)
+            else:
+                missing_paths.append(book_path)
+
+        workers = min(self.preprocess_workers, len(missing_paths))
+        if workers > 1:
+            # Forking would copy the Tk, worker and HTTP pool threads into a
+            # child that can deadlock on their locks, so workers are spawned
+            executor = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+            )
+            futures = [
+                executor.submit(
+                    preprocess_book, book_path, max_tokens, tpm, summary_budget
+                )
+                for book_path in missing_paths
+            ]
+            results = (future.result() for future in as_completed(futures))
+        else:
+            executor = None
+            results = (
+                preprocess_book(book_path, max_tokens, tpm, summary_budget)
+                for book_path in missing_paths
+            )
+
+        try:
+            # Books are reported as soon as they finish, in completion order
+            for result in itertools.chain(memoized_results, results):
+                if cancelled and cancelled():
+                    return None
+                book_path = result["book_path"]
+                if book_path not in memoized_paths:
+                    self.plan_cache.put(
+                        book_path, max_tokens, tpm, summary_budget, result
+                    )
+                book_name = os.path.splitext(os.path.basename(book_path))[0]
+                if result["chunks"] is None:
+                    if result["total_tokens"]:
+                        # Adjust the console message to reflect theoretical max tokens, not current token count
                         self.console_print(
-                            f"Preprocessed {os.path.splitext(os.path.basename(book_path))[0]} ({total_tokens} tokens of length)."
+                            f"Failed to preprocess {book_name} ({result['total_tokens']} tokens of length), as it's too large to process (maximum of ∼{result['theoretical_max_tokens']} tokens possible with this model current settings)."
                         )
+                    continue
 
-                    preprocessed_books[book_path] = chunks
-                    book_chunk_info[book_path] = chunk_info
-
-        self.book_chunk_info = book_chunk_info
-        return preprocessed_books
+                self.console_print(
+                    f"Preprocessed {book_name} ({result['total_tokens']} tokens of length)."
+                )
+                preprocessed_books[book_path] = result["chunks"]
+                book_chunk_info[book_path] = result["chunk_info"]
+                if on_book_done:
+                    on_book_done(book_path, result["chunks"])
+        finally:
+            if executor:
+                executor.shutdown(cancel_futures=True)
+            self.plan_cache.save()
+
+        # Keep the processing order of the file list
+        self.book_chunk_info = {
+            book_path: book_chunk_info[book_path]
+            for book_path in book_paths
+            if book_path in book_chunk_info
+        }
+        return {
+            book_path: preprocessed_books[book_path]
+            for book_path in book_paths
+            if book_path in preprocessed_books
+        }
 
     def calculate_estimated_cost(self, tokens: int, model: str, provider: str) -> str:
         model_info = self.get_model_info(model, provider)
@@ -932,7 +1017,7 @@ class BookSummarizerGUI:
 
         return total_seconds
 
-    def estimate_process(self):
+    def estimate_process(self, cancelled=None):
         selected_model_info = self.get_selected_model_info()
 
         if not selected_model_info:
@@ -948,43 +1033,54 @@ class BookSummarizerGUI:
         else:
             tpm = selected_model_info["tpm"]
 
-        # Preprocess the books and store chunks and summaries
-        self.preprocessed_books = self.preprocess_books(max_tokens, tpm)
-
         # Retrieve pre-calculated chunk and summary data
         chunk_summary_info = {
             "total_chunks": 0,
             "total_tokens": 0,
             "final_summaries": 0,
+            "estimated_time_seconds": 0,
+            "estimated_cost_value": 0,
         }
 
-        total_estimated_time_seconds = 0
-        total_estimated_cost_value = 0
+        # Calculate available requests
+        available_requests = self.calculate_available_requests(selected_model_info)
 
-        # Iterate through each preprocessed book and calculate estimates
-        for book_path, chunks in self.preprocessed_books.items():
+        def add_book_estimate(book_path, chunks):
             num_chunks = len(chunks)
             chunk_summary_info["total_chunks"] += num_chunks
-            chunk_summary_info["total_tokens"] += int(
-                sum(len(chunk.split()) for chunk in chunks) * 1.3
-            )
-            
+            chunk_summary_info["total_tokens"] += chunks.total_tokens
+
             # Only count as a final summary if there is more than one chunk
             if num_chunks > 1:
                 chunk_summary_info["final_summaries"] += 1
 
             # Calculate time and cost per chunk using max_tokens
             for i in range(num_chunks):
-                chunk_tokens = int(len(chunks[i].split()) * 1.3)
-                estimated_time_chunk = self.estimate_processing_time(
+                chunk_tokens = chunks.chunk_tokens(i)
+                chunk_summary_info["estimated_time_seconds"] += self.estimate_processing_time(
                     chunk_tokens, model, provider
                 )
-                estimated_cost_chunk = self.calculate_estimated_cost(
+                chunk_summary_info["estimated_cost_value"] += self.calculate_estimated_cost(
                     chunk_tokens, model, provider
                 )
 
-                total_estimated_time_seconds += estimated_time_chunk
-                total_estimated_cost_value += estimated_cost_chunk
+            # Show the running totals while the remaining books are preprocessed
+            if cancelled and cancelled():
+                return
+            self.show_estimate(chunk_summary_info, available_requests, model, provider)
+
+        # Preprocess the books and store chunks and summaries
+        preprocessed_books = self.preprocess_books(
+            max_tokens, tpm, add_book_estimate, cancelled
+        )
+        if preprocessed_books is None:
+            return
+        self.preprocessed_books = preprocessed_books
+        self.show_estimate(chunk_summary_info, available_requests, model, provider)
+
+    def show_estimate(self, chunk_summary_info, available_requests, model, provider):
+        total_estimated_time_seconds = chunk_summary_info["estimated_time_seconds"]
+        total_estimated_cost_value = chunk_summary_info["estimated_cost_value"]
 
         # Add the final summaries time and cost (tokens estimated at 1250)
         final_summaries = chunk_summary_info["final_summaries"]
@@ -1003,9 +1099,6 @@ class BookSummarizerGUI:
         total_estimated_time = seconds_to_time(total_estimated_time_seconds)
         total_estimated_cost = float_to_cost(total_estimated_cost_value)
 
-        # Calculate available requests
-        available_requests = self.calculate_available_requests(selected_model_info)
-
         # Update the UI with estimated values
         self.estimated_time_label.grid()
         estimated_requests = chunk_summary_info["total_chunks"] + final_summaries
@@ -1013,7 +1106,6 @@ class BookSummarizerGUI:
             text=f"Estimated requests: {estimated_requests} / {available_requests} | {total_estimated_time if estimated_requests > 0 else 'N/A'} | {total_estimated_cost if estimated_requests > 0 else 'N/A'}"
         )
 
-
     def start_processing(self):
 
         self.process_button.config(state=tk.DISABLED)
@@ -1046,9 +1138,15 @@ class BookSummarizerGUI:
         model = selected_model_info["name"]
 
         total_chunks = sum(len(chunks) for chunks in self.preprocessed_books.values())
-        final_summaries = len(
-            [1 for chunks in self.preprocessed_books.values() if len(chunks) > 1]
-        )
+        if self.summarization_mode == "map_reduce":
+            final_summaries = sum(
+                count_reduce_steps(len(chunks), MAP_REDUCE_FAN_IN)
+                for chunks in self.preprocessed_books.values()
+            )
+        else:
+            final_summaries = len(
+                [1 for chunks in self.preprocessed_books.values() if len(chunks) > 1]
+            )
         total_requests = total_chunks + final_summaries
 
         if not self.check_daily_limit(model, provider, total_requests):
@@ -1058,6 +1156,7 @@ class BookSummarizerGUI:
             self.enable_widgets()
             return False
 
+        self.stop_event.clear()
         self.start_processing_thread = PyThreadKiller(
             target=self._start_processing_thread,
             args=(
@@ -1068,13 +1167,41 @@ class BookSummarizerGUI:
         )
         self.start_processing_thread.start()
 
+    def resume_aborted_books(self):
+        """Queue the selected (or all) aborted books again, they continue from their checkpoints."""
+        items = [
+            item
+            for item in (self.file_listbox.selection() or self.file_listbox.get_children())
+            if self.file_listbox.item(item)["values"][1] == "Aborted"
+        ]
+        if not items:
+            self.console_print("No aborted books to resume.")
+            return
+
+        for item in items:
+            # Rows with a processing time are left out of preprocessing
+            self.file_listbox.set(item, "chunk_progress", "")
+            self.file_listbox.set(item, "processing_time", "")
+            base_name = self.file_listbox.item(item)["values"][0]
+            self.aborted_books.discard(self.file_paths.get(base_name))
+        save_aborted_books(self.aborted_books)
+        self.console_print(f"Resuming {len(items)} aborted book(s)...")
+        # Preprocess them again so they are queued, then start once that is done
+        self.update_estimated_time(on_done=self.start_processing)
+
     def _start_processing_thread(self, preprocessed_books, selected_model_info):
         model = selected_model_info["name"]
         max_tokens = selected_model_info["max_tokens"]
         provider = selected_model_info["provider"]
         temperature = selected_model_info["temperature"]
 
-        if provider not in ["ollama", "lmstudio", "g4f"]:
+        if provider not in PROVIDERS:
+            self.console_print(f"Error: Unknown provider: {provider}. Aborting...")
+            self.enable_widgets()
+            return
+
+        api_key = None
+        if requires_api_key(provider):
             if not self.encrypted_api_keys.get(provider):
                 self.console_print(
                     f"Error: No API key found for {provider}. Aborting..."
@@ -1083,159 +1210,145 @@ class BookSummarizerGUI:
                 return
             api_key = decrypt_api_key(self.encrypted_api_keys.get(provider))
 
-        if provider == "ollama":
-            from ai_models import OllamaManager
-
-            self._load_model_if_needed(model)
-
-            manager = OllamaManager(
-                model=model,
-                max_tokens=max_tokens,
-                temperature=temperature,
-            )
-        elif provider == "g4f":
-            from ai_models import G4FManager
+        manager_kwargs = {
+            "model": model,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "provider": provider,
+            "rate_limits": self.get_model_info(model, provider),
+            "concurrency": self.settings.get("adaptive_concurrency"),
+            "retry": self.settings.get("retry"),
+            "response_cache": self.settings.get("response_cache"),
+        }
 
-            manager = G4FManager(
-                model=model,
-                max_tokens=max_tokens,
-                temperature=temperature,
-            )
-        elif provider == "alibaba":
-            from ai_models import AlibabaManager
-
-            manager = AlibabaManager(
-                api_key=api_key,
-                model=model,
-                max_tokens=max_tokens,
-                temperature=temperature,
-            )
-        elif provider == "GLHF":
-            from ai_models import GLHFManager
-
-            manager = GLHFManager(
-                api_key=api_key,
-                model=model,
-                max_tokens=max_tokens,
-                temperature=temperature,
-            )
-        elif provider == "openai":
-            from ai_models import OpenAIManager
-
-            manager = OpenAIManager(
-                api_key=api_key,
-                model=model,
-                max_tokens=max_tokens,
-                temperature=temperature,
-            )
-        elif provider == "openrouter":
-            from ai_models import OpenRouterManager
-
-            manager = OpenRouterManager(
-                api_key=api_key,
-                model=model,
-                max_tokens=max_tokens,
-                temperature=temperature,
-            )
-        elif provider == "lmstudio":
-            from ai_models import LMStudioManager
+        if provider in LOCAL_PROVIDERS:
+            backend = self.prepare_local_backend(provider, model, max_tokens, preprocessed_books)
+            if backend is None:
+                self.console_print(f"Error: {provider} is not available. Aborting...")
+                self.enable_widgets()
+                return
+            manager_kwargs.update(backend.manager_kwargs())
+
+        batch = self.settings.get("batch", {})
+        # Map-reduce requests are independent, so they can all go through one
+        # event loop. Batch jobs are only submitted by the sync managers.
+        use_async = (
+            self.async_requests.get("enabled")
+            and self.summarization_mode == "map_reduce"
+            and not batch.get("enabled")
+        )
+        manager = create_manager(
+            provider,
+            api_key,
+            self.get_provider_info(provider),
+            use_async=use_async,
+            **manager_kwargs,
+        )
+        if use_async:
+            manager = SyncBridge(manager)
 
-            manager = LMStudioManager(
-                model=model,
-                max_tokens=max_tokens,
-                temperature=temperature,
-            )
-        elif provider == "google":
-            from ai_models import GeminiManager
-
-            manager = GeminiManager(
-                api_key=api_key,
-                model=model,
-                max_tokens=max_tokens,
-                temperature=temperature,
-            )
-        elif provider == "hyperbolic":
-            from ai_models import HyperbolicManager
-
-            manager = HyperbolicManager(
-                api_key=api_key,
-                model=model,
-                max_tokens=max_tokens,
-                temperature=temperature,
-            )
-        elif provider == "deepinfra":
-            from ai_models import DeepInfraManager
-
-            manager = DeepInfraManager(
-                api_key=api_key,
-                model=model,
-                max_tokens=max_tokens,
-                temperature=temperature,
-            )
-        elif provider == "mistral":
-            from ai_models import MistralManager
-
-            manager = MistralManager(
-                api_key=api_key,
-                model=model,
-                max_tokens=max_tokens,
-                temperature=temperature,
-            )
-        elif provider == "anthropic":
-            from ai_models import AnthropicManager
-
-            manager = AnthropicManager(
-                api_key=api_key,
-                model=model,
-                max_tokens=max_tokens,
-                temperature=temperature,
-            )
-        elif provider == "huggingface":
-            from ai_models import HuggingFaceManager
-
-            manager = HuggingFaceManager(
-                api_key=api_key,
-                model=model,
-                max_tokens=max_tokens,
-                temperature=temperature,
-            )
-        elif provider == "arliai":
-            from ai_models import ArliAiManager
-
-            manager = ArliAiManager(
-                api_key=api_key,
-                model=model,
-                max_tokens=max_tokens,
-                temperature=temperature,
-            )
-        else:
-            self.console_print(f"Error: Unknown provider: {provider}. Aborting...")
-            self.enable_widgets()
-            return
+        manager.concurrency.on_change = self.report_concurrency_window
 
         self.total_books = len(preprocessed_books)
         self.current_book = 0
 
         self.console_print("Starting processing...")
 
-        self.process_books(manager, provider, preprocessed_books)
+        if (
+            batch.get("enabled")
+            and self.summarization_mode == "map_reduce"
+            and hasattr(manager, "submit_batch")
+        ):
+            self.summarize_in_batch(manager, preprocessed_books, batch)
 
-    def process_books(self, manager, provider, preprocessed_books):
+        try:
+            self.process_books(manager, provider, preprocessed_books)
+        finally:
+            if use_async:
+                manager.close()
+
+    def report_concurrency_window(self, key, old_window, new_window):
+        self.processing_queue.put(
+            (
+                "console_print",
+                f"Concurrent requests to {key}: {old_window} -> {new_window}",
+            )
+        )
+
+    def get_book_dir(self, title, author):
+        return os.path.join(f".{os.sep}summaries", f"{title} - {author}")
+
+    def summarize_in_batch(self, manager, preprocessed_books, batch):
+        """Summarize the chunks of all books in provider batch jobs ahead of process_books.
+
+        The books then resume from the saved summaries and only their merges,
+        and chunks the batch could not deliver, go through interactive requests."""
+        books = []
         for book_path, chunks in preprocessed_books.items():
-            self.console_print(f"Starting to process: {book_path}")
-            item = self.get_item_from_book_path(book_path)
-            self.process_single_book(book_path, manager, provider, item, chunks)
-            self.current_book += 1
-            self.processing_queue.put(("update_progress", self.current_book))
+            title, author, _, _ = self.get_metadata(book_path)
+            if not title or not author or len(chunks) < 2:
+                continue
+            books.append((title, author, self.get_book_dir(title, author), chunks))
+
+        def report(message):
+            self.processing_queue.put(("console_print", message))
+
+        try:
+            summarize_chunks_in_batch(
+                manager,
+                books,
+                poll_interval=batch.get("poll_interval", 60),
+                max_requests_per_batch=batch.get("max_requests_per_batch", MAX_REQUESTS_PER_BATCH),
+                stop_event=self.stop_event,
+                report=report,
+            )
+        except Exception as e:
+            logging.error(f"Batch processing failed: {e}")
+            report(f"Batch processing failed, continuing with regular requests: {e}")
+
+    def process_books(self, manager, provider, preprocessed_books):
+        # Books run concurrently up to the provider's limit, sharing the manager
+        max_books = self.get_provider_info(provider).get("max_concurrent_books", 1)
+        with ThreadPoolExecutor(max_workers=max_books) as executor:
+            futures = [
+                executor.submit(
+                    self.process_queued_book, book_path, manager, provider, chunks
+                )
+                for book_path, chunks in preprocessed_books.items()
+            ]
+            for future in as_completed(futures):
+                future.result()
+
+        if manager.prompt_cache_stats.prompt_tokens:
+            self.processing_queue.put(
+                (
+                    "console_print",
+                    f"Prompt cache: {manager.prompt_cache_stats.summary()}",
+                )
+            )
 
         self.processing_queue.put(("processing_complete", None))
+        # Estimate the books left once, on the main thread, after every book is done
+        self.processing_queue.put(("refresh_estimate", None))
+
+    def process_queued_book(self, book_path, manager, provider, chunks):
+        # Don't start books while the provider is paused after repeated errors
+        manager.retry_policy.breaker.wait_until_closed(self.stop_event)
+        if self.stop_event.is_set():
+            return
+        self.processing_queue.put(("console_print", f"Starting to process: {book_path}"))
+        item = self.get_item_from_book_path(book_path)
+        self.process_single_book(book_path, manager, provider, item, chunks)
+        with self.progress_lock:
+            self.current_book += 1
+            self.processing_queue.put(("update_progress", self.current_book))
 
     def process_single_book(self, book_path: str, manager, provider, item, chunks):
         start_time = time.time()
         try:
             self.processing_queue.put(("update_chunk_progress", (item, 0)))
 
-            title, author, series, series_index = parse_metadata(book_path)
+            title, author, series, series_index = self.get_metadata(book_path)
             if not title or not author:
                 raise ValueError(
                     f"Failed to extract any metadata from {book_path}. Skipping..."
@@ -1245,10 +1358,10 @@ class BookSummarizerGUI:
                 ("console_print", f"Processing: {title} by {author}")
             )
 
-            book_dir = os.path.join(f".{os.sep}summaries", f"{title} - {author}")
+            book_dir = self.get_book_dir(title, author)
             os.makedirs(book_dir, exist_ok=True)
 
-            def progress_callback(step_number, total_steps):
+            def progress_callback(step_number, total_steps, resumed=False):
                 percent_complete = (step_number / total_steps) * 100
                 self.processing_queue.put(
                     ("update_chunk_progress", (item, percent_complete))
@@ -1259,11 +1372,22 @@ class BookSummarizerGUI:
                         (item, round(time.time() - start_time, 2)),
                     )
                 )
+                if resumed:
+                    # Read back from the checkpoint, no request was made
+                    self.processing_queue.put(
+                        (
+                            "console_print",
+                            f"{step_number} of {len(chunks)} chunks of {title} done (resumed)...",
+                        )
+                    )
+                    return
+                # step_number counts finished steps; in map-reduce mode chunks
+                # finish out of order, so it is not the number of a chunk
                 if step_number <= len(chunks):
                     self.processing_queue.put(
                         (
                             "console_print",
-                            f"Processed chunk {step_number}/{len(chunks)} of {title}...",
+                            f"{step_number} of {len(chunks)} chunks of {title} done...",
                         )
                     )
                 else:
@@ -1276,7 +1400,20 @@ class BookSummarizerGUI:
                 self.update_daily_requests(manager.model, provider, 1)
 
             summary = process_chunks(
-                chunks, title, author, book_dir, manager, progress_callback
+                chunks,
+                title,
+                author,
+                book_dir,
+                manager,
+                progress_callback,
+                mode=self.summarization_mode,
+                max_workers=(
+                    self.async_requests.get("max_in_flight", 100)
+                    if isinstance(manager, SyncBridge)
+                    else self.map_reduce_workers
+                ),
+                rolling_context=self.get_rolling_context(manager.max_tokens),
+                stop_event=self.stop_event,
             )
 
             if not summary:
@@ -1310,22 +1447,19 @@ class BookSummarizerGUI:
         except Exception as e:
             logging.error(f"Error processing {book_path}: {e}")
             self.aborted_books.add(book_path)
+            save_aborted_books(self.aborted_books)
             self.console_print(f"Failed to process {book_path}: {str(e)}")
             # add "Aborted" in place of the chunk progress bar
             self.processing_queue.put(("update_chunk_progress", (item, "Aborted")))
 
         finally:
-            time.sleep(0.5) # to account for queue delay
-            self.update_estimated_time()
+            # Drop the book text loaded to materialize its chunks
+            chunks.release()
 
     def get_item_from_book_path(self, book_path):
-        for item in self.file_listbox.get_children():
-            base_name = self.file_listbox.item(item)["values"][0]
-            if self.file_paths.get(base_name) == book_path:
-                return item
-        return None
+        return self.item_by_path.get(book_path)
 
-    def update_estimated_time(self, event=None):
+    def update_estimated_time(self, event=None, on_done=None):
         # don't run if treeview has no items
         selected_model_info = self.get_selected_model_info()
         if selected_model_info:
@@ -1334,8 +1468,15 @@ class BookSummarizerGUI:
             self.loading_wheel.grid()
             self.loading_wheel.start()
             self.process_button.config(state=tk.DISABLED)
+            # A newer estimate replaces one still running, which stops at its
+            # next book, and inherits its callback unless it brings its own
+            self.estimate_generation += 1
+            if on_done:
+                self.pending_estimate_done = on_done
             self.update_time_thread = PyThreadKiller(
-                target=self._update_estimated_time_thread, daemon=True
+                target=self._update_estimated_time_thread,
+                args=(self.estimate_generation,),
+                daemon=True,
             )
             self.update_time_thread.start()
         else:
@@ -1344,13 +1485,30 @@ class BookSummarizerGUI:
             self.loading_wheel.grid_forget()
             self.estimated_time_label.grid()
             self.estimated_time_label.config(text="Estimated requests: N/A")
+            on_done = on_done or self.pending_estimate_done
+            self.pending_estimate_done = None
+            if on_done:
+                # Reports the missing model selection
+                on_done()
+
+    def _update_estimated_time_thread(self, generation):
+        def cancelled():
+            return generation != self.estimate_generation
+
+        self.estimate_process(cancelled)
+        self.master.after(0, self._estimate_done, generation)
 
-    def _update_estimated_time_thread(self):
-        self.estimate_process()
+    def _estimate_done(self, generation):
+        if generation != self.estimate_generation:
+            return
         if self.animate_loading_wheel:
-            self.master.after(0, self.loading_wheel.stop)
+            self.loading_wheel.stop()
             self.loading_wheel.grid_forget()
             self.process_button.config(state=tk.NORMAL)
+        on_done = self.pending_estimate_done
+        self.pending_estimate_done = None
+        if on_done:
+            on_done()
 
     def calculate_available_requests(self, selected_model_info):
         # Assuming `selected_model_info` contains limits like "rpd" or "tpd"
@@ -1381,6 +1539,12 @@ class BookSummarizerGUI:
 
         return available_requests - self.daily_requests[today][provider].get(model, 0)
 
+    def get_provider_info(self, provider: str) -> Dict[str, Any]:
+        for provider_data in self.ai_config["providers"]:
+            if provider == provider_data["name"]:
+                return provider_data
+        return {}
+
     def get_model_info(self, model: str, provider: str) -> Dict[str, Any]:
         for provider_data in self.ai_config["providers"]:
             if provider == provider_data["name"]:
@@ -1407,6 +1571,8 @@ class BookSummarizerGUI:
                     self.update_processing_time(data)
                 elif message == "processing_complete":
                     self.processing_complete()
+                elif message == "refresh_estimate":
+                    self.update_estimated_time()
                 elif message == "console_print":
                     self.console_print(data)
         except Empty:
@@ -1458,11 +1624,18 @@ class BookSummarizerGUI:
         self.update_estimated_time()
 
     def stop_processing(self):
+        # Books running on the worker pool stop after their current request
+        self.stop_event.set()
+
         if self.start_processing_thread and self.start_processing_thread.is_alive():
             self.start_processing_thread.kill()
 
         if self.update_time_thread and self.update_time_thread.is_alive():
-            self.update_time_thread.kill()
+            # The estimate stops at its next book, without running its callback
+            self.estimate_generation += 1
+            self.pending_estimate_done = None
+            self.loading_wheel.stop()
+            self.loading_wheel.grid_forget()
 
         self.console_print("Processing stopped.")
 
@@ -1474,6 +1647,7 @@ class BookSummarizerGUI:
         self.provider_combobox.config(state=tk.DISABLED)
         self.model_combobox.config(state=tk.DISABLED)
         self.process_button.config(state=tk.DISABLED)
+        self.resume_button.config(state=tk.DISABLED)
         self.temperature_slider.config(state=tk.DISABLED)
         self.tokens_slider.config(state=tk.DISABLED)
         self.remove_selected_button.config(state=tk.DISABLED)
@@ -1485,6 +1659,7 @@ class BookSummarizerGUI:
         self.temperature_slider.config(state=tk.NORMAL)
         self.tokens_slider.config(state=tk.NORMAL)
         self.process_button.config(state=tk.NORMAL)
+        self.resume_button.config(state=tk.NORMAL)
         self.remove_selected_button.config(state=tk.NORMAL)
         self.clear_console_button.config(state=tk.NORMAL)
 
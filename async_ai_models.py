@@ -0,0 +1,515 @@
+"""Asyncio counterparts of the managers in ai_models.
+
+Each manager reuses the prompts and response checks of BaseManager but awaits
+the SDK's async client (or httpx for the raw REST providers), so a single event
+loop can keep many requests in flight without a thread per request. As in
+ai_models, each SDK is only imported by the managers that use it.
+
+SyncBridge runs a manager on an event loop thread for the synchronous
+processing code, which hands it whole levels of independent map-reduce
+requests through map_concurrently.
+"""
+
+import abc
+import asyncio
+import logging
+import threading
+import time
+import httpx
+
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterable, Optional
+
+from ai_models import (
+    ALIBABA_BASE_URL,
+    ARLIAI_CHAT_URL,
+    DEEPINFRA_BASE_URL,
+    GLHF_BASE_URL,
+    HYPERBOLIC_CHAT_URL,
+    LLAMACPP_BASE_URL,
+    LMSTUDIO_BASE_URL,
+    OPENROUTER_BASE_URL,
+    CHUNK_SUMMARY_MAX_WORDS,
+    CHUNK_SUMMARY_TARGET_WORDS,
+    BaseManager,
+    anthropic_messages,
+    count_words,
+    gemini_safety_settings,
+    ollama_options,
+    iter_sse_deltas,
+)
+from http_transport import client_kwargs
+from loop_detector import RepetitionDetector
+from retry_policy import RetryBudget
+
+
+async def collect_stream_async(
+    deltas: AsyncIterator[str], max_words: Optional[int] = None, repetition_window: Optional[int] = None
+) -> str:
+    """Join streamed text, abandoning the stream once it runs past max_words or starts looping."""
+    parts = []
+    spaces = 0
+    detector = RepetitionDetector(repetition_window) if repetition_window else None
+    async for delta in deltas:
+        parts.append(delta)
+        if detector:
+            cut = detector.feed(delta)
+            if cut is not None:
+                return "".join(parts)[:cut]
+        spaces += delta.count(" ")
+        if max_words and spaces >= max_words:
+            break
+    return "".join(parts)
+
+
+class AsyncBaseManager(BaseManager, abc.ABC):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._async_rate_limit_lock: Optional[asyncio.Lock] = None
+
+    async def _wait_for_rate_limit(self, prompt: str = ""):
+        """Wait for the model's rate limits, or a minimum time between requests without them"""
+        if self.rate_limiter:
+            await self.rate_limiter.acquire_async(self._estimated_request_tokens(prompt))
+            return
+        if self._async_rate_limit_lock is None:
+            self._async_rate_limit_lock = asyncio.Lock()
+        async with self._async_rate_limit_lock:
+            time_since_last = time.time() - self.last_request_time
+            if time_since_last < self.min_request_interval:
+                await asyncio.sleep(self.min_request_interval - time_since_last)
+            self.last_request_time = time.time()
+
+    @abc.abstractmethod
+    def _stream(self, prompt: str, max_tokens: int) -> AsyncIterator[str]:
+        """Deltas of the model's response, as an async generator."""
+
+    async def _generate_response(self, prompt: str, max_words: Optional[int] = None) -> str:
+        await self._wait_for_rate_limit(prompt)
+        stream = self._stream(prompt, self._max_output_tokens(max_words))
+        try:
+            response = await collect_stream_async(stream, max_words, self.repetition_window)
+        finally:
+            await stream.aclose()
+        if not response:
+            raise ValueError("Empty response from the model")
+        return response
+
+    async def _request(self, prompt: str, max_words: Optional[int] = None) -> str:
+        async with self.concurrency.slot_async():
+            return await self._generate_response(prompt, max_words)
+
+    async def _request_bounded(
+        self, prompt: str, max_words: Optional[int] = None, target_words: Optional[int] = None
+    ) -> str:
+        response = await self._request(prompt, max_words)
+        if max_words and target_words and count_words(response) > max_words:
+            logging.info(f"Response ran past {max_words} words, shortening it")
+            response = await self._request(self._shorten_prompt(response, target_words), max_words)
+        return response
+
+    async def _generate_validated(
+        self,
+        prompt: str,
+        check: Callable[[str], Optional[str]],
+        task: str,
+        give_up: str,
+        retry_budget: Optional[RetryBudget] = None,
+        max_words: Optional[int] = None,
+        target_words: Optional[int] = None,
+    ) -> str:
+        cache_key = self._cache_key(prompt)
+        # The response cache is SQLite, kept off the event loop
+        cached = await asyncio.to_thread(self._cached_response, cache_key, check)
+        if cached:
+            return cached
+        response = await self.retry_policy.call_async(
+            lambda: self._request_bounded(prompt, max_words, target_words),
+            check,
+            task,
+            give_up,
+            retry_budget,
+        )
+        await asyncio.to_thread(self._cache_response, cache_key, response)
+        return response
+
+    async def summarize_chunk(
+        self, content: str, previous_summaries: str, retry_budget: Optional[RetryBudget] = None
+    ) -> str:
+        return await self._generate_validated(
+            self._chunk_prompt(content, previous_summaries),
+            self._check_chunk_summary,
+            "summarization",
+            "Skipping this chunk.",
+            retry_budget,
+            max_words=CHUNK_SUMMARY_MAX_WORDS,
+            target_words=CHUNK_SUMMARY_TARGET_WORDS,
+        )
+
+    async def create_final_summary(
+        self, summaries: str, title: str, author: str, retry_budget: Optional[RetryBudget] = None
+    ) -> str:
+        return await self._generate_validated(
+            self._final_summary_prompt(summaries, title, author),
+            self._check_final_summary,
+            "final summarization",
+            "Skipping final summary creation.",
+            retry_budget,
+        )
+
+    async def condense_summaries(
+        self, summaries: str, max_words: int, retry_budget: Optional[RetryBudget] = None
+    ) -> str:
+        return await self._generate_validated(
+            self._condense_prompt(summaries, max_words),
+            self._condensed_length_check(max_words),
+            "synopsis condensation",
+            "Skipping synopsis condensation.",
+            retry_budget,
+            max_words=int(max_words * 1.25),
+            target_words=max_words,
+        )
+
+    async def aclose(self):
+        """Release the connections held by the async client."""
+        close = getattr(getattr(self, "client", None), "close", None)
+        if close:
+            result = close()
+            if asyncio.iscoroutine(result):
+                await result
+
+
+class AsyncG4FManager(AsyncBaseManager):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        from g4f.client import AsyncClient as G4FAsyncClient
+
+        self.client = G4FAsyncClient()
+        self.min_request_interval = 2.0  # Increased delay for G4F rate limiting
+
+    async def _stream(self, prompt: str, max_tokens: int) -> AsyncIterator[str]:
+        stream = self.client.chat.completions.create(
+            model=self.model,
+            messages=self._messages(prompt),
+            temperature=self.temperature,
+            max_tokens=max_tokens,
+            stream=True,
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+
+class AsyncOpenAIBaseManager(AsyncBaseManager):
+    stream_usage = True
+
+    def __init__(self, api_key: str, base_url: str = None, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        from openai import AsyncOpenAI
+
+        # RetryPolicy is the only retry layer, so that every attempt is budgeted
+        self.client = AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            http_client=httpx.AsyncClient(**client_kwargs()),
+            max_retries=0,
+        )
+
+    async def _stream(self, prompt: str, max_tokens: int) -> AsyncIterator[str]:
+        extra = {"stream_options": {"include_usage": True}} if self.stream_usage else {}
+        raw = await self.client.chat.completions.with_raw_response.create(
+            model=self.model,
+            messages=self._messages(prompt),
+            temperature=self.temperature,
+            max_tokens=max_tokens,
+            stream=True,
+            **extra,
+        )
+        self.concurrency.observe_headers(raw.headers)
+        stream = raw.parse()
+        try:
+            async for chunk in stream:
+                if chunk.usage:
+                    self.prompt_cache_stats.record_openai(chunk.usage)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            await stream.close()
+
+
+class AsyncOpenAIManager(AsyncOpenAIBaseManager):
+    def __init__(self, api_key: str, *args, **kwargs):
+        super().__init__(api_key=api_key, *args, **kwargs)
+
+
+class AsyncLMStudioManager(AsyncOpenAIBaseManager):
+    stream_usage = False
+
+    def __init__(self, base_url: Optional[str] = None, *args, **kwargs):
+        super().__init__(api_key="", base_url=base_url or LMSTUDIO_BASE_URL, *args, **kwargs)
+
+
+class AsyncLlamaCppManager(AsyncOpenAIBaseManager):
+    stream_usage = False
+
+    def __init__(self, base_url: Optional[str] = None, *args, **kwargs):
+        super().__init__(api_key="", base_url=base_url or LLAMACPP_BASE_URL, *args, **kwargs)
+
+
+class AsyncOpenRouterManager(AsyncOpenAIBaseManager):
+    def __init__(self, api_key: str, *args, **kwargs):
+        super().__init__(api_key=api_key, base_url=OPENROUTER_BASE_URL, *args, **kwargs)
+
+
+class AsyncGLHFManager(AsyncOpenAIBaseManager):
+    def __init__(self, api_key: str, *args, **kwargs):
+        super().__init__(api_key=api_key, base_url=GLHF_BASE_URL, *args, **kwargs)
+
+
+class AsyncAlibabaManager(AsyncOpenAIBaseManager):
+    def __init__(self, api_key: str, *args, **kwargs):
+        super().__init__(api_key=api_key, base_url=ALIBABA_BASE_URL, *args, **kwargs)
+
+
+class AsyncDeepInfraManager(AsyncOpenAIBaseManager):
+    def __init__(self, api_key: str, *args, **kwargs):
+        super().__init__(api_key=api_key, base_url=DEEPINFRA_BASE_URL, *args, **kwargs)
+
+
+class AsyncMistralManager(AsyncBaseManager):
+    def __init__(self, api_key: str, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        from mistralai import Mistral
+
+        self.client = Mistral(api_key=api_key)
+
+    async def _stream(self, prompt: str, max_tokens: int) -> AsyncIterator[str]:
+        stream = await self.client.chat.stream_async(
+            model=self.model,
+            temperature=self.temperature,
+            messages=self._messages(prompt),
+            max_tokens=max_tokens,
+        )
+        async for event in stream:
+            if event.data.choices and event.data.choices[0].delta.content:
+                yield event.data.choices[0].delta.content
+
+    async def aclose(self):
+        pass
+
+
+class AsyncOllamaManager(AsyncBaseManager):
+    """Expects the Ollama server to be running already, see local_backends."""
+
+    repetition_window = 50
+
+    def __init__(
+        self,
+        *args,
+        host: Optional[str] = None,
+        num_ctx: Optional[int] = None,
+        keep_alive: Optional[int] = None,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        import ollama
+
+        self.client = ollama.AsyncClient(host=host)
+        self.num_ctx = num_ctx
+        self.keep_alive = keep_alive
+
+    async def _stream(self, prompt: str, max_tokens: int) -> AsyncIterator[str]:
+        stream = await self.client.chat(
+            model=self.model,
+            messages=self._messages(prompt),
+            stream=True,
+            options=ollama_options(self.temperature, max_tokens, self.num_ctx),
+            keep_alive=self.keep_alive,
+        )
+        async for chunk in stream:
+            yield chunk["message"]["content"]
+
+    async def aclose(self):
+        pass
+
+
+class AsyncGeminiManager(AsyncBaseManager):
+    def __init__(self, api_key: str, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        from google import genai
+
+        self.client = genai.Client(api_key=api_key)
+
+    async def _stream(self, prompt: str, max_tokens: int) -> AsyncIterator[str]:
+        from google.genai import types
+
+        stream = await self.client.aio.models.generate_content_stream(
+            model=self.model,
+            contents=prompt,
+            config=types.GenerateContentConfig(
+                temperature=self.temperature,
+                max_output_tokens=max_tokens,
+                safety_settings=gemini_safety_settings(),
+            ),
+        )
+        usage_metadata = None
+        async for chunk in stream:
+            usage_metadata = chunk.usage_metadata or usage_metadata
+            if chunk.text:
+                yield chunk.text
+        self.prompt_cache_stats.record_gemini(usage_metadata)
+
+    async def aclose(self):
+        pass
+
+
+class AsyncHuggingFaceManager(AsyncBaseManager):
+    def __init__(self, api_key: str, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        from huggingface_hub import AsyncInferenceClient
+
+        self.client = AsyncInferenceClient(api_key=api_key)
+
+    async def _stream(self, prompt: str, max_tokens: int) -> AsyncIterator[str]:
+        stream = await self.client.chat.completions.create(
+            model=self.model,
+            messages=self._messages(prompt),
+            temperature=self.temperature,
+            max_tokens=max_tokens,
+            stream=True,
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+
+class AsyncAnthropicManager(AsyncBaseManager):
+    def __init__(self, api_key: str, base_url: Optional[str] = None, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        import anthropic
+
+        self.client = anthropic.AsyncAnthropic(api_key=api_key, base_url=base_url, max_retries=0)
+
+    async def _stream(self, prompt: str, max_tokens: int) -> AsyncIterator[str]:
+        async with self.client.messages.stream(
+            model=self.model,
+            max_tokens=max_tokens,
+            temperature=self.temperature,
+            system=self.system_message,
+            messages=anthropic_messages(prompt),
+        ) as stream:
+            response = getattr(stream, "response", None)
+            if response is not None:
+                self.concurrency.observe_headers(response.headers)
+            async for text in stream.text_stream:
+                yield text
+            message = await stream.get_final_message()
+            self.prompt_cache_stats.record_anthropic(message.usage)
+
+
+class AsyncRestManager(AsyncBaseManager):
+    """OpenAI-style chat completion endpoints called through httpx."""
+
+    url = ""
+
+    def __init__(self, api_key: str, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.client = httpx.AsyncClient(
+            headers={"Authorization": f"Bearer {api_key}"}, **client_kwargs()
+        )
+
+    def _payload(self, prompt: str, max_tokens: int) -> dict:
+        return {
+            "model": self.model,
+            "messages": self._messages(prompt),
+            "temperature": self.temperature,
+            "max_tokens": max_tokens,
+            "stream": True,
+        }
+
+    async def _stream(self, prompt: str, max_tokens: int) -> AsyncIterator[str]:
+        async with self.client.stream(
+            "POST", self.url, json=self._payload(prompt, max_tokens)
+        ) as response:
+            self.concurrency.observe_headers(response.headers)
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                for delta in iter_sse_deltas([line]):
+                    yield delta
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+class AsyncArliAiManager(AsyncRestManager):
+    url = ARLIAI_CHAT_URL
+
+
+class AsyncHyperbolicManager(AsyncRestManager):
+    url = HYPERBOLIC_CHAT_URL
+
+    def _payload(self, prompt: str, max_tokens: int) -> dict:
+        return super()._payload(prompt, max_tokens) | {"top_p": 0.9}
+
+
+class EventLoopThread:
+    """An asyncio event loop running on a daemon thread."""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self.loop.run_forever, name="async-managers", daemon=True
+        )
+        self._thread.start()
+
+    def run(self, coroutine: Awaitable) -> Any:
+        """Run coroutine on the loop and wait for its result in the calling thread."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def stop(self) -> None:
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+class SyncBridge:
+    """Synchronous face of an async manager, for process_chunks and RollingContext.
+
+    Every call runs on one event loop thread shared by all books, so the async
+    client and its connections stay on a single loop. Attributes other than
+    the summarization methods are those of the wrapped manager."""
+
+    def __init__(self, manager: AsyncBaseManager):
+        self.manager = manager
+        self.loop = EventLoopThread()
+
+    def __getattr__(self, name):
+        return getattr(self.manager, name)
+
+    def summarize_chunk(self, *args, **kwargs) -> str:
+        return self.loop.run(self.manager.summarize_chunk(*args, **kwargs))
+
+    def create_final_summary(self, *args, **kwargs) -> str:
+        return self.loop.run(self.manager.create_final_summary(*args, **kwargs))
+
+    def condense_summaries(self, *args, **kwargs) -> str:
+        return self.loop.run(self.manager.condense_summaries(*args, **kwargs))
+
+    def map_concurrently(
+        self, request: Callable[[Any], Awaitable[Any]], items: Iterable, max_in_flight: int
+    ) -> list:
+        """Await request(item) for every item on the loop, at most max_in_flight at a time, in order."""
+
+        async def run_all():
+            semaphore = asyncio.Semaphore(max_in_flight)
+
+            async def run_one(item):
+                async with semaphore:
+                    return await request(item)
+
+            return await asyncio.gather(*(run_one(item) for item in items))
+
+        return self.loop.run(run_all())
+
+    def close(self) -> None:
+        try:
+            self.loop.run(self.manager.aclose())
+        finally:
+            self.loop.stop()
@@ -0,0 +1,184 @@
+"""Bulk chunk summarization through provider batch APIs.
+
+Batch jobs trade latency for much higher throughput limits at about half the
+price, which suits overnight library runs. Only map-reduce chunk summaries are
+independent of each other, so those are what gets batched: accepted results are
+saved and checkpointed exactly like interactive ones, and process_chunks then
+resumes each book from its checkpoint, merging the summaries and redoing any
+chunk the batch could not deliver.
+
+Submitted jobs are recorded in the checkpoints of their books until their
+results are collected, so a run that is closed or fails while waiting leaves
+them to the next run instead of paying for the chunks again.
+"""
+
+import hashlib
+import json
+import logging
+import threading
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from checkpoint import BookCheckpoint
+from chunk_planner import BookChunks
+from utils import save_chunk_summary
+
+MAX_REQUESTS_PER_BATCH = 10000
+
+
+def iter_batches(
+    requests: Iterable[dict], max_requests: int, max_bytes: int
+) -> Iterator[List[dict]]:
+    """Group requests into batches within a request count and encoded size.
+
+    A request larger than max_bytes on its own still gets a batch of its own,
+    for the provider to reject."""
+    batch = []
+    size = 0
+    for request in requests:
+        request_size = len(json.dumps(request).encode("utf-8")) + 1
+        if batch and (len(batch) >= max_requests or size + request_size > max_bytes):
+            yield batch
+            batch = []
+            size = 0
+        batch.append(request)
+        size += request_size
+    if batch:
+        yield batch
+
+
+def custom_id(book_dir: str, chunk_number: int) -> str:
+    """Request id of a chunk, the same in every run so resumed jobs map back to it."""
+    return f"{hashlib.sha256(book_dir.encode('utf-8')).hexdigest()[:16]}-{chunk_number}"
+
+
+def summarize_chunks_in_batch(
+    manager,
+    books: Iterable[Tuple[str, str, str, BookChunks]],
+    poll_interval: float = 60.0,
+    max_requests_per_batch: int = MAX_REQUESTS_PER_BATCH,
+    stop_event: Optional[threading.Event] = None,
+    report: Callable[[str], None] = logging.info,
+) -> int:
+    """Summarize the missing chunks of (title, author, book_dir, chunks) books in batch jobs.
+
+    Requests are built one book at a time and each batch is submitted as soon as
+    it is full, so only one batch is held in memory. Jobs an earlier run left in
+    the books' checkpoints are waited for alongside the new ones, and their
+    chunks are not submitted again. Jobs still running when the wait fails or
+    is stopped are cancelled. Returns the number of chunk summaries saved."""
+    targets = {}  # custom id -> (title, author, book_dir, checkpoint, index, cache key)
+    batch_targets: Dict[str, List[str]] = {}  # batch id -> custom ids
+    resumed = []
+
+    def requests():
+        for title, author, book_dir, chunks in books:
+            checkpoint = BookCheckpoint(
+                book_dir, chunks.fingerprint(), "map_reduce", f"{manager.provider}/{manager.model}"
+            )
+            in_flight = set()
+            for batch_id, chunk_numbers in checkpoint.batches.items():
+                if batch_id not in batch_targets:
+                    resumed.append(batch_id)
+                for number in chunk_numbers:
+                    request_id = custom_id(book_dir, number)
+                    # The prompt is not rebuilt, so the response is not cached
+                    targets[request_id] = (title, author, book_dir, checkpoint, number - 1, None)
+                    batch_targets.setdefault(batch_id, []).append(request_id)
+                in_flight.update(chunk_numbers)
+            try:
+                for index in range(len(chunks)):
+                    if checkpoint.is_done(index + 1) or index + 1 in in_flight:
+                        continue
+                    request_id = custom_id(book_dir, index + 1)
+                    prompt = manager._chunk_prompt(chunks[index], "")
+                    # Only the cache key is kept for the results, not the prompt
+                    targets[request_id] = (
+                        title, author, book_dir, checkpoint, index, manager._cache_key(prompt)
+                    )
+                    yield manager.batch_request(request_id, prompt)
+            finally:
+                chunks.release()
+
+    def record(batch_id, request_ids):
+        batch_targets[batch_id] = request_ids
+        by_checkpoint = {}
+        for request_id in request_ids:
+            checkpoint, index = targets[request_id][3:5]
+            by_checkpoint.setdefault(checkpoint, []).append(index + 1)
+        for checkpoint, chunk_numbers in by_checkpoint.items():
+            checkpoint.add_batch(batch_id, chunk_numbers)
+
+    def forget(batch_id):
+        for checkpoint in {targets[request_id][3] for request_id in batch_targets[batch_id]}:
+            checkpoint.remove_batch(batch_id)
+
+    def cancel(batch_ids):
+        for batch_id in batch_ids:
+            try:
+                manager.cancel_batch(batch_id)
+            except Exception as e:
+                # Left in the checkpoints, for the next run to collect
+                logging.error(f"Failed to cancel batch job {batch_id}: {e}")
+                continue
+            forget(batch_id)
+
+    submitted = 0
+    for batch in iter_batches(requests(), max_requests_per_batch, manager.max_batch_bytes):
+        if stop_event and stop_event.is_set():
+            break
+        record(manager.submit_batch(batch), [request["custom_id"] for request in batch])
+        submitted += len(batch)
+    if not batch_targets:
+        return 0
+    if resumed:
+        report(f"Waiting for {len(resumed)} batch job(s) submitted by an earlier run...")
+    if submitted:
+        report(
+            f"Submitted {submitted} chunk summaries in "
+            f"{len(batch_targets) - len(resumed)} batch job(s)..."
+        )
+
+    pending = set(batch_targets)
+    started = time.time()
+    try:
+        while pending:
+            if stop_event:
+                stop_event.wait(poll_interval)
+            else:
+                time.sleep(poll_interval)
+            if stop_event and stop_event.is_set():
+                cancel(pending)
+                report("Batch jobs cancelled.")
+                return 0
+            pending = {batch_id for batch_id in pending if not manager.batch_done(batch_id)}
+            report(
+                f"{len(batch_targets) - len(pending)}/{len(batch_targets)} batch job(s) finished "
+                f"after {int(time.time() - started)}s..."
+            )
+    except Exception:
+        # Running jobs would otherwise be paid for again by the interactive fallback
+        cancel(pending)
+        raise
+
+    saved = 0
+    for batch_id, request_ids in batch_targets.items():
+        results = manager.batch_results(batch_id)
+        for request_id in request_ids:
+            summary = results.get(request_id)
+            title, author, book_dir, checkpoint, index, cache_key = targets[request_id]
+            if summary is None or checkpoint.is_done(index + 1):
+                continue
+            problem = manager._check_chunk_summary(summary)
+            if problem:
+                logging.error(f"Batch summary of chunk {index + 1} of {title} rejected: {problem}.")
+                continue
+            save_chunk_summary(book_dir, title, author, index + 1, summary)
+            checkpoint.mark_done(index + 1)
+            manager._cache_response(cache_key, summary)
+            saved += 1
+        forget(batch_id)
+
+    total = sum(len(request_ids) for request_ids in batch_targets.values())
+    report(f"Batch jobs returned {saved}/{total} usable chunk summaries.")
+    return saved
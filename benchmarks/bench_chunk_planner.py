@@ -0,0 +1,121 @@
+"""Compare the chunk planner against the retry loop it replaced.
+
+Run with `python benchmarks/bench_chunk_planner.py`.
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chunk_planner import BookChunks, plan_chunks
+
+
+def legacy_plan(content, max_tokens, tpm):
+    """The 200-iteration reduction loop formerly in BookSummarizerGUI.preprocess_books."""
+    total_tokens = int(len(content.split()) * 1.3)
+    initial_chunk_size = min(int(max_tokens * 0.8), tpm)
+    reduction_factor = 1
+    max_allowed_tokens = int(max_tokens * 0.90)
+
+    for _ in range(200):
+        chunks = []
+        current_token_count = 0
+        content_words = content.split()
+        previous_summary_tokens = 0
+
+        while current_token_count < total_tokens:
+            chunk_size = max(
+                int((initial_chunk_size * reduction_factor) - previous_summary_tokens),
+                max_tokens // 10,
+            )
+            chunk_word_count = int(chunk_size / 1.3)
+            if chunk_size + previous_summary_tokens > max_allowed_tokens:
+                break
+            chunks.append(
+                " ".join(
+                    content_words[current_token_count : current_token_count + chunk_word_count]
+                )
+            )
+            current_token_count += chunk_word_count
+            previous_summary_tokens += 1000
+
+        if current_token_count >= total_tokens or (
+            chunk_size + previous_summary_tokens <= max_allowed_tokens
+        ):
+            break
+
+        reduction_factor -= 0.01
+
+    return chunks if current_token_count >= total_tokens else None
+
+
+def new_plan(content, max_tokens, tpm):
+    plan = plan_chunks(len(content.split()), max_tokens, tpm)
+    if not plan.feasible:
+        return None
+    return BookChunks.from_plan("benchmark", plan, content, lambda _: content)
+
+
+def resident_bytes(chunks):
+    """Memory a queued book keeps between preprocessing and processing."""
+    if isinstance(chunks, BookChunks):
+        return sum(
+            sys.getsizeof(offsets)
+            for offsets in (chunks.char_starts, chunks.char_ends, chunks.word_counts)
+        )
+    return sum(sys.getsizeof(chunk) for chunk in chunks)
+
+
+def make_book(word_count, seed=0):
+    rng = random.Random(seed)
+    vocabulary = ["".join(rng.choices("abcdefghijklmnopqrstuvwxyz", k=rng.randint(2, 9))) for _ in range(5000)]
+    words = rng.choices(vocabulary, k=word_count)
+    paragraphs = [" ".join(words[i : i + 120]) for i in range(0, word_count, 120)]
+    return "\n\n".join(paragraphs)
+
+
+def timed(func, *args, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    cases = [
+        (60_000, 32768, float("inf")),
+        (250_000, 128000, 200000),
+        (250_000, 32768, float("inf")),  # too long for this context
+        (500_000, 200000, 20000),
+    ]
+    for word_count, max_tokens, tpm in cases:
+        content = make_book(word_count)
+        legacy_time, legacy_chunks = timed(legacy_plan, content, max_tokens, tpm, repeat=1)
+        new_time, new_chunks = timed(new_plan, content, max_tokens, tpm)
+
+        # The legacy loop compared words against tokens, so it padded feasible
+        # plans with empty chunks; apart from those the plans must be identical.
+        if legacy_chunks is not None:
+            assert list(new_chunks) == [chunk for chunk in legacy_chunks if chunk], "plans differ"
+            new_chunks.release()
+
+        print(
+            f"{word_count:>7} words, max_tokens={max_tokens:>6}, tpm={tpm}: "
+            f"legacy {legacy_time * 1000:9.1f} ms ({'-' if legacy_chunks is None else len(legacy_chunks)} chunks), "
+            f"planner {new_time * 1000:7.1f} ms ({'-' if new_chunks is None else len(new_chunks)} chunks), "
+            f"x{legacy_time / new_time:.1f}"
+        )
+        if legacy_chunks is not None:
+            print(
+                f"{'':>7} queued chunks: legacy {resident_bytes(legacy_chunks) / 1024:9.1f} KiB, "
+                f"offsets {resident_bytes(new_chunks) / 1024:9.1f} KiB"
+            )
+
+
+if __name__ == "__main__":
+    main()
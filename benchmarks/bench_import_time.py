@@ -0,0 +1,91 @@
+"""Check that launching the app imports no provider SDK and stays within a time budget.
+
+Every measurement runs in a fresh interpreter, so nothing is already cached in
+sys.modules. Run with `python benchmarks/bench_import_time.py`; it exits with
+an error when the budget is exceeded or an SDK is imported eagerly.
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Cold import of the app's modules, GUI toolkit aside, must stay under this
+STARTUP_BUDGET_MS = 500
+
+# The non-GUI modules app.py imports at launch
+STARTUP_MODULES = [
+    "providers", "ai_models", "async_ai_models", "local_backends", "batch_runner", "utils"
+]
+
+# What ai_models used to import eagerly
+PROVIDER_SDKS = [
+    "ollama",
+    "anthropic",
+    "g4f",
+    "google.genai",
+    "huggingface_hub",
+    "openai",
+    "mistralai",
+]
+
+_PROBE = """
+import importlib, json, sys, time
+modules = json.loads(sys.argv[1])
+start = time.perf_counter()
+failed = []
+for module in modules:
+    try:
+        importlib.import_module(module)
+    except ImportError:
+        failed.append(module)
+elapsed = time.perf_counter() - start
+sdks = [m for m in json.loads(sys.argv[2]) if m in sys.modules]
+print(json.dumps({"seconds": elapsed, "failed": failed, "sdks": sdks}))
+"""
+
+
+def cold_import(modules, repeat=5):
+    """Best time to import modules in a fresh interpreter, plus the SDKs that came along."""
+    best = None
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", _PROBE, json.dumps(modules), json.dumps(PROVIDER_SDKS)],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        result = json.loads(output)
+        if best is None or result["seconds"] < best["seconds"]:
+            best = result
+    return best
+
+
+def main():
+    startup = cold_import(STARTUP_MODULES)
+    sdks = cold_import(PROVIDER_SDKS, repeat=3)
+
+    print(f"app modules: {startup['seconds'] * 1000:8.1f} ms (budget {STARTUP_BUDGET_MS} ms)")
+    available = [m for m in PROVIDER_SDKS if m not in sdks["failed"]]
+    print(
+        f"provider SDKs avoided: {sdks['seconds'] * 1000:8.1f} ms "
+        f"({len(available)}/{len(PROVIDER_SDKS)} installed)"
+    )
+
+    problems = []
+    if startup["failed"]:
+        problems.append(f"could not import {', '.join(startup['failed'])}")
+    if startup["sdks"]:
+        problems.append(f"imported eagerly: {', '.join(startup['sdks'])}")
+    if startup["seconds"] * 1000 > STARTUP_BUDGET_MS:
+        problems.append(f"over the {STARTUP_BUDGET_MS} ms budget")
+    if problems:
+        sys.exit("FAIL: " + "; ".join(problems))
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Compare the rolling-hash repetition detector against the Ollama stream loop it replaced.
+
+Run with `python benchmarks/bench_loop_detector.py`.
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ai_models import collect_stream
+
+
+def legacy_collect(deltas):
+    """The repeat check formerly in OllamaManager._generate_response."""
+    response = ""
+    latest_50 = ""
+    for i, delta in enumerate(deltas):
+        response += delta
+        latest_50 += delta
+        if i >= 50:
+            latest_50 = latest_50[-50:]
+            if response.count(latest_50) > 1:
+                return " ".join(response.split(latest_50)[:-1])
+    return response
+
+
+def make_stream(token_count, loop_after=None, seed=0):
+    """Tokens of a generation, optionally falling into a loop after loop_after tokens."""
+    rng = random.Random(seed)
+    vocabulary = ["".join(rng.choices("abcdefghijklmnopqrstuvwxyz", k=rng.randint(2, 9))) for _ in range(5000)]
+    tokens = [word + " " for word in rng.choices(vocabulary, k=token_count)]
+    if loop_after is not None:
+        phrase = tokens[loop_after - 30 : loop_after]
+        tokens = tokens[:loop_after] + phrase * ((token_count - loop_after) // len(phrase) + 1)
+    return tokens[:token_count]
+
+
+def timed(func, *args, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    cases = [(1_000, None), (4_000, None), (16_000, None), (16_000, 12_000)]
+    for token_count, loop_after in cases:
+        tokens = make_stream(token_count, loop_after)
+        legacy_time, legacy_text = timed(legacy_collect, tokens, repeat=1)
+        new_time, new_text = timed(collect_stream, tokens, None, 50)
+        print(
+            f"{token_count:>6} tokens, {'looping' if loop_after else 'no loop':>7}: "
+            f"legacy {legacy_time * 1000:8.1f} ms ({len(legacy_text)} chars), "
+            f"detector {new_time * 1000:6.1f} ms ({len(new_text)} chars), "
+            f"x{legacy_time / new_time:.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""Calibre library folders read through their metadata.db.
+
+Calibre keeps the title, authors, series and formats of every book in one
+SQLite database at the library root, with each book's files in a folder named
+by its `path` column. Reading that database in a single query replaces walking
+the library and parsing an OPF file per book.
+
+Calibre 6+ also stores the text its full-text indexer extracted from every
+format in full-text-search.db, which spares converting and parsing the book
+again when the indexed format is still the file on disk.
+"""
+
+import logging
+import os
+import re
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from extraction_cache import file_hash
+
+METADATA_DB = "metadata.db"
+FTS_DB = "full-text-search.db"
+
+# Formats the app can read, best first: EPUB needs no conversion
+FORMAT_PREFERENCE = ("EPUB", "AZW3", "MOBI")
+
+_BOOKS_QUERY = f"""
+WITH preferred_format AS (
+    SELECT book, format, name, ROW_NUMBER() OVER (
+        PARTITION BY book
+        ORDER BY CASE format {" ".join(f"WHEN '{f}' THEN {i}" for i, f in enumerate(FORMAT_PREFERENCE))} END
+    ) AS rank
+    FROM data
+    WHERE format IN ({", ".join(f"'{f}'" for f in FORMAT_PREFERENCE)})
+), first_author AS (
+    SELECT link.book, authors.name, ROW_NUMBER() OVER (PARTITION BY link.book ORDER BY link.id) AS rank
+    FROM books_authors_link AS link JOIN authors ON authors.id = link.author
+)
+SELECT books.title, first_author.name, series.name, books.series_index,
+       books.path, preferred_format.name, preferred_format.format
+FROM books
+JOIN preferred_format ON preferred_format.book = books.id AND preferred_format.rank = 1
+LEFT JOIN first_author ON first_author.book = books.id AND first_author.rank = 1
+LEFT JOIN books_series_link ON books_series_link.book = books.id
+LEFT JOIN series ON series.id = books_series_link.series
+ORDER BY books.sort
+"""
+
+# Book folders are named "Title (book id)" under an author folder
+_BOOK_DIR_RE = re.compile(r"\((\d+)\)$")
+
+_fts_connections: Dict[str, sqlite3.Connection] = {}
+_fts_lock = threading.Lock()
+
+
+class CalibreBook:
+    """A book of a Calibre library, in its preferred readable format."""
+
+    def __init__(
+        self,
+        file_path: str,
+        title: str,
+        author: str,
+        series: str,
+        series_index: str,
+    ):
+        self.file_path = file_path
+        self.title = title
+        self.author = author
+        self.series = series
+        self.series_index = series_index
+
+    def metadata(self) -> Tuple[str, str, str, str]:
+        """Title, author, series and series index, as parse_metadata returns them."""
+        return self.title, self.author, self.series, self.series_index
+
+
+def is_calibre_library(folder: str) -> bool:
+    return os.path.isfile(os.path.join(folder, METADATA_DB))
+
+
+def read_library(library_dir: str) -> Optional[List[CalibreBook]]:
+    """Every book of the library that has a readable format, None when it cannot be read."""
+    db_path = os.path.join(library_dir, METADATA_DB)
+    if not os.path.isfile(db_path):
+        return None
+    try:
+        connection = _connect_read_only(db_path)
+        try:
+            rows = connection.execute(_BOOKS_QUERY).fetchall()
+        finally:
+            connection.close()
+    except sqlite3.Error as e:
+        logging.warning(f"Failed to read the Calibre library {db_path}: {e}")
+        return None
+
+    books = []
+    for title, author, series, series_index, book_path, name, book_format in rows:
+        file_path = os.path.join(library_dir, book_path, f"{name}.{book_format.lower()}")
+        if not os.path.isfile(file_path):
+            logging.warning(f"Missing from the Calibre library: {file_path}")
+            continue
+        books.append(
+            CalibreBook(
+                file_path,
+                title,
+                author or "",
+                series or "",
+                str(float(series_index)) if series else "",
+            )
+        )
+    return books
+
+
+def _connect_read_only(db_path: str) -> sqlite3.Connection:
+    # Read-only, so a running Calibre keeps exclusive control of its database
+    return sqlite3.connect(
+        f"{Path(db_path).resolve().as_uri()}?mode=ro", uri=True, check_same_thread=False
+    )
+
+
+def library_book(file_path: str) -> Optional[Tuple[str, int]]:
+    """Library root and book id of a file stored in a Calibre library, None for other files."""
+    book_dir = os.path.dirname(os.path.abspath(file_path))
+    match = _BOOK_DIR_RE.search(os.path.basename(book_dir))
+    if not match:
+        return None
+    library_dir = os.path.dirname(os.path.dirname(book_dir))
+    if not is_calibre_library(library_dir):
+        return None
+    return library_dir, int(match.group(1))
+
+
+def indexed_text(file_path: str, digest: Optional[str] = None) -> Optional[str]:
+    """Text Calibre's full-text indexer extracted from file_path, None unless present and current.
+
+    The index entry only counts when it was made from this exact file, as
+    recorded by its size and sha256 hash, and the extraction succeeded. digest
+    is the file's sha256 when the caller already has it."""
+    located = library_book(file_path)
+    if located is None:
+        return None
+    fts_path = os.path.join(located[0], FTS_DB)
+    if not os.path.isfile(fts_path):
+        return None
+
+    book_format = os.path.splitext(file_path)[1][1:].upper()
+    try:
+        with _fts_lock:
+            connection = _fts_connections.get(fts_path)
+            if connection is None:
+                connection = _fts_connections[fts_path] = _connect_read_only(fts_path)
+            row = connection.execute(
+                """SELECT format_size, format_hash, searchable_text FROM books_text
+                WHERE book = ? AND format = ? AND COALESCE(err_msg, '') = ''""",
+                (located[1], book_format),
+            ).fetchone()
+    except sqlite3.Error as e:
+        logging.warning(f"Failed to read the Calibre full-text index {fts_path}: {e}")
+        return None
+
+    if row is None:
+        return None
+    format_size, format_hash, text = row
+    if not text or format_size != os.path.getsize(file_path):
+        return None
+    if format_hash != (digest or file_hash(file_path)):
+        return None
+    return text
@@ -0,0 +1,67 @@
+import json
+import logging
+import os
+import threading
+from typing import Dict, Iterable, List, Set
+
+CHECKPOINT_FILE = "checkpoint.json"
+
+
+class BookCheckpoint:
+    """Manifest of the chunk summaries already written for a book.
+
+    It is stored next to the chunk summaries and only trusted while the chunk
+    plan, the summarization mode and the model it was recorded for are
+    unchanged, so an interrupted or aborted book resumes from its first
+    missing chunk instead of starting over. It also lists the provider batch
+    jobs still summarizing chunks of the book, for a later run to collect.
+    """
+
+    def __init__(self, book_dir: str, plan_hash: str, mode: str, model: str):
+        self.path = os.path.join(book_dir, CHECKPOINT_FILE)
+        self.identity = {"plan_hash": plan_hash, "mode": mode, "model": model}
+        self.completed: Set[int] = set()
+        self.batches: Dict[str, List[int]] = {}  # batch id -> chunk numbers
+        self._lock = threading.Lock()
+
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable checkpoint {self.path}: {e}")
+            return
+        if all(manifest.get(k) == v for k, v in self.identity.items()):
+            self.completed = set(manifest.get("completed_chunks", []))
+            self.batches = manifest.get("pending_batches", {})
+
+    def is_done(self, chunk_number: int) -> bool:
+        return chunk_number in self.completed
+
+    def mark_done(self, chunk_number: int) -> None:
+        with self._lock:
+            self.completed.add(chunk_number)
+            self._save()
+
+    def add_batch(self, batch_id: str, chunk_numbers: Iterable[int]) -> None:
+        with self._lock:
+            self.batches[batch_id] = sorted(chunk_numbers)
+            self._save()
+
+    def remove_batch(self, batch_id: str) -> None:
+        with self._lock:
+            if self.batches.pop(batch_id, None) is not None:
+                self._save()
+
+    def _save(self) -> None:
+        manifest = {**self.identity, "completed_chunks": sorted(self.completed)}
+        if self.batches:
+            manifest["pending_batches"] = self.batches
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(manifest, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logging.warning(f"Failed to write checkpoint {self.path}: {e}")
@@ -0,0 +1,357 @@
+"""Chunk planning for book summarization.
+
+Every chunk is sent together with the summaries of the previous chunks, which
+are estimated at SUMMARY_TOKENS each. Chunk j therefore gets
+``max(initial_chunk_size - SUMMARY_TOKENS * j, max_tokens // 10)`` tokens and
+the plan is only valid while ``chunk_size + previous_summary_tokens`` stays under
+90% of the context. That constraint does not depend on how big the earlier
+chunks were, so the largest feasible chunk size for each position can be
+computed directly and the book is tokenized and walked exactly once. Shrinking
+the chunks (what the old reduction loop did) can only lower the number of words
+that fit, so a book that does not fit this plan does not fit any.
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+from array import array
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from extraction_cache import EXTRACTOR_VERSION, file_hash
+
+# Bump whenever the plans produced for the same inputs change.
+PLANNER_VERSION = 1
+
+TOKENS_PER_WORD = 1.3
+SUMMARY_TOKENS = 1000
+
+# Same characters as str.split() treats as whitespace
+_WORD_RE = re.compile(r"\S+")
+
+
+def estimate_tokens(text: str) -> int:
+    return int(len(text.split()) * TOKENS_PER_WORD)
+
+
+class ChunkPlan:
+    """Word ranges of every chunk of a book, plus the per-chunk token budget.
+
+    Chunk i covers words ``word_offsets[i]`` to ``word_offsets[i + 1]``."""
+
+    def __init__(
+        self,
+        word_offsets: array,
+        chunk_info: List[Dict[str, Any]],
+        total_tokens: int,
+        capacity_tokens: int,
+        feasible: bool,
+    ):
+        self.word_offsets = word_offsets
+        self.chunk_info = chunk_info
+        self.total_tokens = total_tokens
+        self.capacity_tokens = capacity_tokens
+        self.feasible = feasible
+
+    def __len__(self) -> int:
+        return max(len(self.word_offsets) - 1, 0)
+
+
+def plan_chunks(
+    word_count: int,
+    max_tokens: int,
+    tpm=float("inf"),
+    summary_budget: Optional[int] = None,
+) -> ChunkPlan:
+    """Split word_count words into chunks that fit the model context.
+
+    summary_budget caps the previous summaries sent with each chunk, as done by
+    a rolling context; without it they grow by SUMMARY_TOKENS per chunk."""
+    max_tokens = int(max_tokens)
+    initial_chunk_size = min(int(max_tokens * 0.8), tpm)
+    min_chunk_size = max_tokens // 10
+    max_allowed_tokens = int(max_tokens * 0.90)
+    total_tokens = int(word_count * TOKENS_PER_WORD)
+
+    word_offsets = array("I", [0])
+    chunk_info = []
+    start = 0
+    previous_summary_tokens = 0
+    capacity_tokens = 0
+
+    while start < word_count:
+        chunk_size = max(
+            int(initial_chunk_size - previous_summary_tokens), min_chunk_size
+        )
+        if chunk_size + previous_summary_tokens > max_allowed_tokens:
+            return ChunkPlan(
+                word_offsets, chunk_info, total_tokens, capacity_tokens, False
+            )
+
+        start = min(start + max(int(chunk_size / TOKENS_PER_WORD), 1), word_count)
+        word_offsets.append(start)
+        chunk_info.append(
+            {"chunk_size": chunk_size, "summary_tokens": previous_summary_tokens}
+        )
+        capacity_tokens += chunk_size
+        previous_summary_tokens += SUMMARY_TOKENS
+        if summary_budget is not None:
+            previous_summary_tokens = min(previous_summary_tokens, summary_budget)
+
+    return ChunkPlan(word_offsets, chunk_info, total_tokens, capacity_tokens, True)
+
+
+def chunk_spans(text: str, plan: ChunkPlan) -> Tuple[array, array]:
+    """Return the start and end character offsets of every planned chunk.
+
+    Words are counted line by line with str.split, and only the lines holding
+    a chunk boundary are scanned word by word."""
+    offsets = plan.word_offsets
+    starts = array("I")
+    ends = array("I")
+    if not len(plan):
+        return starts, ends
+
+    # Word indices whose start (first word of a chunk) or end (last word) is needed
+    wanted = sorted(
+        [(offsets[i], "start") for i in range(len(plan))]
+        + [(offsets[i + 1] - 1, "end") for i in range(len(plan))]
+    )
+    next_wanted = 0
+    word_index = 0
+    position = 0
+    for line in text.splitlines(keepends=True):
+        line_words = len(line.split())
+        if wanted[next_wanted][0] < word_index + line_words:
+            for offset, match in enumerate(_WORD_RE.finditer(line), word_index):
+                while next_wanted < len(wanted) and wanted[next_wanted][0] == offset:
+                    if wanted[next_wanted][1] == "start":
+                        starts.append(position + match.start())
+                    else:
+                        ends.append(position + match.end())
+                    next_wanted += 1
+            if next_wanted == len(wanted):
+                break
+        word_index += line_words
+        position += len(line)
+
+    return starts, ends
+
+
+class BookChunks:
+    """The chunks of one book, stored as character ranges into its text.
+
+    Only the chunk offsets and word counts are kept, so a queue
+    of books does not hold a second copy of the library in memory. The book
+    text is loaded through load_text the first time a chunk is requested, and
+    dropped again with release(). Indexing and iterating yield the chunk
+    strings exactly as joining the chunk's words with single spaces would."""
+
+    def __init__(
+        self,
+        book_path: str,
+        char_starts: array,
+        char_ends: array,
+        word_counts: array,
+        chunk_info: List[Dict[str, Any]],
+        text_length: int,
+        load_text: Callable[[str], str],
+    ):
+        self.book_path = book_path
+        self.char_starts = char_starts
+        self.char_ends = char_ends
+        self.word_counts = word_counts
+        self.chunk_info = chunk_info
+        self.text_length = text_length
+        self.load_text = load_text
+        self.total_tokens = int(sum(word_counts) * TOKENS_PER_WORD)
+        self._text: Optional[str] = None
+
+    @classmethod
+    def from_plan(
+        cls,
+        book_path: str,
+        plan: ChunkPlan,
+        text: str,
+        load_text: Callable[[str], str],
+    ) -> "BookChunks":
+        offsets = plan.word_offsets
+        char_starts, char_ends = chunk_spans(text, plan)
+        word_counts = array(
+            "I", (offsets[i + 1] - offsets[i] for i in range(len(plan)))
+        )
+        return cls(
+            book_path,
+            char_starts,
+            char_ends,
+            word_counts,
+            plan.chunk_info,
+            len(text),
+            load_text,
+        )
+
+    @classmethod
+    def from_dict(
+        cls, book_path: str, data: Dict[str, Any], load_text: Callable[[str], str]
+    ) -> "BookChunks":
+        return cls(
+            book_path,
+            array("I", data["char_starts"]),
+            array("I", data["char_ends"]),
+            array("I", data["word_counts"]),
+            data["chunk_info"],
+            data["text_length"],
+            load_text,
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "char_starts": self.char_starts.tolist(),
+            "char_ends": self.char_ends.tolist(),
+            "word_counts": self.word_counts.tolist(),
+            "chunk_info": self.chunk_info,
+            "text_length": self.text_length,
+        }
+
+    def __len__(self) -> int:
+        return len(self.word_counts)
+
+    def __getitem__(self, index: int) -> str:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("chunk index out of range")
+        text = self._load()
+        return " ".join(text[self.char_starts[index] : self.char_ends[index]].split())
+
+    def __iter__(self) -> Iterator[str]:
+        for index in range(len(self)):
+            yield self[index]
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        state["_text"] = None
+        return state
+
+    def fingerprint(self) -> str:
+        """Hash of the book content and chunk boundaries, stable across runs."""
+        digest = hashlib.sha256(f"{file_hash(self.book_path)}:{self.text_length}".encode())
+        digest.update(self.char_starts.tobytes())
+        digest.update(self.char_ends.tobytes())
+        return digest.hexdigest()
+
+    def chunk_tokens(self, index: int) -> int:
+        return int(self.word_counts[index] * TOKENS_PER_WORD)
+
+    def release(self) -> None:
+        """Drop the loaded book text until a chunk is requested again."""
+        self._text = None
+
+    def _load(self) -> str:
+        if self._text is None:
+            text = self.load_text(self.book_path)
+            if len(text) != self.text_length:
+                raise ValueError(
+                    f"Text of {self.book_path} changed since it was preprocessed"
+                )
+            self._text = text
+        return self._text
+
+
+class PlanCache:
+    """Memo of preprocessing results keyed by book content and planner settings.
+
+    Entries live in memory and are mirrored to a JSON file, so slider positions
+    and models seen before skip both text extraction and planning. The oldest
+    entries are dropped once more than max_entries are stored."""
+
+    def __init__(
+        self, cache_file: str = "chunk_plan_cache.json", max_entries: int = 20000
+    ):
+        self.cache_file = cache_file
+        self.max_entries = max_entries
+        self._entries: Optional[Dict[str, Any]] = None
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(book_path: str, max_tokens: int, tpm, summary_budget) -> Optional[str]:
+        try:
+            digest = file_hash(book_path)
+        except OSError:
+            return None
+        return f"{digest}:{int(max_tokens)}:{tpm}:{summary_budget}:{PLANNER_VERSION}:{EXTRACTOR_VERSION}"
+
+    def _load(self) -> Dict[str, Any]:
+        if self._entries is None:
+            try:
+                with open(self.cache_file, "r") as f:
+                    self._entries = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                self._entries = {}
+        return self._entries
+
+    def get(
+        self,
+        book_path: str,
+        max_tokens: int,
+        tpm,
+        summary_budget: Optional[int],
+        load_text: Callable[[str], str],
+    ) -> Optional[Dict[str, Any]]:
+        """Return a preprocess_book result for the book, or None if not memoized."""
+        key = self._key(book_path, max_tokens, tpm, summary_budget)
+        if key is None:
+            return None
+        with self._lock:
+            entries = self._load()
+            entry = entries.pop(key, None)
+            if entry is None:
+                return None
+            entries[key] = entry  # most recently used last
+
+        chunks = entry["chunks"]
+        return {
+            "book_path": book_path,
+            "chunks": BookChunks.from_dict(book_path, chunks, load_text) if chunks else None,
+            "chunk_info": chunks["chunk_info"] if chunks else None,
+            "total_tokens": entry["total_tokens"],
+            "theoretical_max_tokens": entry["theoretical_max_tokens"],
+        }
+
+    def put(
+        self,
+        book_path: str,
+        max_tokens: int,
+        tpm,
+        summary_budget: Optional[int],
+        result: Dict[str, Any],
+    ) -> None:
+        # Unreadable books are not memoized, they may be fixed and re-added
+        if not result["total_tokens"]:
+            return
+        key = self._key(book_path, max_tokens, tpm, summary_budget)
+        if key is None:
+            return
+        with self._lock:
+            entries = self._load()
+            entries.pop(key, None)
+            entries[key] = {
+                "chunks": result["chunks"].to_dict() if result["chunks"] else None,
+                "total_tokens": result["total_tokens"],
+                "theoretical_max_tokens": result["theoretical_max_tokens"],
+            }
+            while len(entries) > self.max_entries:
+                del entries[next(iter(entries))]
+            self._dirty = True
+
+    def save(self) -> None:
+        with self._lock:
+            if not self._dirty:
+                return
+            tmp_file = f"{self.cache_file}.tmp"
+            with open(tmp_file, "w") as f:
+                json.dump(self._entries, f)
+            os.replace(tmp_file, self.cache_file)
+            self._dirty = False
@@ -0,0 +1,138 @@
+import hashlib
+import logging
+import os
+import zlib
+from typing import Callable, Dict, Optional, Tuple
+
+# Bump whenever the text produced by the extractors changes, so stale entries are ignored.
+EXTRACTOR_VERSION = 3
+
+CACHE_DIR = "extraction_cache"
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024  # 512 MB of compressed text
+
+# file path -> (size, mtime_ns, digest), avoids re-hashing unchanged files
+_hash_memo: Dict[str, Tuple[int, int, str]] = {}
+
+
+def file_hash(file_path: str) -> str:
+    """Return the sha256 hex digest of a file's content."""
+    stat = os.stat(file_path)
+    memo = _hash_memo.get(file_path)
+    if memo and memo[0] == stat.st_size and memo[1] == stat.st_mtime_ns:
+        return memo[2]
+
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+
+    _hash_memo[file_path] = (stat.st_size, stat.st_mtime_ns, digest.hexdigest())
+    return digest.hexdigest()
+
+
+class ExtractionCache:
+    """Content-addressed, zlib-compressed store of extracted book text.
+
+    Entries are keyed by the book file's content hash and the extractor version,
+    and are only read from disk when requested. The file modification time of an
+    entry doubles as its last-access time, which drives LRU eviction once the
+    cache grows past ``max_bytes``. Every write is an atomic rename, so several
+    processes can share the same cache directory.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = CACHE_DIR,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        version: int = EXTRACTOR_VERSION,
+    ):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.version = version
+
+    def _entry_path(self, digest: str) -> str:
+        return os.path.join(self.cache_dir, f"{digest}-v{self.version}.txt.z")
+
+    def get(self, file_path: str, digest: Optional[str] = None) -> Optional[str]:
+        entry_path = self._entry_path(digest or file_hash(file_path))
+        try:
+            with open(entry_path, "rb") as f:
+                text = zlib.decompress(f.read()).decode("utf-8")
+        except FileNotFoundError:
+            return None
+        except (OSError, zlib.error, UnicodeDecodeError) as e:
+            logging.warning(f"Discarding corrupt extraction cache entry {entry_path}: {e}")
+            self._remove(entry_path)
+            return None
+
+        # Touch the entry so it counts as recently used
+        try:
+            os.utime(entry_path)
+        except OSError:
+            pass
+        return text
+
+    def put(self, file_path: str, text: str, digest: Optional[str] = None) -> None:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        entry_path = self._entry_path(digest or file_hash(file_path))
+        tmp_path = f"{entry_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(zlib.compress(text.encode("utf-8")))
+        os.replace(tmp_path, entry_path)
+        self.evict()
+
+    def get_or_extract(self, file_path: str, extract: Callable[[str, Optional[str]], str]) -> str:
+        """Return the cached text for file_path, running extract on a miss.
+
+        extract gets the file's content hash along with its path, or None when
+        the file could not be read."""
+        try:
+            digest = file_hash(file_path)
+            text = self.get(file_path, digest)
+        except OSError:
+            # Unreadable file, let the extractor report it
+            return extract(file_path, None)
+        if text is not None:
+            return text
+
+        text = extract(file_path, digest)
+        if text:
+            try:
+                self.put(file_path, text, digest)
+            except OSError as e:
+                logging.warning(f"Failed to cache extracted text of {file_path}: {e}")
+        return text
+
+    def evict(self) -> None:
+        """Drop entries from older extractor versions, then least recently used ones."""
+        entries = []
+        total_size = 0
+        suffix = f"-v{self.version}.txt.z"
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if not name.endswith(suffix):
+                if name.endswith(".txt.z"):
+                    self._remove(path)
+                continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total_size += stat.st_size
+
+        if total_size <= self.max_bytes:
+            return
+
+        for _, size, path in sorted(entries):
+            self._remove(path)
+            total_size -= size
+            if total_size <= self.max_bytes:
+                break
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,60 @@
+import logging
+import threading
+from typing import Optional
+
+import httpx
+
+# Connection pool shared by the REST managers and the OpenAI-compatible clients
+_settings = {
+    "pool_size": 20,
+    "connect_timeout": 10.0,
+    "read_timeout": 300.0,
+    "http2": False,
+}
+_client: Optional[httpx.Client] = None
+_client_lock = threading.Lock()
+
+
+def configure(**settings) -> None:
+    """Apply the "http" settings block, for clients created from now on."""
+    global _client
+    with _client_lock:
+        _settings.update({k: v for k, v in settings.items() if v is not None})
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def client_kwargs() -> dict:
+    """Pool, keep-alive and timeout options for httpx.Client and httpx.AsyncClient."""
+    http2 = bool(_settings["http2"])
+    if http2 and not _http2_available():
+        logging.warning("HTTP/2 requested but the h2 package is missing, using HTTP/1.1")
+        http2 = False
+    return {
+        "limits": httpx.Limits(
+            max_connections=_settings["pool_size"],
+            max_keepalive_connections=_settings["pool_size"],
+        ),
+        "timeout": httpx.Timeout(
+            _settings["read_timeout"], connect=_settings["connect_timeout"]
+        ),
+        "http2": http2,
+    }
+
+
+def shared_client() -> httpx.Client:
+    """The process-wide pooled client, created on first use."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = httpx.Client(**client_kwargs())
+        return _client
@@ -0,0 +1,223 @@
+"""Health checks, startup and warm-up of the local inference servers.
+
+Ollama is driven through its REST API; LM Studio and llama.cpp are reached
+through their OpenAI-compatible endpoints. A server that is not answering is
+started in the background and polled until it is, then the selected model is
+loaded with a context sized for the queued chunk plans, so the first chunk
+does not pay for a cold model load.
+"""
+
+import json
+import logging
+import subprocess
+import threading
+import time
+from typing import Callable, Iterable, List, Optional
+
+import httpx
+
+from chunk_planner import SUMMARY_TOKENS, BookChunks
+from http_transport import shared_client
+
+LOCAL_PROVIDERS = ("ollama", "lmstudio", "llamacpp")
+
+DEFAULT_BACKENDS = {
+    "ollama": {
+        "url": "http://127.0.0.1:11434",
+        "start_command": ["ollama", "serve"],
+    },
+    "lmstudio": {
+        "url": "http://127.0.0.1:1234",
+        "start_command": ["lms", "server", "start"],
+        "load_command": [
+            "lms", "load", "{model}", "--context-length", "{num_ctx}", "--ttl", "{keep_alive}", "--yes"
+        ],
+    },
+    "llamacpp": {
+        "url": "http://127.0.0.1:8080",
+        "start_command": ["llama-server", "--model", "{model}", "--ctx-size", "{num_ctx}", "--port", "8080"],
+    },
+}
+
+PROMPT_OVERHEAD_TOKENS = 500  # instructions, metadata and chat template around the content
+RESPONSE_TOKENS = 4096  # the longest response, a final summary
+
+
+def context_length(books: Iterable[BookChunks], max_tokens: int) -> int:
+    """Context to load a local model with so every request of the queued books fits.
+
+    That is the largest chunk plus the previous summaries sent with it, or all
+    chunk summaries for the final summary, plus the response, rounded up to a
+    multiple of 2048 and capped at the model's max_tokens."""
+    largest_input = 0
+    for chunks in books:
+        for index, info in enumerate(chunks.chunk_info):
+            largest_input = max(largest_input, chunks.chunk_tokens(index) + info["summary_tokens"])
+        largest_input = max(largest_input, len(chunks) * SUMMARY_TOKENS)
+    needed = largest_input + PROMPT_OVERHEAD_TOKENS + RESPONSE_TOKENS
+    return min(int(max_tokens), -(-needed // 2048) * 2048)
+
+
+class LocalBackend:
+    """One local inference server: its health, its process and the loaded model."""
+
+    def __init__(
+        self,
+        provider: str,
+        url: str,
+        start_command: Optional[List[str]] = None,
+        load_command: Optional[List[str]] = None,
+        keep_alive: int = 1800,
+        startup_timeout: float = 60.0,
+    ):
+        self.provider = provider
+        self.url = url.rstrip("/")
+        self.start_command = start_command
+        self.load_command = load_command
+        self.keep_alive = keep_alive
+        self.startup_timeout = startup_timeout
+        self.num_ctx: Optional[int] = None
+        self.process: Optional[subprocess.Popen] = None
+
+    @classmethod
+    def from_settings(cls, provider: str, settings: Optional[dict]) -> "LocalBackend":
+        """Build the backend from the local_backends settings block over the defaults."""
+        settings = settings or {}
+        backend = DEFAULT_BACKENDS[provider] | (settings.get(provider) or {})
+        return cls(
+            provider,
+            keep_alive=settings.get("keep_alive", 1800),
+            startup_timeout=settings.get("startup_timeout", 60.0),
+            **backend,
+        )
+
+    @property
+    def is_ollama(self) -> bool:
+        return self.provider == "ollama"
+
+    def manager_kwargs(self) -> dict:
+        """Constructor arguments pointing the provider's manager at this server."""
+        if self.is_ollama:
+            return {"host": self.url, "num_ctx": self.num_ctx, "keep_alive": self.keep_alive}
+        return {"base_url": f"{self.url}/v1"}
+
+    def is_healthy(self) -> bool:
+        path = "/api/version" if self.is_ollama else "/v1/models"
+        try:
+            return shared_client().get(f"{self.url}{path}", timeout=2.0).status_code == 200
+        except httpx.HTTPError:
+            return False
+
+    def _command(self, command: List[str], model: str) -> List[str]:
+        fields = {"model": model, "num_ctx": self.num_ctx, "keep_alive": self.keep_alive}
+        return [part.format(**fields) for part in command]
+
+    def start(self, model: str) -> bool:
+        """Launch the server in the background, without waiting for it to come up."""
+        if not self.start_command:
+            return False
+        try:
+            self.process = subprocess.Popen(
+                self._command(self.start_command, model),
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                start_new_session=True,
+            )
+        except OSError as e:
+            logging.error(f"Failed to start the {self.provider} server: {e}")
+            return False
+        return True
+
+    def wait_until_healthy(self, stop_event: Optional[threading.Event] = None) -> bool:
+        deadline = time.monotonic() + self.startup_timeout
+        while time.monotonic() < deadline:
+            if self.is_healthy():
+                return True
+            # Launchers such as `lms server start` exit 0 once the server runs
+            # in the background, so only a failed exit ends the wait early
+            if self.process and self.process.poll():
+                logging.error(f"The {self.provider} server exited with code {self.process.returncode}")
+                return False
+            if stop_event is None:
+                time.sleep(0.5)
+            elif stop_event.wait(0.5):
+                return False
+        logging.error(f"The {self.provider} server did not answer within {self.startup_timeout}s")
+        return False
+
+    def prepare(
+        self,
+        model: str,
+        num_ctx: int,
+        report: Callable[[str], None] = logging.info,
+        stop_event: Optional[threading.Event] = None,
+    ) -> bool:
+        """Make sure the server is up and model is loaded with num_ctx tokens of context."""
+        self.num_ctx = num_ctx
+        started = False
+        if not self.is_healthy():
+            report(f"Starting the {self.provider} server...")
+            started = self.start(model)
+            if not started or not self.wait_until_healthy(stop_event):
+                return False
+
+        report(f"Loading {model} with a {num_ctx} token context...")
+        try:
+            if self.is_ollama:
+                if not self._prepare_ollama(model, report, stop_event):
+                    return False
+            else:
+                # A server already running has its models loaded by the user, a
+                # second load would only duplicate them
+                if started and self.load_command:
+                    subprocess.run(
+                        self._command(self.load_command, model),
+                        check=True,
+                        stdin=subprocess.DEVNULL,
+                        stdout=subprocess.DEVNULL,
+                        stderr=subprocess.DEVNULL,
+                    )
+                self._warm_up(model)
+        except (httpx.HTTPError, OSError, subprocess.CalledProcessError) as e:
+            logging.error(f"Failed to load {model} on {self.provider}: {e}")
+            return False
+        return True
+
+    def _prepare_ollama(
+        self,
+        model: str,
+        report: Callable[[str], None],
+        stop_event: Optional[threading.Event] = None,
+    ) -> bool:
+        """Pull the model if missing and load it, False when stopped during the pull."""
+        client = shared_client()
+        tags = client.get(f"{self.url}/api/tags").json().get("models", [])
+        if not {model, f"{model}:latest"} & {tag["name"] for tag in tags}:
+            report(f"{model} not found locally. Pulling it... Please wait some minutes...")
+            # The pull streams its progress, so the read timeout only bounds a
+            # stalled download and stop_event is checked between updates
+            with client.stream("POST", f"{self.url}/api/pull", json={"model": model}) as response:
+                response.raise_for_status()
+                for line in response.iter_lines():
+                    if stop_event and stop_event.is_set():
+                        return False
+                    error = json.loads(line).get("error") if line else None
+                    if error:
+                        raise httpx.HTTPError(error)
+            report(f"{model} pulled successfully.")
+        # A request without a prompt only loads the model. Chats must send the
+        # same num_ctx, or Ollama reloads the model with the new context. Like
+        # every request here, it is bounded by the read timeout of http_transport.
+        client.post(
+            f"{self.url}/api/generate",
+            json={"model": model, "keep_alive": self.keep_alive, "options": {"num_ctx": self.num_ctx}},
+        ).raise_for_status()
+        return True
+
+    def _warm_up(self, model: str) -> None:
+        """One-token completion, which makes servers that load models on demand load it now."""
+        shared_client().post(
+            f"{self.url}/v1/chat/completions",
+            json={"model": model, "messages": [{"role": "user", "content": "Hi"}], "max_tokens": 1},
+        ).raise_for_status()
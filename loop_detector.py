@@ -0,0 +1,43 @@
+from typing import Dict, List, Optional
+
+_BASE = 1_000_003
+_MOD = (1 << 61) - 1
+
+
+class RepetitionDetector:
+    """Notices a streamed response starting to repeat itself, in constant time per character.
+
+    A Rabin-Karp hash of the last `window` characters is rolled forward as text
+    arrives and looked up among the hashes of every earlier window. A match that
+    does not overlap the current window, and survives a direct comparison to rule
+    out hash collisions, means the model is looping.
+    """
+
+    def __init__(self, window: int = 50):
+        self.window = window
+        self._codes: List[int] = []
+        self._first_end: Dict[int, int] = {}  # window hash -> end of its first occurrence
+        self._hash = 0
+        self._drop = pow(_BASE, window - 1, _MOD)
+
+    def feed(self, text: str) -> Optional[int]:
+        """Add streamed text; once a repeat shows up, return the length to cut the response to."""
+        window = self.window
+        codes = self._codes
+        first_end = self._first_end
+        drop = self._drop
+        h = self._hash
+        start = len(codes)
+        codes.extend(map(ord, text))
+        for end in range(start + 1, len(codes) + 1):
+            if end > window:
+                h -= codes[end - 1 - window] * drop
+            h = (h * _BASE + codes[end - 1]) % _MOD
+            if end < window:
+                continue
+            seen = first_end.setdefault(h, end)
+            if seen <= end - window and codes[seen - window : seen] == codes[end - window : end]:
+                self._hash = h
+                return end - window
+        self._hash = h
+        return None
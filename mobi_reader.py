@@ -0,0 +1,276 @@
+"""Text of MOBI and AZW3 (KF8) books, read straight from their text records.
+
+A MOBI file is a Palm database whose first record holds the PalmDOC and MOBI
+headers, followed by the book's HTML split into compressed text records. Each
+record is decompressed (PalmDOC LZ77 or HUFF/CDIC) and fed to an HTML parser
+as it comes, so the text streams out without converting the book to EPUB.
+Encrypted books and unknown compressions raise MobiError, for the caller to
+fall back on Calibre's ebook-convert.
+"""
+
+import codecs
+import struct
+from html.parser import HTMLParser
+from typing import Iterator, List, Tuple
+
+COMPRESSION_NONE = 1
+COMPRESSION_PALMDOC = 2
+COMPRESSION_HUFF_CDIC = 17480
+
+_ENCODINGS = {1252: "cp1252", 65001: "utf-8"}
+
+# Tags whose end starts a new line of text
+_BLOCK_TAGS = {
+    "p", "div", "br", "li", "tr", "h1", "h2", "h3", "h4", "h5", "h6",
+    "blockquote", "pre", "section", "table", "mbp:pagebreak",
+}
+_SKIPPED_TAGS = {"script", "style", "head"}
+
+
+class MobiError(Exception):
+    """The book is not a MOBI file this reader can decode."""
+
+
+def read_mobi_text(file_path: str) -> str:
+    return "".join(iter_mobi_text(file_path))
+
+
+def iter_mobi_text(file_path: str) -> Iterator[str]:
+    """Text of the book, one decompressed text record at a time."""
+    with open(file_path, "rb") as f:
+        data = f.read()
+    try:
+        book = _MobiBook(data)
+        decoder = codecs.getincrementaldecoder(book.encoding)("replace")
+        parser = _TextExtractor()
+        for raw in book.iter_html():
+            parser.feed(decoder.decode(raw))
+            yield parser.take()
+    except (struct.error, LookupError, ValueError, RecursionError) as e:
+        # Damaged records, e.g. a CDIC entry made of itself, recursing forever
+        raise MobiError(f"corrupt book: {e}") from e
+    parser.feed(decoder.decode(b"", final=True))
+    parser.close()
+    yield parser.take()
+
+
+class _MobiBook:
+    """Headers and text records of a MOBI or KF8 Palm database."""
+
+    def __init__(self, data: bytes):
+        if len(data) < 78 or data[60:68] not in (b"BOOKMOBI", b"TEXtREAd"):
+            raise MobiError("not a MOBI file")
+        self.data = data
+        (record_count,) = struct.unpack_from(">H", data, 76)
+        self.offsets = [
+            struct.unpack_from(">L", data, 78 + 8 * i)[0] for i in range(record_count)
+        ] + [len(data)]
+
+        header = self.record(0)
+        compression, text_length, self.text_records, _, encryption = struct.unpack_from(
+            ">HxxLHHH", header, 0
+        )
+        # Plain PalmDOC keeps a reading position where MOBI has the encryption type
+        if encryption and data[60:68] == b"BOOKMOBI":
+            raise MobiError("the book is encrypted")
+        if compression not in (COMPRESSION_NONE, COMPRESSION_PALMDOC, COMPRESSION_HUFF_CDIC):
+            raise MobiError(f"unknown compression {compression}")
+        self.compression = compression
+        self.text_length = text_length
+        self.encoding = "cp1252"
+        self.extra_flags = 0
+        self.huff_records = (0, 0)
+
+        if header[16:20] == b"MOBI":
+            header_length, encoding, version = struct.unpack_from(">L4xL4xL", header, 20)
+            if encoding not in _ENCODINGS:
+                raise MobiError(f"unknown text encoding {encoding}")
+            self.encoding = _ENCODINGS[encoding]
+            self.huff_records = struct.unpack_from(">LL", header, 0x70)
+            if header_length >= 0xE4:
+                (self.extra_flags,) = struct.unpack_from(">H", header, 0xF2)
+            # KF8 keeps CSS and SVG flows after the text; the FDST record
+            # tells where the first flow, the book's HTML, ends
+            if version >= 8 and header_length >= 0xB4:
+                (fdst,) = struct.unpack_from(">L", header, 0xC0)
+                if 0 < fdst < record_count:
+                    flows = self.record(fdst)
+                    if flows[:4] == b"FDST":
+                        (table,) = struct.unpack_from(">L", flows, 4)
+                        (self.text_length,) = struct.unpack_from(">L", flows, table + 4)
+
+    def record(self, index: int) -> bytes:
+        return self.data[self.offsets[index] : self.offsets[index + 1]]
+
+    def iter_html(self) -> Iterator[bytes]:
+        if self.compression == COMPRESSION_HUFF_CDIC:
+            first, count = self.huff_records
+            decompress = _HuffCdicReader([self.record(first + i) for i in range(count)]).unpack
+        elif self.compression == COMPRESSION_PALMDOC:
+            decompress = palmdoc_decompress
+        else:
+            decompress = bytes
+
+        remaining = self.text_length
+        for index in range(1, self.text_records + 1):
+            if remaining <= 0:
+                break
+            html = decompress(self._strip_trailing_entries(self.record(index)))[:remaining]
+            remaining -= len(html)
+            yield html
+
+    def _strip_trailing_entries(self, record: bytes) -> bytes:
+        """Drop the extra data appended to a text record, as flagged in the MOBI header.
+
+        Every flag bit above the lowest adds an entry ending with its own size,
+        written backwards in 7-bit groups. The lowest bit adds the bytes of a
+        character continuing into the next record."""
+        flags = self.extra_flags >> 1
+        while flags:
+            if flags & 1:
+                size = 0
+                for byte in record[-4:]:
+                    if byte & 0x80:
+                        size = 0
+                    size = (size << 7) | (byte & 0x7F)
+                record = record[: len(record) - size]
+            flags >>= 1
+        if self.extra_flags & 1 and record:
+            record = record[: len(record) - (record[-1] & 0x3) - 1]
+        return record
+
+
+def palmdoc_decompress(data: bytes) -> bytes:
+    """Decode PalmDOC LZ77: literals, byte runs, space pairs and back-references."""
+    out = bytearray()
+    i = 0
+    length = len(data)
+    while i < length:
+        c = data[i]
+        i += 1
+        if c == 0 or 0x09 <= c <= 0x7F:
+            out.append(c)
+        elif c <= 0x08:
+            out += data[i : i + c]
+            i += c
+        elif c >= 0xC0:
+            out.append(0x20)
+            out.append(c ^ 0x80)
+        else:
+            pair = (c << 8) | data[i]
+            i += 1
+            distance = (pair >> 3) & 0x7FF
+            count = (pair & 0x07) + 3
+            start = len(out) - distance
+            if distance >= count:
+                out += out[start : start + count]
+            else:
+                # The copy overlaps what it produces, so it goes byte by byte
+                for j in range(count):
+                    out.append(out[start + j])
+    return bytes(out)
+
+
+class _HuffCdicReader:
+    """Decoder for HUFF/CDIC compressed text records.
+
+    The HUFF record holds a canonical Huffman code table and the CDIC records
+    the dictionary it indexes. Dictionary entries may be compressed themselves,
+    and are decoded the first time they are used."""
+
+    def __init__(self, records: List[bytes]):
+        if not records or records[0][:8] != b"HUFF\x00\x00\x00\x18":
+            raise MobiError("missing HUFF record")
+        huff = records[0]
+        table_offset, bounds_offset = struct.unpack_from(">LL", huff, 8)
+
+        # For the top byte of a code: its length, whether that length is
+        # final, and the largest code of that length
+        self.code_table: List[Tuple[int, bool, int]] = []
+        for value in struct.unpack_from(">256L", huff, table_offset):
+            length = value & 0x1F
+            if length == 0:
+                raise MobiError("invalid HUFF code table")
+            self.code_table.append(
+                (length, bool(value & 0x80), (((value >> 8) + 1) << (32 - length)) - 1)
+            )
+        bounds = struct.unpack_from(">64L", huff, bounds_offset)
+        self.min_codes = [0] + [low << (32 - length) for length, low in enumerate(bounds[0::2], 1)]
+        self.max_codes = [0] + [
+            ((high + 1) << (32 - length)) - 1 for length, high in enumerate(bounds[1::2], 1)
+        ]
+
+        self.dictionary: List[Tuple[bytes, bool]] = []
+        for cdic in records[1:]:
+            if cdic[:8] != b"CDIC\x00\x00\x00\x10":
+                raise MobiError("invalid CDIC record")
+            phrases, bits = struct.unpack_from(">LL", cdic, 8)
+            count = min(1 << bits, phrases - len(self.dictionary))
+            for offset in struct.unpack_from(f">{count}H", cdic, 16):
+                (size,) = struct.unpack_from(">H", cdic, 16 + offset)
+                phrase = cdic[18 + offset : 18 + offset + (size & 0x7FFF)]
+                self.dictionary.append((phrase, bool(size & 0x8000)))
+
+    def unpack(self, data: bytes) -> bytes:
+        bits_left = len(data) * 8
+        data += b"\x00" * 8
+        position = 0
+        (window,) = struct.unpack_from(">Q", data, 0)
+        shift = 32
+        out = []
+        while True:
+            if shift <= 0:
+                position += 4
+                (window,) = struct.unpack_from(">Q", data, position)
+                shift += 32
+            code = (window >> shift) & 0xFFFFFFFF
+            length, final, max_code = self.code_table[code >> 24]
+            if not final:
+                while code < self.min_codes[length]:
+                    length += 1
+                max_code = self.max_codes[length]
+            shift -= length
+            bits_left -= length
+            if bits_left < 0:
+                break
+            index = (max_code - code) >> (32 - length)
+            phrase, decoded = self.dictionary[index]
+            if not decoded:
+                phrase = self.unpack(phrase)
+                self.dictionary[index] = (phrase, True)
+            out.append(phrase)
+        return b"".join(out)
+
+
+class _TextExtractor(HTMLParser):
+    """HTML to plain text, fed piece by piece, with a line break after every block."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self._pieces: List[str] = []
+        self._skipping = 0
+
+    def take(self) -> str:
+        text = "".join(self._pieces)
+        self._pieces.clear()
+        return text
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _SKIPPED_TAGS:
+            self._skipping += 1
+        elif tag == "br" or tag == "mbp:pagebreak":
+            self._pieces.append("\n")
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in _BLOCK_TAGS:
+            self._pieces.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in _SKIPPED_TAGS:
+            self._skipping = max(0, self._skipping - 1)
+        elif tag in _BLOCK_TAGS:
+            self._pieces.append("\n")
+
+    def handle_data(self, data):
+        if not self._skipping:
+            self._pieces.append(data)
@@ -0,0 +1,57 @@
+"""Registry of the providers named in ai_providers_config.json.
+
+Each entry names the manager class serving the provider, and its asyncio
+counterpart in async_ai_models. The class is only imported when a manager is
+created, and the provider SDK only when the manager is constructed, so
+launching the app costs no SDK imports at all.
+"""
+
+import importlib
+from typing import Optional
+
+# "api_key": False for providers that run without one, "base_url": True to
+# pass the base_url of the provider's config entry on to the manager
+PROVIDERS = {
+    "ollama": {"manager": "ai_models.OllamaManager", "async_manager": "async_ai_models.AsyncOllamaManager", "api_key": False},
+    "lmstudio": {"manager": "ai_models.LMStudioManager", "async_manager": "async_ai_models.AsyncLMStudioManager", "api_key": False},
+    "llamacpp": {"manager": "ai_models.LlamaCppManager", "async_manager": "async_ai_models.AsyncLlamaCppManager", "api_key": False},
+    "g4f": {"manager": "ai_models.G4FManager", "async_manager": "async_ai_models.AsyncG4FManager", "api_key": False},
+    "openai": {"manager": "ai_models.OpenAIManager", "async_manager": "async_ai_models.AsyncOpenAIManager", "base_url": True},
+    "anthropic": {"manager": "ai_models.AnthropicManager", "async_manager": "async_ai_models.AsyncAnthropicManager", "base_url": True},
+    "google": {"manager": "ai_models.GeminiManager", "async_manager": "async_ai_models.AsyncGeminiManager"},
+    "mistral": {"manager": "ai_models.MistralManager", "async_manager": "async_ai_models.AsyncMistralManager"},
+    "openrouter": {"manager": "ai_models.OpenRouterManager", "async_manager": "async_ai_models.AsyncOpenRouterManager"},
+    "GLHF": {"manager": "ai_models.GLHFManager", "async_manager": "async_ai_models.AsyncGLHFManager"},
+    "alibaba": {"manager": "ai_models.AlibabaManager", "async_manager": "async_ai_models.AsyncAlibabaManager"},
+    "deepinfra": {"manager": "ai_models.DeepInfraManager", "async_manager": "async_ai_models.AsyncDeepInfraManager"},
+    "huggingface": {"manager": "ai_models.HuggingFaceManager", "async_manager": "async_ai_models.AsyncHuggingFaceManager"},
+    "hyperbolic": {"manager": "ai_models.HyperbolicManager", "async_manager": "async_ai_models.AsyncHyperbolicManager"},
+    "arliai": {"manager": "ai_models.ArliAiManager", "async_manager": "async_ai_models.AsyncArliAiManager"},
+}
+
+
+def requires_api_key(provider: str) -> bool:
+    return PROVIDERS[provider].get("api_key", True)
+
+
+def manager_class(provider: str, use_async: bool = False) -> type:
+    module, _, name = PROVIDERS[provider]["async_manager" if use_async else "manager"].rpartition(".")
+    return getattr(importlib.import_module(module), name)
+
+
+def create_manager(
+    name: str,
+    api_key: Optional[str] = None,
+    provider_config: Optional[dict] = None,
+    use_async: bool = False,
+    **kwargs,
+):
+    """Construct the manager of a registered provider, importing its SDK on first use.
+
+    use_async picks the asyncio manager, which takes the same arguments."""
+    spec = PROVIDERS[name]
+    if spec.get("api_key", True):
+        kwargs["api_key"] = api_key
+    if spec.get("base_url"):
+        kwargs.setdefault("base_url", (provider_config or {}).get("base_url"))
+    return manager_class(name, use_async)(**kwargs)
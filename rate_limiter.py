@@ -0,0 +1,137 @@
+import asyncio
+import sqlite3
+import time
+from datetime import datetime
+from typing import Optional
+
+DB_PATH = "rate_limits.db"
+
+
+class DailyLimitReached(Exception):
+    pass
+
+
+class RateLimiter:
+    """Token buckets metering requests and tokens for one (provider, model).
+
+    rpm and tpm refill continuously, rpd and tpd are counted per calendar day.
+    Bucket state lives in a SQLite database and every acquisition runs in an
+    immediate transaction, so all threads and all running app processes using
+    the same model draw from the same quota.
+    """
+
+    def __init__(
+        self,
+        provider: str,
+        model: str,
+        rpm: Optional[float] = None,
+        tpm: Optional[float] = None,
+        rpd: Optional[int] = None,
+        tpd: Optional[int] = None,
+        db_path: str = DB_PATH,
+    ):
+        self.key = f"{provider}/{model}"
+        self.rpm = rpm
+        self.tpm = tpm
+        self.rpd = rpd
+        self.tpd = tpd
+        self.db_path = db_path
+        connection = self._connect()
+        try:
+            connection.execute(
+                """CREATE TABLE IF NOT EXISTS buckets (
+                    key TEXT PRIMARY KEY,
+                    requests REAL NOT NULL,
+                    tokens REAL NOT NULL,
+                    updated REAL NOT NULL,
+                    day TEXT NOT NULL,
+                    day_requests INTEGER NOT NULL,
+                    day_tokens INTEGER NOT NULL
+                )"""
+            )
+        finally:
+            connection.close()
+
+    @classmethod
+    def from_model_info(cls, provider: str, model_info: dict, **kwargs) -> Optional["RateLimiter"]:
+        """Build a limiter from a model entry of ai_providers_config.json, if it lists any limit."""
+        limits = {name: model_info.get(name) for name in ("rpm", "tpm", "rpd", "tpd")}
+        if not any(limits.values()):
+            return None
+        return cls(provider, model_info["name"], **limits, **kwargs)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+
+    def acquire(self, tokens: int = 0) -> None:
+        """Block until one request of about `tokens` tokens fits the limits."""
+        while True:
+            wait = self._try_acquire(tokens)
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens: int = 0) -> None:
+        while True:
+            # The transaction may wait on other processes, keep it off the event loop
+            wait = await asyncio.to_thread(self._try_acquire, tokens)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    def _try_acquire(self, tokens: int) -> float:
+        """Take one request and `tokens` tokens, or return how long to wait for them."""
+        # A single request larger than the whole bucket only waits for a full bucket
+        if self.tpm:
+            tokens = min(tokens, self.tpm)
+        today = datetime.now().strftime("%Y-%m-%d")
+        now = time.time()
+
+        connection = self._connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute(
+                "SELECT requests, tokens, updated, day, day_requests, day_tokens FROM buckets WHERE key = ?",
+                (self.key,),
+            ).fetchone()
+            if row is None:
+                row = (self.rpm or 0, self.tpm or 0, now, today, 0, 0)
+            available_requests, available_tokens, updated, day, day_requests, day_tokens = row
+
+            elapsed = max(now - updated, 0)
+            if self.rpm:
+                available_requests = min(self.rpm, available_requests + elapsed * self.rpm / 60)
+            if self.tpm:
+                available_tokens = min(self.tpm, available_tokens + elapsed * self.tpm / 60)
+            if day != today:
+                day, day_requests, day_tokens = today, 0, 0
+
+            if self.rpd and day_requests >= self.rpd:
+                connection.execute("ROLLBACK")
+                raise DailyLimitReached(f"Daily request limit of {self.key} reached ({self.rpd})")
+            if self.tpd and day_tokens + tokens > self.tpd:
+                connection.execute("ROLLBACK")
+                raise DailyLimitReached(f"Daily token limit of {self.key} reached ({self.tpd})")
+
+            wait = 0.0
+            if self.rpm and available_requests < 1:
+                wait = max(wait, (1 - available_requests) * 60 / self.rpm)
+            if self.tpm and available_tokens < tokens:
+                wait = max(wait, (tokens - available_tokens) * 60 / self.tpm)
+
+            if wait <= 0:
+                if self.rpm:
+                    available_requests -= 1
+                if self.tpm:
+                    available_tokens -= tokens
+                day_requests += 1
+                day_tokens += tokens
+
+            connection.execute(
+                "INSERT OR REPLACE INTO buckets VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (self.key, available_requests, available_tokens, now, day, day_requests, day_tokens),
+            )
+            connection.execute("COMMIT")
+            return wait
+        finally:
+            connection.close()
@@ -0,0 +1,116 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+DB_PATH = "response_cache.db"
+
+
+class ResponseCache:
+    """SQLite store of accepted model responses, keyed by everything that shapes them.
+
+    Entries older than max_age_days are dropped, and once the stored responses
+    exceed max_megabytes the least recently used ones go first. The access time
+    is refreshed at most hourly so that hits stay read-only.
+    """
+
+    def __init__(
+        self,
+        db_path: str = DB_PATH,
+        max_megabytes: float = 256,
+        max_age_days: float = 30,
+        evict_every: int = 100,
+    ):
+        self.db_path = db_path
+        self.max_bytes = int(max_megabytes * 1024 * 1024)
+        self.max_age = max_age_days * 86400
+        self.evict_every = evict_every
+        self._puts = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            db_path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )"""
+        )
+
+    @classmethod
+    def from_settings(cls, settings: Optional[dict]) -> Optional["ResponseCache"]:
+        """Build the cache from the response_cache settings block, None when disabled."""
+        settings = dict(settings or {})
+        if not settings.pop("enabled", True):
+            return None
+        try:
+            return cls(**settings)
+        except sqlite3.Error as e:
+            logging.warning(f"Response cache unavailable: {e}")
+            return None
+
+    @staticmethod
+    def key(provider: Optional[str], model: str, temperature: float, system_message: str, prompt: str) -> str:
+        fields = [
+            provider,
+            model,
+            temperature,
+            hashlib.sha256(system_message.encode("utf-8")).hexdigest(),
+            hashlib.sha256(prompt.encode("utf-8")).hexdigest(),
+        ]
+        return hashlib.sha256(json.dumps(fields).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        try:
+            with self._lock:
+                row = self._connection.execute(
+                    "SELECT response, created, accessed FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    return None
+                response, created, accessed = row
+                if now - created > self.max_age:
+                    return None
+                if now - accessed > 3600:
+                    self._connection.execute(
+                        "UPDATE responses SET accessed = ? WHERE key = ?", (now, key)
+                    )
+        except sqlite3.Error as e:
+            logging.warning(f"Failed to read the response cache: {e}")
+            return None
+        return response
+
+    def put(self, key: str, response: str) -> None:
+        now = time.time()
+        try:
+            with self._lock:
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                    (key, response, len(response.encode("utf-8")), now, now),
+                )
+                self._puts += 1
+                # On the first write, then every evict_every writes
+                if (self._puts - 1) % self.evict_every == 0:
+                    self._evict(now)
+        except sqlite3.Error as e:
+            logging.warning(f"Failed to write the response cache: {e}")
+
+    def _evict(self, now: float) -> None:
+        self._connection.execute("DELETE FROM responses WHERE created < ?", (now - self.max_age,))
+        self._connection.execute(
+            """DELETE FROM responses WHERE key IN (
+                SELECT key FROM (
+                    SELECT key, SUM(size) OVER (ORDER BY accessed DESC, key) AS running
+                    FROM responses
+                ) WHERE running > ?
+            )""",
+            (self.max_bytes,),
+        )
@@ -0,0 +1,217 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from typing import Awaitable, Callable, Optional
+
+from adaptive_concurrency import CONGESTION_STATUSES, error_status
+from rate_limiter import DailyLimitReached
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+class RetryBudget:
+    """Thread-safe number of retries left, shared by all requests it is passed to."""
+
+    def __init__(self, limit: Optional[int]):
+        self.limit = limit
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def spend(self) -> bool:
+        with self._lock:
+            if self.limit is not None and self.used >= self.limit:
+                return False
+            self.used += 1
+            return True
+
+
+class CircuitBreaker:
+    """Fails requests fast after failure_threshold consecutive errors.
+
+    Once open, requests are refused for cooldown seconds. After that a single
+    probe request is let through: its success closes the circuit, its failure
+    opens it for another cooldown.
+    """
+
+    def __init__(self, key: str, failure_threshold: int = 5, cooldown: float = 60.0):
+        self.key = key
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def remaining_cooldown(self) -> float:
+        if self.opened_at is None:
+            return 0.0
+        return max(self.opened_at + self.cooldown - time.monotonic(), 0.0)
+
+    def before_call(self) -> None:
+        with self._lock:
+            if self.opened_at is None:
+                return
+            if self.remaining_cooldown() > 0 or self._probing:
+                raise CircuitOpen(f"Requests to {self.key} are paused after repeated errors")
+            self._probing = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.opened_at is not None:
+                logging.info(f"Requests to {self.key} succeed again, resuming")
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self._probing or self.failures >= self.failure_threshold:
+                if self.opened_at is None or self._probing:
+                    logging.warning(
+                        f"{self.failures} consecutive errors from {self.key}, "
+                        f"pausing requests for {self.cooldown:.0f}s"
+                    )
+                self.opened_at = time.monotonic()
+                self._probing = False
+
+    def wait_until_closed(self, stop_event: Optional[threading.Event] = None) -> None:
+        """Block until the cooldown of an open circuit is over."""
+        while True:
+            remaining = self.remaining_cooldown()
+            if remaining <= 0:
+                return
+            if stop_event:
+                if stop_event.wait(remaining):
+                    return
+            else:
+                time.sleep(remaining)
+
+
+class RetryPolicy:
+    """One retry loop for every manager.
+
+    Errors and rejected responses are retried up to max_attempts times with full
+    jitter exponential backoff, as long as both the run's budget and the book's
+    budget (see book_budget) allow another retry. Client errors such as a bad
+    request or a missing API key and reached daily limits are not retried.
+    """
+
+    def __init__(
+        self,
+        key: str,
+        max_attempts: int = 5,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        run_budget: Optional[int] = 200,
+        book_budget: Optional[int] = 20,
+        failure_threshold: int = 5,
+        cooldown: float = 60.0,
+    ):
+        self.key = key
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.run_budget = RetryBudget(run_budget)
+        self.book_retries = book_budget
+        self.breaker = CircuitBreaker(key, failure_threshold, cooldown)
+
+    def book_budget(self) -> RetryBudget:
+        """A fresh budget for the requests of one book."""
+        return RetryBudget(self.book_retries)
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+    @staticmethod
+    def _is_retryable(error: BaseException) -> bool:
+        if isinstance(error, (DailyLimitReached, CircuitOpen)):
+            return False
+        status = error_status(error)
+        return not (status and 400 <= status < 500 and status not in CONGESTION_STATUSES)
+
+    def _failed(self, attempt: int, budget: Optional[RetryBudget], give_up: str) -> Optional[float]:
+        """Return the delay before the next attempt, or None to give up."""
+        if attempt + 1 >= self.max_attempts:
+            logging.warning(f"Max retries reached. {give_up}")
+        elif budget and not budget.spend():
+            logging.warning(f"Retry budget of the book exhausted. {give_up}")
+        elif not self.run_budget.spend():
+            logging.warning(f"Retry budget of the run exhausted. {give_up}")
+        else:
+            return self.backoff(attempt)
+        return None
+
+    def _on_error(self, error: BaseException, attempt: int, task: str, give_up: str) -> bool:
+        """Log and record an error, returning whether it may be retried."""
+        if isinstance(error, CircuitOpen):
+            logging.error(f"Error during {task}: {error}. {give_up}")
+            return False
+        logging.error(f"Error during {task} (attempt {attempt + 1}): {error}")
+        if self._is_retryable(error):
+            self.breaker.record_failure()
+            return True
+        # Not an outage, and it must not leave a probe of an open circuit pending
+        self.breaker.record_success()
+        logging.warning(f"Not retrying. {give_up}")
+        return False
+
+    def _rejected(self, response: str, check: Callable[[str], Optional[str]], attempt: int, task: str) -> bool:
+        self.breaker.record_success()
+        problem = check(response)
+        if problem:
+            logging.error(f"Error during {task} (attempt {attempt + 1}): {problem}.")
+        return bool(problem)
+
+    def call(
+        self,
+        send: Callable[[], str],
+        check: Callable[[str], Optional[str]],
+        task: str,
+        give_up: str,
+        budget: Optional[RetryBudget] = None,
+    ) -> str:
+        """Return the first response check accepts, or "" once retrying is over."""
+        for attempt in range(self.max_attempts):
+            try:
+                self.breaker.before_call()
+                response = send()
+            except Exception as e:
+                if not self._on_error(e, attempt, task, give_up):
+                    return ""
+            else:
+                if not self._rejected(response, check, attempt, task):
+                    return response
+            delay = self._failed(attempt, budget, give_up)
+            if delay is None:
+                return ""
+            time.sleep(delay)
+        return ""
+
+    async def call_async(
+        self,
+        send: Callable[[], Awaitable[str]],
+        check: Callable[[str], Optional[str]],
+        task: str,
+        give_up: str,
+        budget: Optional[RetryBudget] = None,
+    ) -> str:
+        for attempt in range(self.max_attempts):
+            try:
+                self.breaker.before_call()
+                response = await send()
+            except Exception as e:
+                if not self._on_error(e, attempt, task, give_up):
+                    return ""
+            else:
+                if not self._rejected(response, check, attempt, task):
+                    return response
+            delay = self._failed(attempt, budget, give_up)
+            if delay is None:
+                return ""
+            await asyncio.sleep(delay)
+        return ""
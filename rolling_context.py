@@ -0,0 +1,68 @@
+import logging
+from collections import deque
+
+from chunk_planner import TOKENS_PER_WORD, estimate_tokens
+
+MIN_SYNOPSIS_TOKENS = 500
+SYNOPSIS_PREFIX = "Story so far: "
+PREFIX_TOKENS = 6  # the prefix, plus rounding of the per-part estimates
+
+
+class RollingContext:
+    """Bounded replacement for the ever-growing previous summaries.
+
+    The last keep_last chunk summaries are kept verbatim, fewer when they would
+    leave less than MIN_SYNOPSIS_TOKENS of budget_tokens. Older ones are folded
+    into a running synopsis, which is condensed by the model to half of the
+    room left to it whenever the rendered context outgrows budget_tokens, so
+    the context stays under budget_tokens however long the book is.
+    """
+
+    def __init__(self, manager, keep_last: int = 3, budget_tokens: int = 6000, retry_budget=None):
+        self.manager = manager
+        self.retry_budget = retry_budget
+        self.keep_last = keep_last
+        self.budget_tokens = budget_tokens
+        self.synopsis = ""
+        self.recent = deque()
+
+    def _recent_tokens(self) -> int:
+        return estimate_tokens("\n\n".join(self.recent))
+
+    @property
+    def synopsis_budget(self) -> int:
+        """Tokens left to the synopsis beside the verbatim summaries."""
+        return max(self.budget_tokens - self._recent_tokens() - PREFIX_TOKENS, 0)
+
+    def add(self, summary: str) -> None:
+        self.recent.append(summary)
+        while self.recent and (
+            len(self.recent) > self.keep_last
+            or self._recent_tokens() > self.budget_tokens - MIN_SYNOPSIS_TOKENS
+        ):
+            self.synopsis = f"{self.synopsis}\n\n{self.recent.popleft()}".strip()
+
+        if estimate_tokens(self.render()) > self.budget_tokens:
+            self._condense()
+
+    def render(self) -> str:
+        parts = []
+        if self.synopsis:
+            parts.append(f"{SYNOPSIS_PREFIX}{self.synopsis}")
+        parts.extend(self.recent)
+        return "\n\n".join(parts)
+
+    def _condense(self) -> None:
+        max_words = int(self.synopsis_budget / 2 / TOKENS_PER_WORD)
+        condensed = self.manager.condense_summaries(
+            self.synopsis, max_words, self.retry_budget
+        )
+        if condensed:
+            self.synopsis = condensed
+        else:
+            logging.warning("Failed to condense the running synopsis, truncating it.")
+        if estimate_tokens(self.render()) > self.budget_tokens:
+            # Keep the most recent part of the synopsis rather than blow the budget
+            keep_words = int(self.synopsis_budget / TOKENS_PER_WORD)
+            words = self.synopsis.split()
+            self.synopsis = " ".join(words[max(len(words) - keep_words, 0) :]) if keep_words else ""
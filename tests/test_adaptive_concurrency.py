@@ -0,0 +1,88 @@
+import time
+
+import pytest
+
+from adaptive_concurrency import AdaptiveConcurrency, controller_for, parse_wait
+
+
+class StatusError(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        if headers is not None:
+            self.response = type("Response", (), {"status_code": status_code, "headers": headers})()
+
+
+def test_successes_widen_the_window_additively():
+    controller = AdaptiveConcurrency("test", initial_window=4)
+    for _ in range(4):
+        controller.release(controller.acquire())
+    assert 4.9 < controller.window < 5.1
+
+
+def test_congestion_halves_the_window_once_per_round_trip():
+    controller = AdaptiveConcurrency("test", initial_window=8)
+    started = [controller.acquire() for _ in range(3)]
+    for start in started:
+        controller.release(start, StatusError(429))
+    assert controller.window == 4
+    controller.release(controller.acquire(), StatusError(503))
+    assert controller.window == 2
+
+
+def test_request_errors_do_not_shrink_the_window():
+    controller = AdaptiveConcurrency("test", initial_window=8)
+    controller.release(controller.acquire(), StatusError(400))
+    assert controller.window == 8
+
+
+def test_window_stays_within_bounds():
+    controller = AdaptiveConcurrency("test", initial_window=2, min_window=1, max_window=3)
+    for _ in range(5):
+        controller.release(controller.acquire(), StatusError(429))
+        controller._last_decrease = 0
+    assert controller.window == 1
+    for _ in range(50):
+        controller.release(controller.acquire())
+    assert controller.window == 3
+
+
+def test_remaining_requests_header_caps_the_window():
+    controller = AdaptiveConcurrency("test", initial_window=16)
+    controller.observe_headers({"x-ratelimit-remaining-requests": "5"})
+    assert controller.window == 5
+
+
+def test_retry_after_pauses_new_requests():
+    controller = AdaptiveConcurrency("test")
+    controller.observe_headers({"retry-after": "30"})
+    started, wait = controller._try_take()
+    assert started is None
+    assert 29 < wait <= 30
+
+
+def test_exhausted_quota_pauses_until_the_reset():
+    controller = AdaptiveConcurrency("test")
+    controller.observe_headers(
+        {"x-ratelimit-remaining-tokens": "0", "x-ratelimit-reset-tokens": "6m0s"}
+    )
+    assert controller.paused_until - time.monotonic() == pytest.approx(360, abs=1)
+
+
+def test_full_window_blocks_until_a_slot_is_released():
+    controller = AdaptiveConcurrency("test", initial_window=1)
+    controller.acquire()
+    started, _ = controller._try_take()
+    assert started is None
+
+
+@pytest.mark.parametrize(
+    "value, seconds",
+    [("20", 20), ("1.5", 1.5), ("6m0s", 360), ("250ms", 0.25), ("1h2m", 3720)],
+)
+def test_parse_wait(value, seconds):
+    assert parse_wait(value) == pytest.approx(seconds)
+
+
+def test_managers_of_a_model_share_one_controller():
+    assert controller_for("provider", "shared-model") is controller_for("provider", "shared-model")
@@ -0,0 +1,366 @@
+import email.policy
+import json
+import threading
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+for module in ("ebooklib", "bs4", "PyPDF2", "tqdm", "cryptography"):
+    pytest.importorskip(module)
+
+from batch_runner import iter_batches, summarize_chunks_in_batch
+from checkpoint import BookCheckpoint
+
+SUMMARY = "word " * 150
+
+
+class Chunks(list):
+    """Chunks of a book, logging when they are read and released."""
+
+    def __init__(self, name, count, log):
+        super().__init__(f"{name} chunk {i}" for i in range(1, count + 1))
+        self.log = log
+
+    def __getitem__(self, index):
+        self.log.append(f"read {super().__getitem__(index)}")
+        return super().__getitem__(index)
+
+    def fingerprint(self):
+        return "plan"
+
+    def release(self):
+        self.log.append("release")
+
+
+class FakeBatchManager:
+    """Batch API that answers every request with SUMMARY."""
+
+    provider = "fake"
+    model = "model"
+    max_batch_bytes = 10 ** 9
+
+    def __init__(self, log):
+        self.log = log
+        self.batches = {}
+
+    def _chunk_prompt(self, content, previous_summaries):
+        return content
+
+    def _cache_key(self, prompt):
+        return None
+
+    def _cache_response(self, cache_key, response):
+        pass
+
+    @staticmethod
+    def _check_chunk_summary(summary):
+        return None if summary == SUMMARY else "bad summary"
+
+    def batch_request(self, custom_id, prompt):
+        return {"custom_id": custom_id, "prompt": prompt}
+
+    def submit_batch(self, requests):
+        self.log.append(f"submit {len(requests)}")
+        batch_id = f"batch-{len(self.batches)}"
+        self.batches[batch_id] = requests
+        return batch_id
+
+    def batch_done(self, batch_id):
+        return True
+
+    def batch_results(self, batch_id):
+        return {request["custom_id"]: SUMMARY for request in self.batches[batch_id]}
+
+
+def books(tmp_path, log, sizes=(2, 2)):
+    return [
+        (f"Book {n}", "Author", str(tmp_path / f"book {n}"), Chunks(f"book {n}", size, log))
+        for n, size in enumerate(sizes, 1)
+    ]
+
+
+def test_iter_batches_splits_by_count_and_size():
+    requests = [{"text": "x" * 10} for _ in range(7)]
+    size = len(json.dumps(requests[0])) + 1
+
+    assert [len(b) for b in iter_batches(requests, 3, 10 ** 6)] == [3, 3, 1]
+    assert [len(b) for b in iter_batches(requests, 100, 2 * size)] == [2, 2, 2, 1]
+    # A request over the size limit on its own is still sent
+    assert [len(b) for b in iter_batches(requests, 100, size - 1)] == [1] * 7
+
+
+def test_batches_are_submitted_as_the_books_are_read(tmp_path):
+    log = []
+    manager = FakeBatchManager(log)
+
+    saved = summarize_chunks_in_batch(
+        manager, books(tmp_path, log), poll_interval=0, max_requests_per_batch=2
+    )
+
+    assert saved == 4
+    assert log == [
+        "read book 1 chunk 1",
+        "read book 1 chunk 2",
+        "release",
+        "read book 2 chunk 1",
+        "submit 2",
+        "read book 2 chunk 2",
+        "release",
+        "submit 2",
+    ]
+
+
+def test_done_chunks_are_not_requested_again(tmp_path):
+    log = []
+    manager = FakeBatchManager(log)
+    book = books(tmp_path, log, sizes=(3,))
+    (tmp_path / "book 1").mkdir()
+    BookCheckpoint(book[0][2], "plan", "map_reduce", "fake/model").mark_done(2)
+
+    assert summarize_chunks_in_batch(manager, book, poll_interval=0) == 2
+    assert [r["prompt"] for r in manager.batches["batch-0"]] == [
+        "book 1 chunk 1",
+        "book 1 chunk 3",
+    ]
+
+
+def test_stop_cancels_the_submitted_batches(tmp_path):
+    log = []
+    manager = FakeBatchManager(log)
+    manager.batch_done = lambda batch_id: False
+    cancelled = []
+    manager.cancel_batch = cancelled.append
+    stop_event = threading.Event()
+    stop_event.set()
+    # Stopped before anything was submitted
+    assert summarize_chunks_in_batch(manager, books(tmp_path, log), stop_event=stop_event) == 0
+    assert manager.batches == {}
+
+    stop_event.clear()
+    timer = threading.Timer(0.1, stop_event.set)
+    timer.start()
+    assert summarize_chunks_in_batch(
+        manager, books(tmp_path, log), poll_interval=0.01, stop_event=stop_event
+    ) == 0
+    timer.join()
+    assert cancelled == ["batch-0"]
+
+
+def test_jobs_of_a_closed_run_are_collected_by_the_next(tmp_path):
+    log = []
+    manager = FakeBatchManager(log)
+    library = books(tmp_path, log)
+    for book in library:
+        (tmp_path / book[0].lower()).mkdir()
+
+    def closed(batch_id):
+        raise KeyboardInterrupt
+
+    manager.batch_done = closed
+    with pytest.raises(KeyboardInterrupt):
+        summarize_chunks_in_batch(manager, library, poll_interval=0)
+    assert BookCheckpoint(library[0][2], "plan", "map_reduce", "fake/model").batches == {
+        "batch-0": [1, 2]
+    }
+
+    del manager.batch_done
+    log.clear()
+    assert summarize_chunks_in_batch(manager, books(tmp_path, log), poll_interval=0) == 4
+    assert not any(entry.startswith("submit") for entry in log)
+    for title, author, book_dir, chunks in library:
+        checkpoint = BookCheckpoint(book_dir, "plan", "map_reduce", "fake/model")
+        assert checkpoint.completed == {1, 2}
+        assert checkpoint.batches == {}
+
+
+def test_failed_wait_cancels_the_running_jobs(tmp_path):
+    log = []
+    manager = FakeBatchManager(log)
+    library = books(tmp_path, log)
+    for book in library:
+        (tmp_path / book[0].lower()).mkdir()
+    cancelled = []
+    manager.cancel_batch = cancelled.append
+
+    def network_error(batch_id):
+        raise ConnectionError("connection reset")
+
+    manager.batch_done = network_error
+    with pytest.raises(ConnectionError):
+        summarize_chunks_in_batch(manager, library, poll_interval=0)
+    assert cancelled == ["batch-0"]
+    assert BookCheckpoint(library[0][2], "plan", "map_reduce", "fake/model").batches == {}
+
+
+class BatchServer(ThreadingHTTPServer):
+    """Stand-in for the OpenAI and Anthropic batch endpoints.
+
+    Every batch is finished on its first poll, with SUMMARY for each request."""
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), BatchHandler)
+        self.url = f"http://127.0.0.1:{self.server_port}"
+        self.files = {}
+        self.batches = {}
+        self.payload_sizes = []
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+
+class BatchHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _send(self, body, content_type="application/json"):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self):
+        return self.rfile.read(int(self.headers["Content-Length"]))
+
+    def _openai_batch(self, batch_id):
+        return {
+            "id": batch_id,
+            "object": "batch",
+            "endpoint": "/v1/chat/completions",
+            "input_file_id": f"file-{batch_id}",
+            "completion_window": "24h",
+            "created_at": 0,
+            "status": "completed",
+            "output_file_id": f"output-{batch_id}",
+        }
+
+    def _anthropic_batch(self, batch_id):
+        return {
+            "id": batch_id,
+            "type": "message_batch",
+            "processing_status": "ended",
+            "request_counts": {
+                "processing": 0, "succeeded": 0, "errored": 0, "canceled": 0, "expired": 0
+            },
+            "created_at": "2024-01-01T00:00:00Z",
+            "expires_at": "2024-01-02T00:00:00Z",
+            "ended_at": "2024-01-01T00:00:00Z",
+            "archived_at": None,
+            "cancel_initiated_at": None,
+            "results_url": f"{self.server.url}/v1/messages/batches/{batch_id}/results",
+        }
+
+    def do_POST(self):
+        server = self.server
+        body = self._body()
+        path = self.path.split("?")[0]
+        if path == "/v1/files":
+            form = BytesParser(policy=email.policy.HTTP).parsebytes(
+                f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body
+            )
+            content = next(p for p in form.iter_parts() if p.get_filename()).get_payload(
+                decode=True
+            )
+            file_id = f"file-{len(server.files)}"
+            server.files[file_id] = content
+            self._send({
+                "id": file_id, "object": "file", "bytes": len(content), "created_at": 0,
+                "filename": "batch.jsonl", "purpose": "batch", "status": "processed",
+            })
+        elif path == "/v1/batches":
+            content = server.files[json.loads(body)["input_file_id"]]
+            server.payload_sizes.append(len(content))
+            batch_id = f"batch_{len(server.batches)}"
+            server.batches[batch_id] = [json.loads(line) for line in content.splitlines()]
+            self._send(self._openai_batch(batch_id))
+        elif path == "/v1/messages/batches":
+            server.payload_sizes.append(len(body))
+            batch_id = f"msgbatch_{len(server.batches)}"
+            server.batches[batch_id] = json.loads(body)["requests"]
+            self._send(self._anthropic_batch(batch_id))
+        else:
+            self.send_error(404)
+
+    def do_GET(self):
+        server = self.server
+        path = self.path.split("?")[0]
+        parts = path.split("/")
+        if path.startswith("/v1/batches/"):
+            self._send(self._openai_batch(parts[3]))
+        elif path.startswith("/v1/files/output-"):
+            batch_id = parts[3][len("output-"):]
+            lines = [
+                json.dumps({
+                    "id": f"response-{i}",
+                    "custom_id": request["custom_id"],
+                    "response": {
+                        "status_code": 200,
+                        "body": {"choices": [{"message": {"content": SUMMARY}}]},
+                    },
+                    "error": None,
+                })
+                for i, request in enumerate(server.batches[batch_id])
+            ]
+            self._send("\n".join(lines).encode("utf-8"), "application/octet-stream")
+        elif path.endswith("/results"):
+            lines = [
+                json.dumps({
+                    "custom_id": request["custom_id"],
+                    "result": {
+                        "type": "succeeded",
+                        "message": {
+                            "id": "msg", "type": "message", "role": "assistant",
+                            "model": request["params"]["model"],
+                            "content": [{"type": "text", "text": SUMMARY}],
+                            "stop_reason": "end_turn", "stop_sequence": None,
+                            "usage": {"input_tokens": 1, "output_tokens": 1},
+                        },
+                    },
+                })
+                for request in server.batches[parts[4]]
+            ]
+            self._send("\n".join(lines).encode("utf-8"), "application/binary")
+        elif path.startswith("/v1/messages/batches/"):
+            self._send(self._anthropic_batch(parts[4]))
+        else:
+            self.send_error(404)
+
+
+@pytest.mark.parametrize(
+    "sdk, manager_class, base_path",
+    [("openai", "OpenAIManager", "/v1"), ("anthropic", "AnthropicManager", "")],
+)
+def test_batches_against_stand_in_server(tmp_path, monkeypatch, sdk, manager_class, base_path):
+    pytest.importorskip(sdk)
+    pytest.importorskip("httpx")
+    import ai_models
+
+    monkeypatch.delenv("HTTP_PROXY", raising=False)
+    monkeypatch.delenv("HTTPS_PROXY", raising=False)
+    log = []
+    library = books(tmp_path, log, sizes=(3, 4))
+    with BatchServer() as server:
+        manager = getattr(ai_models, manager_class)(
+            api_key="test", base_url=server.url + base_path, model="model", max_tokens=1000,
+            provider=sdk,
+        )
+        # About two requests per batch
+        prompt = manager._chunk_prompt("book 1 chunk 1", "")
+        request_size = len(json.dumps(manager.batch_request("chunk-0", prompt)))
+        manager.max_batch_bytes = 2 * request_size + 100
+
+        assert summarize_chunks_in_batch(manager, library, poll_interval=0) == 7
+
+    assert len(server.batches) == 4
+    assert all(size <= manager.max_batch_bytes for size in server.payload_sizes)
+    for title, author, book_dir, chunks in library:
+        checkpoint = BookCheckpoint(book_dir, "plan", "map_reduce", f"{sdk}/model")
+        assert all(checkpoint.is_done(n) for n in range(1, len(chunks) + 1))
@@ -0,0 +1,164 @@
+import hashlib
+import sqlite3
+
+import pytest
+
+import calibre_library
+from calibre_library import library_book, read_library
+
+SCHEMA = """
+CREATE TABLE books (id INTEGER PRIMARY KEY, title TEXT, sort TEXT, path TEXT, series_index REAL);
+CREATE TABLE authors (id INTEGER PRIMARY KEY, name TEXT);
+CREATE TABLE books_authors_link (id INTEGER PRIMARY KEY, book INTEGER, author INTEGER);
+CREATE TABLE series (id INTEGER PRIMARY KEY, name TEXT);
+CREATE TABLE books_series_link (id INTEGER PRIMARY KEY, book INTEGER, series INTEGER);
+CREATE TABLE data (id INTEGER PRIMARY KEY, book INTEGER, format TEXT, name TEXT);
+"""
+
+
+def add_book(library, connection, book_id, title, authors, formats, series=None, write=True):
+    """Add a book to the database, and its format files to the library when write is set."""
+    path = f"{authors[0] if authors else 'Unknown'}/{title} ({book_id})"
+    connection.execute(
+        "INSERT INTO books VALUES (?, ?, ?, ?, ?)",
+        (book_id, title, title.lower(), path, series[1] if series else 1.0),
+    )
+    for name in authors:
+        row = connection.execute("SELECT id FROM authors WHERE name = ?", (name,)).fetchone()
+        author_id = row[0] if row else connection.execute(
+            "INSERT INTO authors (name) VALUES (?)", (name,)
+        ).lastrowid
+        connection.execute(
+            "INSERT INTO books_authors_link (book, author) VALUES (?, ?)", (book_id, author_id)
+        )
+    if series:
+        series_id = connection.execute(
+            "INSERT INTO series (name) VALUES (?)", (series[0],)
+        ).lastrowid
+        connection.execute(
+            "INSERT INTO books_series_link (book, series) VALUES (?, ?)", (book_id, series_id)
+        )
+    book_dir = library / path
+    book_dir.mkdir(parents=True)
+    for book_format in formats:
+        connection.execute(
+            "INSERT INTO data (book, format, name) VALUES (?, ?, ?)", (book_id, book_format, title)
+        )
+        if write:
+            book_file = book_dir / f"{title}.{book_format.lower()}"
+            book_file.write_bytes(f"{title} {book_format}".encode())
+    return book_dir
+
+
+def make_library(library):
+    library.mkdir(exist_ok=True)
+    connection = sqlite3.connect(library / "metadata.db")
+    connection.executescript(SCHEMA)
+    add_book(library, connection, 1, "Zeta", ["Ann Author", "Bob Author"], ["MOBI", "EPUB", "PDF"])
+    add_book(library, connection, 2, "Alpha", ["Bob Author"], ["AZW3", "MOBI"], ("Saga", 2))
+    add_book(library, connection, 3, "Only PDF", ["Ann Author"], ["PDF"])
+    add_book(library, connection, 4, "Missing", [], ["EPUB"], write=False)
+    add_book(library, connection, 5, "No Author", [], ["MOBI"])
+    connection.commit()
+    connection.close()
+    return library
+
+
+def test_read_library_picks_the_preferred_format_and_first_author(tmp_path):
+    library = make_library(tmp_path / "library")
+
+    books = read_library(str(library))
+
+    assert [book.metadata() for book in books] == [
+        ("Alpha", "Bob Author", "Saga", "2.0"),
+        ("No Author", "", "", ""),
+        ("Zeta", "Ann Author", "", ""),
+    ]
+    assert [book.file_path for book in books] == [
+        str(library / "Bob Author" / "Alpha (2)" / "Alpha.azw3"),
+        str(library / "Unknown" / "No Author (5)" / "No Author.mobi"),
+        str(library / "Ann Author" / "Zeta (1)" / "Zeta.epub"),
+    ]
+
+
+def test_read_library_without_a_readable_database(tmp_path):
+    assert read_library(str(tmp_path)) is None
+    (tmp_path / "metadata.db").write_bytes(b"not a database")
+    assert read_library(str(tmp_path)) is None
+
+
+def test_database_stays_read_only(tmp_path):
+    library = make_library(tmp_path / "library")
+    connection = calibre_library._connect_read_only(str(library / "metadata.db"))
+    try:
+        with pytest.raises(sqlite3.OperationalError):
+            connection.execute("DELETE FROM books")
+    finally:
+        connection.close()
+
+
+def test_library_book_locates_files_of_the_library(tmp_path):
+    library = make_library(tmp_path / "library")
+    book_file = library / "Ann Author" / "Zeta (1)" / "Zeta.epub"
+
+    assert library_book(str(book_file)) == (str(library), 1)
+    assert library_book(str(tmp_path / "Zeta (1)" / "Zeta.epub")) is None
+    assert library_book(str(library / "Ann Author" / "Zeta" / "Zeta.epub")) is None
+
+
+def index_text(library, book_id, book_format, text, size, digest, err_msg=None):
+    connection = sqlite3.connect(library / "full-text-search.db")
+    connection.execute(
+        """CREATE TABLE IF NOT EXISTS books_text (id INTEGER PRIMARY KEY, book INTEGER,
+        format TEXT, format_size INTEGER, format_hash TEXT, searchable_text TEXT, err_msg TEXT)"""
+    )
+    connection.execute(
+        """INSERT INTO books_text (book, format, format_size, format_hash, searchable_text, err_msg)
+        VALUES (?, ?, ?, ?, ?, ?)""",
+        (book_id, book_format, size, digest, text, err_msg),
+    )
+    connection.commit()
+    connection.close()
+
+
+def indexed_book(tmp_path, stale=None):
+    """A TXT book of a library, with full-text index entry made stale as named."""
+    library = make_library(tmp_path / "library")
+    book_file = library / "Ann Author" / "Zeta (1)" / "Zeta.txt"
+    book_file.write_text("Parsed text", encoding="utf-8")
+    size = book_file.stat().st_size
+    digest = hashlib.sha256(book_file.read_bytes()).hexdigest()
+    index_text(
+        library,
+        1,
+        "TXT",
+        "Indexed text",
+        size + 1 if stale == "size" else size,
+        "0" * 64 if stale == "hash" else digest,
+        "Failed" if stale == "error" else None,
+    )
+    return str(book_file), digest
+
+
+def test_indexed_text_of_the_current_file(tmp_path, monkeypatch):
+    book_file, digest = indexed_book(tmp_path)
+    assert calibre_library.indexed_text(book_file) == "Indexed text"
+
+    # A digest from the caller spares hashing the file again
+    def file_hash(file_path):
+        raise AssertionError("the file was hashed again")
+
+    monkeypatch.setattr(calibre_library, "file_hash", file_hash)
+    assert calibre_library.indexed_text(book_file, digest) == "Indexed text"
+
+
+@pytest.mark.parametrize("stale", ["size", "hash", "error"])
+def test_stale_index_entry_falls_back_to_parsing(tmp_path, stale):
+    book_file, digest = indexed_book(tmp_path, stale)
+    assert calibre_library.indexed_text(book_file, digest) is None
+
+    for module in ("ebooklib", "bs4", "PyPDF2", "tqdm", "cryptography"):
+        pytest.importorskip(module)
+    import utils
+
+    assert utils._extract_text(book_file, digest) == "Parsed text"
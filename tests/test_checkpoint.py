@@ -0,0 +1,42 @@
+import json
+import os
+
+from checkpoint import CHECKPOINT_FILE, BookCheckpoint
+
+
+def test_completed_chunks_survive_a_restart(tmp_path):
+    checkpoint = BookCheckpoint(str(tmp_path), "plan", "sequential", "openai/gpt-4o-mini")
+    checkpoint.mark_done(1)
+    checkpoint.mark_done(2)
+
+    resumed = BookCheckpoint(str(tmp_path), "plan", "sequential", "openai/gpt-4o-mini")
+    assert resumed.completed == {1, 2}
+    assert resumed.is_done(2) and not resumed.is_done(3)
+
+
+def test_manifest_of_another_plan_mode_or_model_is_ignored(tmp_path):
+    BookCheckpoint(str(tmp_path), "plan", "sequential", "openai/gpt-4o-mini").mark_done(1)
+    for identity in (
+        ("other plan", "sequential", "openai/gpt-4o-mini"),
+        ("plan", "map_reduce", "openai/gpt-4o-mini"),
+        ("plan", "sequential", "anthropic/claude"),
+    ):
+        assert not BookCheckpoint(str(tmp_path), *identity).completed
+
+
+def test_unreadable_manifest_is_ignored(tmp_path):
+    (tmp_path / CHECKPOINT_FILE).write_text("{not json")
+    assert not BookCheckpoint(str(tmp_path), "plan", "sequential", "model").completed
+
+
+def test_manifest_is_replaced_atomically(tmp_path):
+    checkpoint = BookCheckpoint(str(tmp_path), "plan", "sequential", "model")
+    checkpoint.mark_done(3)
+    assert not os.path.exists(tmp_path / f"{CHECKPOINT_FILE}.tmp")
+    manifest = json.loads((tmp_path / CHECKPOINT_FILE).read_text())
+    assert manifest == {
+        "plan_hash": "plan",
+        "mode": "sequential",
+        "model": "model",
+        "completed_chunks": [3],
+    }
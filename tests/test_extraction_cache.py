@@ -0,0 +1,26 @@
+import hashlib
+
+from extraction_cache import ExtractionCache
+
+
+def test_extractor_gets_the_hash_and_runs_once(tmp_path):
+    book_file = tmp_path / "book.txt"
+    book_file.write_text("Some text", encoding="utf-8")
+    cache = ExtractionCache(str(tmp_path / "cache"))
+    calls = []
+
+    def extract(file_path, digest):
+        calls.append(digest)
+        return "Extracted"
+
+    assert cache.get_or_extract(str(book_file), extract) == "Extracted"
+    assert cache.get_or_extract(str(book_file), extract) == "Extracted"
+    assert calls == [hashlib.sha256(b"Some text").hexdigest()]
+
+
+def test_unreadable_file_goes_to_the_extractor(tmp_path):
+    cache = ExtractionCache(str(tmp_path / "cache"))
+    missing = str(tmp_path / "missing.txt")
+    assert cache.get_or_extract(missing, lambda file_path, digest: f"{file_path} {digest}") == (
+        f"{missing} None"
+    )
@@ -0,0 +1,40 @@
+import pytest
+
+httpx = pytest.importorskip("httpx")
+
+import http_transport
+
+
+@pytest.fixture(autouse=True)
+def default_settings():
+    saved = dict(http_transport._settings)
+    yield
+    http_transport.configure(**saved)
+
+
+def test_shared_client_is_reused():
+    assert http_transport.shared_client() is http_transport.shared_client()
+
+
+def test_configure_replaces_the_shared_client():
+    first = http_transport.shared_client()
+    http_transport.configure(pool_size=5)
+    second = http_transport.shared_client()
+    assert second is not first
+    assert first.is_closed
+
+
+def test_client_kwargs_follow_the_settings():
+    http_transport.configure(pool_size=7, read_timeout=42.0, connect_timeout=3.0, http2=False)
+    kwargs = http_transport.client_kwargs()
+    assert kwargs["limits"].max_connections == 7
+    assert kwargs["limits"].max_keepalive_connections == 7
+    assert kwargs["timeout"].read == 42.0
+    assert kwargs["timeout"].connect == 3.0
+    assert kwargs["http2"] is False
+
+
+def test_none_values_keep_the_current_settings():
+    http_transport.configure(pool_size=9)
+    http_transport.configure(pool_size=None)
+    assert http_transport.client_kwargs()["limits"].max_connections == 9
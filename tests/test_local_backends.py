@@ -0,0 +1,104 @@
+import threading
+
+import pytest
+
+httpx = pytest.importorskip("httpx")
+
+import local_backends
+from local_backends import LocalBackend
+
+
+class FakeProcess:
+    def __init__(self, returncode):
+        self.returncode = returncode
+
+    def poll(self):
+        return self.returncode
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    now = [0.0]
+
+    def sleep(seconds):
+        now[0] += seconds
+
+    monkeypatch.setattr(local_backends.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(local_backends.time, "sleep", sleep)
+    return LocalBackend("lmstudio", "http://127.0.0.1:1234", startup_timeout=10.0)
+
+
+def healthy_after(checks, calls=None):
+    answers = iter([False] * checks + [True] * 100)
+
+    def is_healthy():
+        if calls is not None:
+            calls.append(1)
+        return next(answers)
+
+    return is_healthy
+
+
+def test_launcher_exiting_cleanly_keeps_waiting(backend):
+    backend.process = FakeProcess(0)
+    backend.is_healthy = healthy_after(3)
+    assert backend.wait_until_healthy()
+
+
+def test_server_failing_stops_waiting(backend):
+    backend.process = FakeProcess(1)
+    calls = []
+    backend.is_healthy = healthy_after(1000, calls)
+    assert not backend.wait_until_healthy()
+    assert len(calls) == 1
+
+
+def test_server_not_answering_times_out(backend):
+    backend.process = FakeProcess(None)
+    backend.is_healthy = healthy_after(1000)
+    assert not backend.wait_until_healthy()
+    assert local_backends.time.monotonic() >= backend.startup_timeout
+
+
+def ollama_server(monkeypatch, pull_lines):
+    """Ollama without the model, answering pulls with pull_lines; returns the requests made."""
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        if request.url.path == "/api/tags":
+            return httpx.Response(200, json={"models": []})
+        if request.url.path == "/api/pull":
+            return httpx.Response(200, content="\n".join(pull_lines).encode())
+        return httpx.Response(200, json={})
+
+    client = httpx.Client(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(local_backends, "shared_client", lambda: client)
+    return requests
+
+
+def test_ollama_pull_and_load_have_bounded_timeouts(monkeypatch):
+    requests = ollama_server(monkeypatch, ['{"status": "pulling"}', '{"status": "success"}'])
+    backend = LocalBackend("ollama", "http://127.0.0.1:11434")
+    backend.num_ctx = 8192
+
+    assert backend._prepare_ollama("model", lambda message: None)
+    assert [request.url.path for request in requests] == ["/api/tags", "/api/pull", "/api/generate"]
+    assert all(request.extensions["timeout"]["read"] is not None for request in requests)
+
+
+def test_ollama_pull_stops_with_the_stop_event(monkeypatch):
+    requests = ollama_server(monkeypatch, ['{"status": "pulling"}'] * 3)
+    stop_event = threading.Event()
+    stop_event.set()
+
+    backend = LocalBackend("ollama", "http://127.0.0.1:11434")
+    assert not backend._prepare_ollama("model", lambda message: None, stop_event)
+    assert requests[-1].url.path == "/api/pull"
+
+
+def test_ollama_pull_error_fails_the_preparation(monkeypatch):
+    ollama_server(monkeypatch, ['{"error": "pull model manifest: file does not exist"}'])
+    backend = LocalBackend("ollama", "http://127.0.0.1:11434")
+    monkeypatch.setattr(backend, "is_healthy", lambda: True)
+    assert not backend.prepare("model", 8192)
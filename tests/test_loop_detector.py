@@ -0,0 +1,60 @@
+import random
+import string
+
+import pytest
+
+import loop_detector
+from loop_detector import RepetitionDetector
+
+
+def random_text(length, seed=0):
+    rng = random.Random(seed)
+    return "".join(rng.choice(string.ascii_lowercase + " ") for _ in range(length))
+
+
+def test_looping_text_is_cut_where_the_repeat_starts():
+    intro = random_text(200)
+    loop = random_text(80, seed=1)
+    detector = RepetitionDetector(window=50)
+    # The repeated window ends 50 characters into the second copy of the loop
+    assert detector.feed(intro + loop + loop + loop) == len(intro) + len(loop)
+
+
+def test_text_without_repeats_is_not_cut():
+    assert RepetitionDetector(window=50).feed(random_text(5000)) is None
+
+
+def test_cut_does_not_depend_on_how_the_text_is_streamed():
+    text = random_text(300) + random_text(120, seed=1) * 3
+    whole = RepetitionDetector(window=40).feed(text)
+
+    detector = RepetitionDetector(window=40)
+    pieces = [text[i : i + 7] for i in range(0, len(text), 7)]
+    cuts = [detector.feed(piece) for piece in pieces]
+    assert whole is not None
+    assert [cut for cut in cuts if cut is not None][0] == whole
+
+
+def test_overlapping_windows_are_not_a_repeat():
+    detector = RepetitionDetector(window=10)
+    # A run of one character matches itself one character later, but only a
+    # second, separate window of it counts as a repeat
+    assert detector.feed("x" * 19) is None
+    assert detector.feed("x") == 10
+
+
+def test_hash_collisions_are_not_repeats(monkeypatch):
+    monkeypatch.setattr(loop_detector, "_MOD", 7)
+    assert RepetitionDetector(window=20).feed(random_text(2000)) is None
+
+
+def test_collect_stream_stops_at_the_loop():
+    pytest.importorskip("httpx")
+    from ai_models import collect_stream
+
+    intro = random_text(200)
+    loop = random_text(80, seed=1)
+    deltas = iter([intro, loop, loop, "never read"])
+
+    assert collect_stream(deltas, repetition_window=50) == intro + loop
+    assert next(deltas) == "never read"
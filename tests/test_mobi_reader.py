@@ -0,0 +1,212 @@
+import struct
+
+import pytest
+
+from mobi_reader import (
+    COMPRESSION_HUFF_CDIC,
+    COMPRESSION_NONE,
+    COMPRESSION_PALMDOC,
+    MobiError,
+    palmdoc_decompress,
+    read_mobi_text,
+)
+
+HTML = (
+    b"<html><head><title>Skipped</title><style>p { margin: 0 }</style></head><body>"
+    b"<p>It was a bright cold day in April.</p><p>The clocks were striking thirteen.</p>"
+    b"</body></html>"
+)
+TEXT = "It was a bright cold day in April.\nThe clocks were striking thirteen.\n"
+
+
+def palmdoc_compress(data):
+    """Greedy PalmDOC LZ77, using every kind of token the format has."""
+    out = bytearray()
+    i = 0
+    while i < len(data):
+        best_length, best_distance = 0, 0
+        for distance in range(1, min(i, 2047) + 1):
+            length = 0
+            while (
+                length < 10
+                and i + length < len(data)
+                and data[i + length] == data[i - distance + length]
+            ):
+                length += 1
+            if length > best_length:
+                best_length, best_distance = length, distance
+        if best_length >= 3:
+            out += struct.pack(">H", 0x8000 | (best_distance << 3) | (best_length - 3))
+            i += best_length
+        elif data[i] == 0x20 and i + 1 < len(data) and 0x40 <= data[i + 1] <= 0x7F:
+            out.append(data[i + 1] ^ 0x80)
+            i += 2
+        elif data[i] == 0 or 0x09 <= data[i] <= 0x7F:
+            out.append(data[i])
+            i += 1
+        else:
+            out += bytes([1, data[i]])
+            i += 1
+    return bytes(out)
+
+
+def huff_record():
+    """Code table where every code is 8 bits long, so byte b stands for entry 255 - b."""
+    table = struct.pack(">256L", *[(255 << 8) | 0x80 | 8] * 256)
+    header = b"HUFF\x00\x00\x00\x18" + struct.pack(">LL", 24, 24 + len(table)) + bytes(8)
+    return header + table + bytes(256)
+
+
+def cdic_record(entries):
+    """Dictionary of (phrase, decoded) entries."""
+    offsets = []
+    data = b""
+    for phrase, decoded in entries:
+        offsets.append(2 * len(entries) + len(data))
+        data += struct.pack(">H", len(phrase) | (0x8000 if decoded else 0)) + phrase
+    return (
+        b"CDIC\x00\x00\x00\x10"
+        + struct.pack(">LL", len(entries), 8)
+        + struct.pack(f">{len(entries)}H", *offsets)
+        + data
+    )
+
+
+def huff_encode(indices):
+    return bytes(255 - index for index in indices)
+
+
+def record0(compression, text_length, text_records, encryption=0, mobi=True, **fields):
+    header = bytearray(0x110 if mobi else 16)
+    struct.pack_into(
+        ">HxxLHHH", header, 0, compression, text_length, text_records, 4096, encryption
+    )
+    if mobi:
+        header[16:20] = b"MOBI"
+        encoding, version = fields.get("encoding", 65001), fields.get("version", 6)
+        struct.pack_into(">LLLLL", header, 20, 0xE8, 2, encoding, 0, version)
+        struct.pack_into(">LL", header, 0x70, *fields.get("huff", (0, 0)))
+        struct.pack_into(">L", header, 0xC0, fields.get("fdst", 0))
+        struct.pack_into(">H", header, 0xF2, fields.get("extra_flags", 0))
+    return bytes(header)
+
+
+def palm_database(records, kind=b"BOOKMOBI"):
+    header = bytearray(78)
+    header[:4] = b"Test"
+    header[60:68] = kind
+    struct.pack_into(">H", header, 76, len(records))
+    offset = 78 + 8 * len(records) + 2
+    table = b""
+    for uid, record in enumerate(records):
+        table += struct.pack(">LL", offset, uid)
+        offset += len(record)
+    return bytes(header) + table + b"\x00\x00" + b"".join(records)
+
+
+def write_book(
+    tmp_path, text_records, text_length, compression=COMPRESSION_NONE, extra=(), **fields
+):
+    book = tmp_path / "book.mobi"
+    records = [record0(compression, text_length, len(text_records), **fields)]
+    book.write_bytes(palm_database(records + list(text_records) + list(extra)))
+    return str(book)
+
+
+def test_uncompressed_book(tmp_path):
+    book = write_book(tmp_path, [HTML[:100], HTML[100:]], len(HTML))
+    assert read_mobi_text(book) == TEXT
+
+
+def test_palmdoc_round_trip():
+    data = b"aaaaaaaaaaaaaaaa x y \x01\x02\xe9\xff\x00 the theme then the end " * 3
+    compressed = palmdoc_compress(data)
+    assert len(compressed) < len(data)
+    assert palmdoc_decompress(compressed) == data
+
+
+def test_palmdoc_book(tmp_path):
+    records = [palmdoc_compress(HTML[:120]), palmdoc_compress(HTML[120:])]
+    book = write_book(tmp_path, records, len(HTML), COMPRESSION_PALMDOC)
+    assert read_mobi_text(book) == TEXT
+
+
+def test_huff_cdic_book(tmp_path):
+    words = [b"<p>", b"</p>", b"Call me ", b"Ishmael", b"."]
+    # Entry 5 is compressed itself, as a reference to entries 2 and 3
+    entries = [(word, True) for word in words] + [(huff_encode([2, 3]), False)]
+    records = [huff_encode([0, 5, 4, 1]), huff_encode([0, 2, 3, 4, 1])]
+    book = write_book(
+        tmp_path,
+        records,
+        2 * len(b"<p>Call me Ishmael.</p>"),
+        COMPRESSION_HUFF_CDIC,
+        extra=[huff_record(), cdic_record(entries)],
+        huff=(3, 2),
+    )
+    assert read_mobi_text(book) == "Call me Ishmael.\nCall me Ishmael.\n"
+
+
+def test_trailing_entries_and_multibyte_characters(tmp_path):
+    # "é" spans the two records; the first repeats its continuation byte as
+    # multibyte trailing data, then both end with a 3 byte trailing entry
+    entry = b"xx\x83"
+    records = [b"<p>Caf\xc3" + b"\xa9\x01" + entry, b"\xa9 au lait</p>" + b"\x00" + entry]
+    book = write_book(tmp_path, records, len("<p>Café au lait</p>".encode()), extra_flags=0b11)
+    assert read_mobi_text(book) == "Café au lait\n"
+
+
+def test_kf8_text_ends_with_its_first_flow(tmp_path):
+    css = b"p { color: red }"
+    flows = b"FDST" + struct.pack(">LL", 12, 2) + struct.pack(
+        ">LLLL", 0, len(HTML), len(HTML), len(HTML) + len(css)
+    )
+    book = write_book(
+        tmp_path, [HTML + css], len(HTML) + len(css), extra=[flows], version=8, fdst=2
+    )
+    assert read_mobi_text(book) == TEXT
+
+
+def test_plain_palmdoc_keeps_a_reading_position(tmp_path):
+    book = tmp_path / "book.pdb"
+    records = [record0(COMPRESSION_NONE, 11, 1, encryption=5, mobi=False), b"Caf\xe9 noir."]
+    book.write_bytes(palm_database(records, b"TEXtREAd"))
+    assert read_mobi_text(str(book)) == "Café noir."
+
+
+@pytest.mark.parametrize(
+    "kind, message",
+    [
+        ("junk", "not a MOBI file"),
+        ("encrypted", "encrypted"),
+        ("unknown compression", "unknown compression"),
+        ("truncated", "corrupt book"),
+        ("self-referencing CDIC", "corrupt book"),
+    ],
+)
+def test_unreadable_books(tmp_path, kind, message):
+    if kind == "junk":
+        book = tmp_path / "book.mobi"
+        book.write_bytes(b"\x00" * 200)
+        book = str(book)
+    elif kind == "encrypted":
+        book = write_book(tmp_path, [HTML], len(HTML), encryption=2)
+    elif kind == "unknown compression":
+        book = write_book(tmp_path, [HTML], len(HTML), compression=3)
+    elif kind == "truncated":
+        book = write_book(tmp_path, [HTML], len(HTML))
+        with open(book, "r+b") as f:
+            f.truncate(90)
+    else:
+        entries = [(b"<p>", True), (huff_encode([1]), False)]
+        book = write_book(
+            tmp_path,
+            [huff_encode([0, 1])],
+            10,
+            COMPRESSION_HUFF_CDIC,
+            extra=[huff_record(), cdic_record(entries)],
+            huff=(2, 2),
+        )
+
+    with pytest.raises(MobiError, match=message):
+        read_mobi_text(book)
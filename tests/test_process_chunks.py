@@ -0,0 +1,98 @@
+import pytest
+
+for module in ("ebooklib", "bs4", "PyPDF2", "tqdm", "cryptography"):
+    pytest.importorskip(module)
+
+import utils
+from retry_policy import RetryPolicy
+
+
+class Chunks(list):
+    def fingerprint(self):
+        return "plan"
+
+
+class FakeManager:
+    """Summarizes chunks, failing the chunks listed in fail_at."""
+
+    provider = "fake"
+    model = "model"
+    max_tokens = 100000
+    max_output_tokens = 1000
+
+    def __init__(self, fail_at=(), summary_words=0):
+        self.fail_at = set(fail_at)
+        self.summary_words = summary_words
+        self.requested = []
+        self.final_prompts = []
+        self.retry_policy = RetryPolicy("fake/model", base_delay=0)
+
+    def summarize_chunk(self, content, previous_summaries, retry_budget=None):
+        self.requested.append(content)
+        if content in self.fail_at:
+            return ""
+        return f"summary of {content}" + " word" * self.summary_words
+
+    def create_final_summary(self, summaries, title, author, retry_budget=None):
+        self.final_prompts.append(summaries)
+        return f"final of {len(summaries.split())} words" + " word" * self.summary_words
+
+
+def process(book_dir, manager, mode, progress=None):
+    chunks = Chunks(f"chunk {i}" for i in range(1, 6))
+    return utils.process_chunks(
+        chunks, "Title", "Author", str(book_dir), manager, progress, mode=mode, max_workers=2
+    )
+
+
+@pytest.mark.parametrize(
+    "mode, requested, resumed_chunks",
+    [
+        # The first run stopped at the failed chunk
+        ("sequential", ["chunk 3", "chunk 4", "chunk 5"], 2),
+        # The first run summarized every other chunk
+        ("map_reduce", ["chunk 3"], 4),
+    ],
+)
+def test_aborted_book_resumes_from_its_checkpoint(tmp_path, mode, requested, resumed_chunks):
+    assert process(tmp_path, FakeManager(fail_at={"chunk 3"}), mode) is None
+
+    manager = FakeManager()
+    resumed_steps = []
+    summary = process(
+        tmp_path,
+        manager,
+        mode,
+        lambda step, total, resumed=False: resumed_steps.append(resumed),
+    )
+
+    assert summary
+    assert sorted(manager.requested) == requested
+    assert resumed_steps.count(True) == resumed_chunks
+
+
+def test_checkpoint_of_another_model_starts_over(tmp_path):
+    process(tmp_path, FakeManager(fail_at={"chunk 3"}), "sequential")
+    manager = FakeManager()
+    manager.model = "other-model"
+    assert process(tmp_path, manager, "sequential")
+    assert "chunk 1" in manager.requested
+
+
+def test_summaries_over_the_context_are_merged_in_groups(tmp_path):
+    # Five summaries of about 1300 tokens each, with 3500 tokens of room for them
+    manager = FakeManager(summary_words=1000)
+    manager.max_tokens = 5000
+
+    assert process(tmp_path, manager, "sequential")
+    assert len(manager.final_prompts) == 4
+    assert all(
+        utils.estimate_tokens(prompt) <= 5000 - 1000 - utils.FINAL_PROMPT_OVERHEAD_TOKENS
+        for prompt in manager.final_prompts
+    )
+
+
+def test_summaries_within_the_context_take_one_request(tmp_path):
+    manager = FakeManager()
+    assert process(tmp_path, manager, "sequential")
+    assert len(manager.final_prompts) == 1
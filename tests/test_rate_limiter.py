@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+
+import rate_limiter
+from rate_limiter import DailyLimitReached, RateLimiter
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(rate_limiter.time, "time", lambda: now[0])
+    return now
+
+
+def limiter(tmp_path, **limits):
+    return RateLimiter("provider", "model", db_path=str(tmp_path / "limits.db"), **limits)
+
+
+def test_requests_per_minute_bucket_empties_and_refills(tmp_path, clock):
+    bucket = limiter(tmp_path, rpm=2)
+    assert bucket._try_acquire(0) == 0
+    assert bucket._try_acquire(0) == 0
+    assert bucket._try_acquire(0) == pytest.approx(30)
+
+    clock[0] += 30
+    assert bucket._try_acquire(0) == 0
+
+
+def test_tokens_per_minute_wait_for_the_missing_tokens(tmp_path, clock):
+    bucket = limiter(tmp_path, tpm=6000)
+    assert bucket._try_acquire(4000) == 0
+    assert bucket._try_acquire(4000) == pytest.approx(20)
+
+
+def test_request_larger_than_the_bucket_waits_for_a_full_bucket(tmp_path, clock):
+    bucket = limiter(tmp_path, tpm=1000)
+    assert bucket._try_acquire(5000) == 0
+    assert bucket._try_acquire(5000) == pytest.approx(60)
+
+
+def test_daily_request_limit(tmp_path, clock):
+    bucket = limiter(tmp_path, rpd=2)
+    bucket.acquire()
+    bucket.acquire()
+    with pytest.raises(DailyLimitReached):
+        bucket.acquire()
+
+
+def test_daily_token_limit(tmp_path, clock):
+    bucket = limiter(tmp_path, tpd=1000)
+    bucket.acquire(800)
+    with pytest.raises(DailyLimitReached):
+        bucket.acquire(300)
+
+
+def test_limiters_of_the_same_model_share_the_quota(tmp_path, clock):
+    first = limiter(tmp_path, rpm=1)
+    second = limiter(tmp_path, rpm=1)
+    assert first._try_acquire(0) == 0
+    assert second._try_acquire(0) == pytest.approx(60)
+
+
+def test_acquire_async_waits_off_the_event_loop(tmp_path, clock, monkeypatch):
+    bucket = limiter(tmp_path, rpm=1)
+    slept = []
+
+    async def fake_sleep(seconds):
+        slept.append(seconds)
+        clock[0] += seconds
+
+    monkeypatch.setattr(rate_limiter.asyncio, "sleep", fake_sleep)
+
+    async def acquire_twice():
+        await bucket.acquire_async()
+        await bucket.acquire_async()
+
+    asyncio.run(acquire_twice())
+    assert slept == [pytest.approx(60)]
+
+
+def test_from_model_info_without_limits():
+    assert RateLimiter.from_model_info("provider", {"name": "model"}) is None
@@ -0,0 +1,64 @@
+import pytest
+
+import response_cache
+from response_cache import ResponseCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(response_cache.time, "time", lambda: now[0])
+    return now
+
+
+def cache(tmp_path, **kwargs):
+    return ResponseCache(str(tmp_path / "responses.db"), **kwargs)
+
+
+def test_round_trip_and_persistence(tmp_path):
+    cache(tmp_path).put("key", "summary")
+    assert cache(tmp_path).get("key") == "summary"
+    assert cache(tmp_path).get("missing") is None
+
+
+def test_key_covers_everything_that_shapes_the_response():
+    base = ("openai", "gpt-4o-mini", 0.5, "system", "prompt")
+    keys = {ResponseCache.key(*base)}
+    for index, value in enumerate(("anthropic", "gpt-4o", 0.7, "other system", "other prompt")):
+        changed = list(base)
+        changed[index] = value
+        keys.add(ResponseCache.key(*changed))
+    assert len(keys) == 6
+    assert ResponseCache.key(*base) == ResponseCache.key(*base)
+
+
+def test_entries_expire_after_max_age(tmp_path, clock):
+    responses = cache(tmp_path, max_age_days=1)
+    responses.put("key", "summary")
+    clock[0] += 86400 + 1
+    assert responses.get("key") is None
+
+
+def test_least_recently_used_entries_are_evicted_past_the_size_limit(tmp_path, clock):
+    responses = cache(tmp_path, max_megabytes=2.5 / 1024, evict_every=1)
+    kilobyte = "x" * 1024
+    responses.put("old", kilobyte)
+    clock[0] += 7200
+    responses.put("recent", kilobyte)
+    clock[0] += 7200
+    # Reading refreshes the access time of an entry
+    assert responses.get("old") == kilobyte
+    clock[0] += 7200
+    responses.put("new", kilobyte)
+
+    assert responses.get("recent") is None
+    assert responses.get("old") == kilobyte
+    assert responses.get("new") == kilobyte
+
+
+def test_from_settings(tmp_path):
+    assert ResponseCache.from_settings({"enabled": False}) is None
+    responses = ResponseCache.from_settings(
+        {"db_path": str(tmp_path / "responses.db"), "max_megabytes": 1}
+    )
+    assert responses.max_bytes == 1024 * 1024
@@ -0,0 +1,183 @@
+import asyncio
+import importlib
+
+import pytest
+
+import retry_policy
+from rate_limiter import DailyLimitReached
+from retry_policy import CircuitBreaker, CircuitOpen, RetryBudget, RetryPolicy
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+def accept(response):
+    return None
+
+
+def policy(**kwargs):
+    kwargs.setdefault("base_delay", 0)
+    kwargs.setdefault("failure_threshold", 100)
+    return RetryPolicy("provider/model", **kwargs)
+
+
+def sender(*outcomes):
+    """send() returning or raising each outcome in turn, counting the calls."""
+    calls = []
+
+    def send():
+        outcome = outcomes[len(calls)]
+        calls.append(outcome)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+    return send, calls
+
+
+def test_retries_errors_until_a_response_is_accepted():
+    send, calls = sender(StatusError(503), TimeoutError(), "summary")
+    assert policy().call(send, accept, "task", "Giving up.") == "summary"
+    assert len(calls) == 3
+
+
+def test_rejected_responses_are_retried():
+    send, calls = sender("too short", "long enough")
+    check = lambda response: "too short" if response == "too short" else None
+    assert policy().call(send, check, "task", "Giving up.") == "long enough"
+    assert len(calls) == 2
+
+
+@pytest.mark.parametrize("error", [StatusError(400), StatusError(401), DailyLimitReached("quota")])
+def test_client_errors_and_daily_limits_are_not_retried(error):
+    send, calls = sender(error, "summary")
+    assert policy().call(send, accept, "task", "Giving up.") == ""
+    assert len(calls) == 1
+
+
+def test_gives_up_after_max_attempts():
+    send, calls = sender(*[StatusError(500)] * 10)
+    assert policy(max_attempts=3).call(send, accept, "task", "Giving up.") == ""
+    assert len(calls) == 3
+
+
+def test_book_budget_is_shared_by_the_requests_of_a_book():
+    retries = policy(book_budget=2)
+    budget = retries.book_budget()
+    send, calls = sender(StatusError(500), StatusError(500), StatusError(500), "summary")
+    assert retries.call(send, accept, "task", "Giving up.", budget) == ""
+    assert len(calls) == 3
+
+    # The next request of the same book has no retries left
+    send, calls = sender(StatusError(500), "summary")
+    assert retries.call(send, accept, "task", "Giving up.", budget) == ""
+    assert len(calls) == 1
+
+    # Another book starts with a fresh budget
+    send, calls = sender(StatusError(500), "summary")
+    assert retries.call(send, accept, "task", "Giving up.", retries.book_budget()) == "summary"
+
+
+def test_run_budget_caps_retries_across_books():
+    retries = policy(run_budget=1, book_budget=None)
+    send, _ = sender(StatusError(500), "summary")
+    assert retries.call(send, accept, "task", "Giving up.", retries.book_budget()) == "summary"
+    send, calls = sender(StatusError(500), "summary")
+    assert retries.call(send, accept, "task", "Giving up.", retries.book_budget()) == ""
+    assert len(calls) == 1
+
+
+def test_unlimited_budget():
+    budget = RetryBudget(None)
+    assert all(budget.spend() for _ in range(1000))
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(retry_policy.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_circuit_opens_after_consecutive_failures_and_fails_fast(clock):
+    retries = policy(failure_threshold=3, cooldown=60, max_attempts=5)
+    send, calls = sender(*[StatusError(503)] * 5)
+    assert retries.call(send, accept, "task", "Giving up.") == ""
+    # The fourth attempt is refused by the open circuit without a request
+    assert len(calls) == 3
+    assert retries.breaker.remaining_cooldown() == 60
+
+    send, calls = sender("summary")
+    assert retries.call(send, accept, "task", "Giving up.") == ""
+    assert not calls
+
+
+def test_probe_after_the_cooldown_closes_or_reopens_the_circuit(clock):
+    breaker = CircuitBreaker("provider/model", failure_threshold=1, cooldown=60)
+    breaker.record_failure()
+    with pytest.raises(CircuitOpen):
+        breaker.before_call()
+
+    clock[0] += 60
+    breaker.before_call()
+    # Only one probe at a time
+    with pytest.raises(CircuitOpen):
+        breaker.before_call()
+    breaker.record_failure()
+    assert breaker.remaining_cooldown() == 60
+
+    clock[0] += 60
+    breaker.before_call()
+    breaker.record_success()
+    breaker.before_call()
+    assert breaker.opened_at is None
+
+
+def test_client_error_on_a_probe_does_not_leave_it_pending(clock):
+    retries = policy(failure_threshold=1, cooldown=60)
+    retries.breaker.record_failure()
+    clock[0] += 60
+    send, _ = sender(StatusError(400))
+    assert retries.call(send, accept, "task", "Giving up.") == ""
+    retries.breaker.before_call()
+
+
+def test_success_resets_the_consecutive_failures():
+    breaker = CircuitBreaker("provider/model", failure_threshold=2)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.before_call()
+
+
+def test_call_async():
+    outcomes = iter([StatusError(429), "summary"])
+
+    async def send():
+        outcome = next(outcomes)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+    result = asyncio.run(policy().call_async(send, accept, "task", "Giving up."))
+    assert result == "summary"
+
+
+@pytest.mark.parametrize(
+    "sdk, module, manager",
+    [
+        ("openai", "ai_models", "OpenAIManager"),
+        ("anthropic", "ai_models", "AnthropicManager"),
+        ("openai", "async_ai_models", "AsyncOpenAIManager"),
+        ("anthropic", "async_ai_models", "AsyncAnthropicManager"),
+    ],
+)
+def test_sdk_clients_leave_retries_to_the_policy(sdk, module, manager):
+    pytest.importorskip(sdk)
+    pytest.importorskip("httpx")
+    manager_class = getattr(importlib.import_module(module), manager)
+    client = manager_class(api_key="test", model="model", max_tokens=1000).client
+    assert client.max_retries == 0
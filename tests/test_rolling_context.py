@@ -0,0 +1,60 @@
+from chunk_planner import estimate_tokens
+from rolling_context import RollingContext
+
+
+class FakeManager:
+    def __init__(self, condensed_words=None):
+        self.condensed_words = condensed_words
+        self.calls = []
+
+    def condense_summaries(self, summaries, max_words, retry_budget=None):
+        self.calls.append(max_words)
+        words = max_words if self.condensed_words is None else self.condensed_words
+        return " ".join(["synopsis"] * words)
+
+
+def summary(words=800):
+    return " ".join(["word"] * words)
+
+
+def test_small_budget_keeps_fewer_verbatim_summaries():
+    # A quarter of an 8k local model context
+    context = RollingContext(FakeManager(), keep_last=3, budget_tokens=2048)
+    for _ in range(10):
+        context.add(summary())
+        assert estimate_tokens(context.render()) <= 2048
+    assert len(context.recent) == 1
+
+
+def test_large_budget_keeps_keep_last_summaries():
+    context = RollingContext(FakeManager(), keep_last=3, budget_tokens=6000)
+    for _ in range(10):
+        context.add(summary(300))
+    assert len(context.recent) == 3
+    assert context.render().startswith("Story so far: ")
+
+
+def test_condenses_when_over_budget():
+    manager = FakeManager()
+    context = RollingContext(manager, keep_last=2, budget_tokens=4000)
+    for _ in range(20):
+        context.add(summary())
+        assert estimate_tokens(context.render()) <= 4000
+    assert manager.calls
+
+
+def test_truncates_when_condensation_fails_or_overshoots():
+    for condensed_words in (0, 10_000):
+        context = RollingContext(
+            FakeManager(condensed_words), keep_last=3, budget_tokens=2048
+        )
+        for _ in range(10):
+            context.add(summary())
+            assert estimate_tokens(context.render()) <= 2048
+
+
+def test_tiny_budget_drops_verbatim_summaries():
+    context = RollingContext(FakeManager(0), keep_last=3, budget_tokens=300)
+    context.add(summary())
+    assert not context.recent
+    assert estimate_tokens(context.render()) <= 300
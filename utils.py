@@ -1,17 +1,29 @@
+import asyncio
 import os
 import xml.etree.ElementTree as ET
 import subprocess
 import ebooklib
 import json
 import logging
+import threading
 import PyPDF2
 from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
-from typing import Set, Tuple, Optional
+from typing import Any, Dict, Set, Tuple, Optional
 
 from cryptography.fernet import Fernet
 from ebooklib import epub
 
+from calibre_library import indexed_text
+from checkpoint import BookCheckpoint
+from chunk_planner import BookChunks, estimate_tokens, plan_chunks
+from extraction_cache import ExtractionCache
+from mobi_reader import MobiError, read_mobi_text
+from rolling_context import RollingContext
+
+extraction_cache = ExtractionCache()
+
 
 def save_api_keys_to_file(keys):
     with open("api_keys.json", "w") as file:
@@ -146,7 +158,9 @@ def save_aborted_books(aborted_books: Set[str]) -> None:
 
 
 def convert_to_epub(book_file: str) -> str:
-    """Convert .mobi and .azw3 files to .epub using calibre's ebook-convert."""
+    """Convert .mobi and .azw3 files to .epub using calibre's ebook-convert.
+
+    Only needed for the books mobi_reader cannot decode, such as encrypted ones."""
     script_dir = os.path.dirname(os.path.abspath(__file__))
     
     # Ensure the 'converted' directory exists
@@ -179,6 +193,22 @@ def save_chunk_summary(
         f.write(summary)
 
 
+def load_chunk_summary(
+    book_dir: str, title: str, author: str, chunk_number: int
+) -> Optional[str]:
+    """Read back a chunk summary written by save_chunk_summary."""
+    summary_filename = f"{title} - {author} - Chunk {chunk_number}.txt"
+    summary_path = os.path.join(book_dir, "chunk_summaries", summary_filename)
+    try:
+        with open(summary_path, "r", encoding="utf-8") as f:
+            content = f.read()
+    except OSError:
+        return None
+    # Skip the title, author and chunk header lines
+    summary = content.split("\n\n", 1)[-1]
+    return summary or None
+
+
 def find_ocr_files(file_path):
     "from a book file path, search its parent directory to find the ocr file for that book"
     parent_dir = os.path.dirname(file_path)
@@ -269,11 +299,26 @@ def save_conversion_cache(conversion_cache: dict[str, str]) -> None:
 
 
 def read_epub(file_path: str) -> str:
-    """Extract text from an epub, azw3, mobi, PDF, TXT, or HTML file."""
+    """Extract text from an epub, azw3, mobi, PDF, TXT, or HTML file.
+
+    Results are served from the on-disk extraction cache when the file content
+    was already extracted, so repeated estimates do no HTML parsing."""
+    return extraction_cache.get_or_extract(file_path, _extract_text)
+
 
-    conversion_cache = load_conversion_cache()
+def _extract_text(file_path: str, digest: Optional[str] = None) -> str:
+    # Books of a Calibre library may already have been extracted by its indexer
+    text = indexed_text(file_path, digest)
+    if text:
+        return text
 
     if any(file_path.endswith(x) for x in [".azw3", ".mobi"]):
+        try:
+            return read_mobi_text(file_path)
+        except MobiError as e:
+            logging.info(f"Reading {file_path} through ebook-convert: {e}")
+
+        conversion_cache = load_conversion_cache()
         if not file_path in conversion_cache or not os.path.exists(
             conversion_cache[file_path]
         ):
@@ -324,13 +369,121 @@ def read_epub(file_path: str) -> str:
             return ""
 
 
+def preprocess_book(
+    book_path: str, max_tokens: int, tpm, summary_budget: Optional[int] = None
+) -> Dict[str, Any]:
+    """Extract a book and plan its chunks.
+
+    Runs inside preprocessing worker processes, so it only takes and returns
+    picklable values. "chunks" is None when the book could not be read or is
+    too large to process with the given settings."""
+    result = {
+        "book_path": book_path,
+        "chunks": None,
+        "chunk_info": None,
+        "total_tokens": 0,
+        "theoretical_max_tokens": 0,
+    }
+
+    content = read_epub(book_path)
+    if not content:
+        return result
+
+    plan = plan_chunks(len(content.split()), max_tokens, tpm, summary_budget)
+
+    result["total_tokens"] = plan.total_tokens
+    result["theoretical_max_tokens"] = plan.capacity_tokens
+    if plan.feasible:
+        # Chunks are sent back as offsets, the text is re-read when processing
+        result["chunks"] = BookChunks.from_plan(book_path, plan, content, read_epub)
+        result["chunk_info"] = plan.chunk_info
+    return result
+
+
+# Summaries merged per create_final_summary request in map-reduce mode
+MAP_REDUCE_FAN_IN = 8
+
+
+def count_reduce_steps(num_summaries: int, fan_in: int) -> int:
+    """Number of merge requests a tree reduction of num_summaries takes."""
+    steps = 0
+    while num_summaries > 1:
+        groups = -(-num_summaries // fan_in)
+        # A trailing group of one summary is carried over without a request
+        steps += groups - (1 if num_summaries % fan_in == 1 else 0)
+        num_summaries = groups
+    return steps
+
+
+# Instructions and metadata around the summaries of a create_final_summary prompt
+FINAL_PROMPT_OVERHEAD_TOKENS = 500
+
+
+def reduce_summaries(
+    manager, summaries, title, author, retry_budget=None, fan_in=MAP_REDUCE_FAN_IN
+) -> Optional[str]:
+    """Merge summaries into the final summary without overflowing the model's context.
+
+    They go in one create_final_summary request when they fit beside the
+    response, otherwise they are merged up to fan_in at a time, and as many as
+    fit, until they do."""
+    budget = int(manager.max_tokens) - manager.max_output_tokens - FINAL_PROMPT_OVERHEAD_TOKENS
+    while len(summaries) > 1 and estimate_tokens("\n\n".join(summaries)) > budget:
+        groups = [[]]
+        for summary in summaries:
+            group = groups[-1]
+            if len(group) >= 2 and (
+                len(group) >= fan_in
+                or estimate_tokens("\n\n".join(group + [summary])) > budget
+            ):
+                groups.append([])
+            groups[-1].append(summary)
+        merged = []
+        for group in groups:
+            summary = group[0] if len(group) == 1 else manager.create_final_summary(
+                "\n\n".join(group), title, author, retry_budget
+            )
+            if not summary:
+                return None
+            merged.append(summary)
+        summaries = merged
+    return manager.create_final_summary("\n\n".join(summaries), title, author, retry_budget)
+
+
 def process_chunks(
-    chunks, title, author, book_dir, manager, progress_callback=None
+    chunks,
+    title,
+    author,
+    book_dir,
+    manager,
+    progress_callback=None,
+    mode="sequential",
+    max_workers=8,
+    fan_in=MAP_REDUCE_FAN_IN,
+    rolling_context=None,
+    stop_event=None,
 ) -> Optional[str]:
-    """Process and summarize chunks of the book content."""
+    """Process and summarize chunks of the book content.
+
+    In "sequential" mode every chunk is summarized with the summaries of the
+    chunks before it, or with a RollingContext built from the rolling_context
+    keyword arguments when given, and the chunk summaries are merged by
+    reduce_summaries. In "map_reduce" mode chunks are summarized independently
+    by up to max_workers parallel requests, and the summaries are then merged
+    fan_in at a time through create_final_summary until one is left. With a
+    SyncBridge manager those requests all run on its event loop instead of
+    one thread each.
+
+    Setting stop_event makes the book fail after the requests in flight. All
+    requests of the book share one retry budget.
+
+    Chunks recorded in the book's checkpoint by an earlier, interrupted run of
+    the same plan and model are read back from their saved summaries instead
+    of being summarized again, and reported with resumed=True."""
+    retry_budget = manager.retry_policy.book_budget()
     if len(chunks) == 1:
         logging.info("Summarizing entire book in one chunk...")
-        summary = manager.create_final_summary(chunks[0], title, author)
+        summary = manager.create_final_summary(chunks[0], title, author, retry_budget)
         if summary:
             save_chunk_summary(book_dir, title, author, 1, summary)
             if progress_callback:
@@ -340,38 +493,91 @@ def process_chunks(
             logging.error(f"Failed to summarize {title} in one chunk")
             return None
 
+    checkpoint = BookCheckpoint(
+        book_dir, chunks.fingerprint(), mode, f"{manager.provider}/{manager.model}"
+    )
+
+    def resumed_summary(index):
+        if not checkpoint.is_done(index + 1):
+            return None
+        return load_chunk_summary(book_dir, title, author, index + 1)
+
+    if checkpoint.completed:
+        logging.info(
+            f"Resuming {title}, {len(checkpoint.completed)}/{len(chunks)} chunks already summarized"
+        )
+
+    if mode == "map_reduce":
+        return _process_chunks_map_reduce(
+            chunks,
+            title,
+            author,
+            book_dir,
+            manager,
+            progress_callback,
+            max_workers,
+            fan_in,
+            stop_event,
+            retry_budget,
+            checkpoint,
+            resumed_summary,
+        )
+
     logging.info(f"Processing {len(chunks)} chunks...")
     chunk_summaries = []
     previous_summaries = ""
+    context = (
+        RollingContext(manager, retry_budget=retry_budget, **rolling_context)
+        if rolling_context
+        else None
+    )
     error_flag = False
 
     total_steps = len(chunks) + 1  # Include final summary as a step
 
     # Processing each chunk
-    for i, chunk in enumerate(tqdm(chunks, desc="Summarizing chunks")):
-        logging.info(f"\nProcessing chunk {i+1}/{len(chunks)}")
+    for i in tqdm(range(len(chunks)), desc="Summarizing chunks"):
+        if stop_event and stop_event.is_set():
+            error_flag = True
+            logging.error(f"Stopped processing {title} at chunk {i + 1}")
+            break
 
-        # Summarize the chunk, passing previous summaries
-        summary = manager.summarize_chunk(chunk, previous_summaries)
+        summary = resumed_summary(i)
+        resumed = summary is not None
+        if not resumed:
+            logging.info(f"\nProcessing chunk {i+1}/{len(chunks)}")
+
+            # Summarize the chunk, passing previous summaries
+            if context:
+                previous_summaries = context.render()
+            summary = manager.summarize_chunk(chunks[i], previous_summaries, retry_budget)
 
         if summary:
             chunk_summaries.append(summary)
-            save_chunk_summary(book_dir, title, author, i + 1, summary)
+            if not resumed:
+                save_chunk_summary(book_dir, title, author, i + 1, summary)
+                checkpoint.mark_done(i + 1)
 
             # Append the previous summaries to the current one
-            previous_summaries += "\n\n" + summary
+            if context:
+                context.add(summary)
+            else:
+                previous_summaries += "\n\n" + summary
 
             # Call the progress callback after the chunk is successfully summarized
             if progress_callback:
-                progress_callback(i + 1, total_steps)
+                if resumed:
+                    progress_callback(i + 1, total_steps, resumed=True)
+                else:
+                    progress_callback(i + 1, total_steps)
         else:
             error_flag = True
             logging.error(f"Failed to summarize chunk {i + 1} of {title}")
             break
 
     if not error_flag:
-        final_summary = manager.create_final_summary(
-            "\n\n".join(chunk_summaries), title, author
+        final_summary = reduce_summaries(
+            manager, chunk_summaries, title, author, retry_budget, fan_in
         )
         if final_summary:
             # Call the progress callback for the final summary
@@ -384,3 +590,124 @@ def process_chunks(
     else:
         logging.error(f"Aborting {title} due to errors during chunk summarization.")
         return None
+
+
+def _process_chunks_map_reduce(
+    chunks,
+    title,
+    author,
+    book_dir,
+    manager,
+    progress_callback,
+    max_workers,
+    fan_in,
+    stop_event,
+    retry_budget,
+    checkpoint,
+    resumed_summary,
+) -> Optional[str]:
+    use_async = hasattr(manager, "map_concurrently")
+    logging.info(
+        f"Processing {len(chunks)} chunks with up to {max_workers} parallel requests..."
+    )
+    total_steps = len(chunks) + count_reduce_steps(len(chunks), fan_in)
+    completed_steps = 0
+    progress_lock = threading.Lock()
+
+    def step_done(resumed=False):
+        nonlocal completed_steps
+        with progress_lock:
+            completed_steps += 1
+            if progress_callback:
+                if resumed:
+                    progress_callback(completed_steps, total_steps, resumed=True)
+                else:
+                    progress_callback(completed_steps, total_steps)
+
+    def resumed_or_skipped(index):
+        """The summary of a chunk needing no request: read back, or "" once stopped."""
+        summary = resumed_summary(index)
+        if summary is not None:
+            step_done(resumed=True)
+            return summary
+        if stop_event and stop_event.is_set():
+            return ""
+        return None
+
+    def record(index, summary):
+        if summary:
+            save_chunk_summary(book_dir, title, author, index + 1, summary)
+            checkpoint.mark_done(index + 1)
+            step_done()
+        else:
+            logging.error(f"Failed to summarize chunk {index + 1} of {title}")
+        return summary
+
+    def summarize(index):
+        summary = resumed_or_skipped(index)
+        if summary is not None:
+            return summary
+        return record(index, manager.summarize_chunk(chunks[index], "", retry_budget))
+
+    async def summarize_async(index):
+        # File access stays off the event loop the requests share
+        summary = await asyncio.to_thread(resumed_or_skipped, index)
+        if summary is not None:
+            return summary
+        content = await asyncio.to_thread(chunks.__getitem__, index)
+        summary = await manager.manager.summarize_chunk(content, "", retry_budget)
+        return await asyncio.to_thread(record, index, summary)
+
+    def merge(group):
+        if len(group) == 1:
+            return group[0]
+        if stop_event and stop_event.is_set():
+            return ""
+        summary = manager.create_final_summary(
+            "\n\n".join(group), title, author, retry_budget
+        )
+        if summary:
+            step_done()
+        return summary
+
+    async def merge_async(group):
+        if len(group) == 1:
+            return group[0]
+        if stop_event and stop_event.is_set():
+            return ""
+        summary = await manager.manager.create_final_summary(
+            "\n\n".join(group), title, author, retry_budget
+        )
+        if summary:
+            await asyncio.to_thread(step_done)
+        return summary
+
+    # Async managers keep a whole level in flight on their event loop,
+    # sync ones get a thread per request
+    executor = None if use_async else ThreadPoolExecutor(max_workers=max_workers)
+
+    def run_level(request, request_async, items):
+        if executor is None:
+            return manager.map_concurrently(request_async, items, max_workers)
+        return list(executor.map(request, items))
+
+    try:
+        summaries = run_level(summarize, summarize_async, range(len(chunks)))
+        if not all(summaries):
+            logging.error(f"Aborting {title} due to errors during chunk summarization.")
+            return None
+
+        # Tree reduction, the last level merges everything into the final summary
+        while len(summaries) > 1:
+            groups = [
+                summaries[i : i + fan_in] for i in range(0, len(summaries), fan_in)
+            ]
+            summaries = run_level(merge, merge_async, groups)
+            if not all(summaries):
+                logging.error(f"Failed to create final summary for {title}")
+                return None
+    finally:
+        if executor:
+            executor.shutdown()
+
+    return summaries[0]